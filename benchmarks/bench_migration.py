@@ -0,0 +1,225 @@
+"""
+端到端迁移基准
+
+在本地启动图片服务（可注入延迟和错误）以及限速的 SM.MS / COS 替身，
+生成合成语料后分别以三种方式运行迁移，报告吞吐量、各阶段延迟分位数和峰值内存：
+
+    file      逐个文件调用 MarkdownImageDownloader.process_markdown_file
+    pipeline  一次性调用 process_markdown_files
+    main      调用 main.main（仅支持 SM.MS）
+
+每种方式在独立的子进程中运行，使用全新的语料副本和图片目录，峰值内存互不影响。
+
+用法：
+    python -m benchmarks.bench_migration --notes 200 --images 600 --latency-ms 5 50
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.rate_limiter import RateLimit
+from .corpus import generate_corpus
+from .fake_servers import FakeCOSServer, FakeSMMSServer, ImageServer
+
+MODES = ("file", "pipeline", "main")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB），不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(all_results: Dict[str, Dict[str, List[Dict]]]) -> Dict:
+    """按URL去重后汇总各阶段耗时"""
+    per_url: Dict[str, Dict] = {}
+    for results in all_results.values():
+        for item in results["success"] + results["failed"]:
+            if item.get("url"):
+                per_url[item["url"]] = item
+    stages: Dict[str, List[float]] = {}
+    for item in per_url.values():
+        for stage, seconds in item.get("timings", {}).items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "images": len(per_url),
+        "failed": sum(1 for item in per_url.values() if item.get("error")),
+        "stages": {
+            stage: {
+                "p50_ms": percentile(values, 50) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+            for stage, values in stages.items()
+        },
+    }
+
+
+def build_uploader(options: Dict):
+    if options["backend"] == "smms":
+        from storage.uploaders.sms_uploader import SMSUploader
+        uploader = SMSUploader("bench-token", upload_url=options["upload_url"])
+    else:
+        from storage.uploaders.tencent_cos import TencentCOSUploader
+        uploader = TencentCOSUploader(
+            "id", "key", "ap-shanghai", "bench-1250000000",
+            domain=options["cos_domain"], scheme="http",
+            custom_url=f"http://{options['cos_domain']}"
+        )
+    uploader.rate_limits = (RateLimit(options["upload_rate"], 1.0),)
+    return uploader
+
+
+def run_worker(options: Dict) -> Dict:
+    """在子进程中执行一种运行方式并返回报告"""
+    from markdown.image_downloader import MarkdownImageDownloader
+
+    notes = sorted(str(path) for path in Path(options["corpus"]).glob("*.md"))
+    start = time.perf_counter()
+    if options["mode"] == "main":
+        import logging
+        import main as cli
+        from storage.uploaders.sms_uploader import SMSUploader
+
+        logging.getLogger("utils.logger").setLevel(logging.WARNING)
+        os.environ["SMS_API_TOKEN"] = "bench-token"
+        os.environ["SMS_UPLOAD_URL"] = options["upload_url"]
+        # 替身服务按 upload_rate 限速，客户端保持一致
+        SMSUploader.rate_limits = (RateLimit(options["upload_rate"], 1.0),)
+        all_results = cli.main(["--markdown-dir", options["corpus"], "--save-dir", options["save_dir"]])
+    else:
+        downloader = MarkdownImageDownloader(
+            options["save_dir"], build_uploader(options),
+            download_workers=options["download_workers"],
+            upload_workers=options["upload_workers"]
+        )
+        if options["mode"] == "file":
+            all_results = {note: downloader.process_markdown_file(note) for note in notes}
+        else:
+            all_results = downloader.process_markdown_files(notes)
+    elapsed = time.perf_counter() - start
+
+    report = summarize(all_results or {})
+    report.update({
+        "mode": options["mode"],
+        "seconds": elapsed,
+        "images_per_sec": report["images"] / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    })
+    return report
+
+
+def print_report(report: Dict, servers: Dict[str, Dict[str, int]]):
+    rss = report["peak_rss_mb"]
+    rss_text = f"{rss:.1f} MB" if rss is not None else "未知"
+    print(f"[{report['mode']}] {report['images']} 张图片 / {report['seconds']:.2f} s = "
+          f"{report['images_per_sec']:.1f} 张/s，失败 {report['failed']}，峰值内存 {rss_text}")
+    for stage, stats in report["stages"].items():
+        print(f"    {stage:>10}: p50 {stats['p50_ms']:8.1f} ms   p99 {stats['p99_ms']:8.1f} ms")
+    for name, stats in servers.items():
+        print(f"    {name:>10}: {stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端迁移基准")
+    parser.add_argument("--notes", type=int, default=100, help="笔记数量")
+    parser.add_argument("--images", type=int, default=300, help="唯一图片URL数量")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="内容重复的URL比例")
+    parser.add_argument("--shared-ratio", type=float, default=0.2, help="跨笔记共享引用的比例")
+    parser.add_argument("--median-kb", type=float, default=64, help="图片大小中位数（KB）")
+    parser.add_argument("--max-kb", type=float, default=2048, help="图片大小上限（KB）")
+    parser.add_argument("--latency-ms", type=float, nargs=2, default=(5, 50),
+                        metavar=("MIN", "MAX"), help="图片服务的延迟区间（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="图片服务返回 500 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="图片服务返回 429 的比例")
+    parser.add_argument("--backend", choices=("smms", "cos"), default="smms", help="上传目标")
+    parser.add_argument("--upload-rate", type=int, default=50, help="上传替身每秒允许的请求数")
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--upload-workers", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="同时把报告写入该 JSON 文件")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix="pic-migrate-bench-"))
+    limits = (RateLimit(args.upload_rate, 1.0),)
+    image_server = ImageServer({}, latency=(args.latency_ms[0] / 1000, args.latency_ms[1] / 1000),
+                               error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                               seed=args.seed)
+    upload_server = FakeSMMSServer(limits) if args.backend == "smms" else FakeCOSServer(limits)
+    reports = []
+    try:
+        with image_server, upload_server:
+            corpus = generate_corpus(
+                str(workdir / "corpus"), image_server.images_url, notes=args.notes,
+                images=args.images, duplicate_ratio=args.duplicate_ratio,
+                shared_ratio=args.shared_ratio, median_kb=args.median_kb,
+                max_kb=args.max_kb, seed=args.seed
+            )
+            image_server.images = corpus.images
+            print(f"语料: {len(corpus.notes)} 篇笔记，{len(corpus.images)} 个图片URL，"
+                  f"{corpus.references} 处引用，{corpus.total_bytes / 1024 / 1024:.1f} MB")
+
+            for mode in args.modes:
+                if mode == "main" and args.backend != "smms":
+                    print("[main] main.py 只支持 SM.MS，跳过")
+                    continue
+                # 每种方式使用全新的语料副本、图片目录和空的上传替身
+                upload_server.reset()
+                run_dir = workdir / mode
+                shutil.copytree(corpus.root, run_dir / "corpus")
+                options = {
+                    "mode": mode,
+                    "backend": args.backend,
+                    "corpus": str(run_dir / "corpus"),
+                    "save_dir": str(run_dir / "images"),
+                    "upload_url": getattr(upload_server, "upload_url", ""),
+                    "cos_domain": getattr(upload_server, "domain", ""),
+                    "upload_rate": args.upload_rate,
+                    "download_workers": args.download_workers,
+                    "upload_workers": args.upload_workers,
+                }
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_migration", "--worker", json.dumps(options)],
+                    capture_output=True, text=True, check=True
+                ).stdout
+                report = json.loads(output.strip().splitlines()[-1])
+                servers = {"images": image_server.reset_stats(), "upload": upload_server.reset_stats()}
+                report["servers"] = servers
+                reports.append(report)
+                print_report(report, servers)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(reports, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
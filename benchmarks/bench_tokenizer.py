@@ -0,0 +1,98 @@
+"""
+图片分词器微基准
+
+生成不同大小的 Markdown 文档，比较分词器与原先两条正则的吞吐量，
+并验证分词器的耗时随文档大小线性增长；最后用一行未闭合的图片语法
+演示原先的惰性正则在病态输入下的超线性退化。
+
+用法：
+    python -m benchmarks.bench_tokenizer --size-mb 8 --repeat 3
+"""
+import argparse
+import random
+import re
+import time
+
+from markdown.tokenizer import find_image_refs
+
+# 分词器替换之前 extract_images 使用的正则
+_LEGACY_MD = re.compile(r'!\[.*?\]\((.*?)\)')
+_LEGACY_HTML = re.compile(r'<img.*?src=["\'](.*?)["\'].*?>')
+
+_BLOCKS = (
+    "普通的段落文本，包含一些 [链接](https://example.com/page) 和 **强调**。\n",
+    "![截图 {i}](https://img.example.com/shots/{i}.png)\n",
+    '![带标题 {i}](https://img.example.com/t/{i}.jpg "标题")\n',
+    '<img src="https://img.example.com/html/{i}.gif" width="300">\n',
+    "![引用 {i}][ref{i}]\n\n[ref{i}]: https://img.example.com/ref/{i}.webp\n",
+    "```python\nprint('![not an image](https://example.com/x.png)')\n```\n",
+    "- 列表项 `code` 以及 ![行内](https://img.example.com/li/{i}.png) 图片\n",
+)
+
+
+def generate_document(size_mb: float, seed: int = 0) -> str:
+    """生成指定大小的Markdown文档"""
+    rng = random.Random(seed)
+    target = int(size_mb * 1024 * 1024)
+    parts = []
+    size = 0
+    i = 0
+    while size < target:
+        block = rng.choice(_BLOCKS).format(i=i)
+        parts.append(block)
+        size += len(block.encode('utf-8'))
+        i += 1
+    return ''.join(parts)
+
+
+def legacy_extract(content: str):
+    return _LEGACY_MD.findall(content) + _LEGACY_HTML.findall(content)
+
+
+def measure(func, content: str, repeat: int):
+    """返回 (最佳耗时秒数, 结果数量)"""
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(func(content))
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def pathological_line(repeats: int) -> str:
+    """一行大量未闭合的图片语法，惰性正则会在每个起点反复回溯到行尾"""
+    return "![a](b " * repeats + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片分词器微基准")
+    parser.add_argument("--size-mb", type=float, default=8.0, help="最大文档大小（MB）")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数，取最佳值")
+    args = parser.parse_args()
+
+    funcs = (("tokenizer", find_image_refs), ("legacy-regex", legacy_extract))
+    size = args.size_mb
+    sizes = []
+    while size >= 1 and len(sizes) < 4:
+        sizes.insert(0, size)
+        size /= 2
+
+    for target in sizes:
+        content = generate_document(target)
+        size_mb = len(content.encode('utf-8')) / 1024 / 1024
+        print(f"文档大小: {size_mb:.1f} MB")
+        for name, func in funcs:
+            elapsed, count = measure(func, content, args.repeat)
+            print(f"{name:>14}: {elapsed * 1000:8.1f} ms  {size_mb / elapsed:8.1f} MB/s  {count} 个引用")
+
+    print("病态输入（单行未闭合的图片语法）:")
+    for repeats in (100, 200, 400):
+        content = pathological_line(repeats)
+        for name, func in funcs:
+            elapsed, _ = measure(func, content, 1)
+            print(f"{name:>14}: {repeats:5d} 次重复 {elapsed * 1000:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+合成语料生成器
+
+生成 N 篇笔记、M 个图片URL，可配置内容重复比例（不同URL返回相同字节）、
+跨笔记共享引用的比例以及图片大小分布。图片是可以被解码的最小 PNG，
+通过一个私有的辅助数据块补足到目标大小。
+"""
+import random
+import struct
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_FILLER = (
+    "普通的段落文本，包含一些 [链接](https://example.com/page) 和 **强调**。\n",
+    "- 列表项 `code` 以及一些说明文字\n",
+    "```python\nprint('![not an image](https://example.com/x.png)')\n```\n",
+    "> 引用的一段话。\n",
+)
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def make_png(size: int, seed: int) -> bytes:
+    """
+    生成约 size 字节、可被解码的 1x1 PNG
+    :param size: 目标字节数
+    :param seed: 决定填充内容，不同 seed 得到不同的字节
+    """
+    ihdr = _chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+    idat = _chunk(b"IDAT", zlib.compress(b"\x00\xff\x00\x00"))
+    iend = _chunk(b"IEND", b"")
+    fixed = len(_PNG_SIGNATURE) + len(ihdr) + len(idat) + len(iend) + 12
+    padding = random.Random(seed).randbytes(max(8, size - fixed))
+    # 首字母小写的块类型为辅助块，解码器会忽略
+    return _PNG_SIGNATURE + ihdr + _chunk(b"pdDg", padding) + idat + iend
+
+
+@dataclass
+class Corpus:
+    """生成的语料"""
+    root: Path
+    notes: List[Path] = field(default_factory=list)
+    # 图片路径（相对图片服务根路径）-> 内容
+    images: Dict[str, bytes] = field(default_factory=dict)
+    references: int = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(len(data) for data in self.images.values())
+
+
+def generate_corpus(root: str, base_url: str, notes: int = 100, images: int = 300,
+                    duplicate_ratio: float = 0.1, shared_ratio: float = 0.2,
+                    median_kb: float = 64, max_kb: float = 2048, seed: int = 0) -> Corpus:
+    """
+    生成笔记并返回图片内容，图片由本地图片服务提供
+    :param root: 笔记写入的目录
+    :param base_url: 图片服务的根URL，例如 http://127.0.0.1:8000/images
+    :param notes: 笔记数量
+    :param images: 唯一图片URL数量
+    :param duplicate_ratio: 与之前某张图片字节完全相同的URL比例
+    :param shared_ratio: 额外引用其他笔记中已出现图片的引用比例
+    :param median_kb: 图片大小（对数正态分布）的中位数
+    :param max_kb: 图片大小上限
+    :param seed: 随机种子，相同参数生成相同的语料
+    """
+    rng = random.Random(seed)
+    corpus = Corpus(root=Path(root))
+    corpus.root.mkdir(parents=True, exist_ok=True)
+
+    names: List[str] = []
+    unique: List[bytes] = []
+    for i in range(images):
+        name = f"{i:06d}.png"
+        if unique and rng.random() < duplicate_ratio:
+            data = rng.choice(unique)
+        else:
+            size = int(min(max_kb, rng.lognormvariate(0, 1) * median_kb) * 1024)
+            data = make_png(size, seed * 1_000_003 + i)
+            unique.append(data)
+        corpus.images[name] = data
+        names.append(name)
+
+    # 每张图片至少出现在一篇笔记中，再按比例追加跨笔记的共享引用
+    assigned: List[List[str]] = [[] for _ in range(max(1, notes))]
+    for i, name in enumerate(names):
+        assigned[i % len(assigned)].append(name)
+    extra = int(images * shared_ratio)
+    for _ in range(extra):
+        assigned[rng.randrange(len(assigned))].append(rng.choice(names))
+
+    for index, note_images in enumerate(assigned):
+        lines = [f"# 笔记 {index}\n\n"]
+        for j, name in enumerate(note_images):
+            lines.append(rng.choice(_FILLER))
+            url = f"{base_url}/{name}"
+            style = rng.random()
+            if style < 0.7:
+                lines.append(f"![图片 {j}]({url})\n")
+            elif style < 0.85:
+                lines.append(f'<img src="{url}" width="300">\n')
+            else:
+                lines.append(f"![图片 {j}][img{j}]\n\n[img{j}]: {url}\n")
+            corpus.references += 1
+        path = corpus.root / f"note-{index:05d}.md"
+        path.write_text("".join(lines), encoding="utf-8")
+        corpus.notes.append(path)
+    return corpus
@@ -0,0 +1,284 @@
+"""
+本地替身服务
+
+- ImageServer：提供图片的 HTTP 服务，可注入延迟和错误
+- FakeSMMSServer：兼容 SM.MS /api/v2/upload 的上传接口，按配置限速并识别重复图片
+- FakeCOSServer：接受 COS 简单上传（PUT/HEAD）的对象存储，按配置限速
+
+均在后台线程中运行 ThreadingHTTPServer，只监听 127.0.0.1。
+"""
+import email
+import email.policy
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from utils.image_types import sniff_extension
+from utils.rate_limiter import RateLimit, RateLimiter
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.owner.handle(self, "GET")
+
+    def do_HEAD(self):
+        self.server.owner.handle(self, "HEAD")
+
+    def do_PUT(self):
+        self.server.owner.handle(self, "PUT")
+
+    def do_POST(self):
+        self.server.owner.handle(self, "POST")
+
+
+class LocalServer:
+    """在后台线程中运行的本地 HTTP 服务"""
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.stats: Counter = Counter()
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def reset_stats(self) -> Dict[str, int]:
+        """返回并清空请求统计"""
+        with self._stats_lock:
+            stats, self.stats = dict(self.stats), Counter()
+        return stats
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def handle(self, request: BaseHTTPRequestHandler, method: str):
+        raise NotImplementedError
+
+    @staticmethod
+    def read_body(request: BaseHTTPRequestHandler) -> bytes:
+        length = int(request.headers.get("Content-Length") or 0)
+        return request.rfile.read(length) if length else b""
+
+    @staticmethod
+    def respond(request: BaseHTTPRequestHandler, status: int, body: bytes = b"",
+                headers: Optional[Dict[str, str]] = None, head_only: bool = False):
+        request.send_response(status)
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        if body and not head_only:
+            request.wfile.write(body)
+
+    def respond_json(self, request: BaseHTTPRequestHandler, status: int, payload: dict):
+        self.respond(request, status, json.dumps(payload).encode(),
+                     {"Content-Type": "application/json"})
+
+
+class ImageServer(LocalServer):
+    """
+    提供图片的本地服务
+    :param images: 图片路径 -> 内容，访问 /images/<路径>
+    :param latency: 每个请求的延迟区间（秒），在区间内均匀分布
+    :param error_rate: 返回 500 的请求比例
+    :param throttle_rate: 返回 429（带 Retry-After）的请求比例
+    """
+
+    def __init__(self, images: Dict[str, bytes], latency: Tuple[float, float] = (0.0, 0.0),
+                 error_rate: float = 0.0, throttle_rate: float = 0.0, seed: int = 0):
+        super().__init__()
+        self.images = images
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @property
+    def images_url(self) -> str:
+        return f"{self.base_url}/images"
+
+    def handle(self, request, method):
+        with self._rng_lock:
+            delay = self._rng.uniform(*self.latency)
+            roll = self._rng.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            self.count("500")
+            return self.respond(request, 500, b"injected error")
+        if roll < self.error_rate + self.throttle_rate:
+            self.count("429")
+            return self.respond(request, 429, b"slow down", {"Retry-After": "1"})
+
+        name = unquote(urlparse(request.path).path).rsplit("/images/", 1)[-1]
+        data = self.images.get(name)
+        if data is None:
+            self.count("404")
+            return self.respond(request, 404, b"not found")
+        self.count("200")
+        self.respond(request, 200, data, {"Content-Type": "image/png"},
+                     head_only=method == "HEAD")
+
+
+class FakeSMMSServer(LocalServer):
+    """
+    SM.MS 上传接口替身：POST /api/v2/upload，字段 smfile
+    :param rate_limits: 服务端强制执行的限速，超出时返回 429
+    :param max_file_size: 单个文件的最大字节数
+    """
+
+    def __init__(self, rate_limits: Iterable[RateLimit] = (),
+                 max_file_size: int = 5 * 1024 * 1024):
+        super().__init__()
+        self.limiter = RateLimiter(rate_limits)
+        self.max_file_size = max_file_size
+        # 内容摘要 -> 已上传的URL
+        self.stored: Dict[str, str] = {}
+        self.blobs: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """清空已上传的图片和限速记录"""
+        with self._lock:
+            self.stored.clear()
+            self.blobs.clear()
+        self.limiter = RateLimiter(self.limiter.limits)
+
+    @property
+    def upload_url(self) -> str:
+        return f"{self.base_url}/api/v2/upload"
+
+    def handle(self, request, method):
+        path = urlparse(request.path).path
+        if method == "GET" and path.startswith("/i/"):
+            data = self.blobs.get(path[3:])
+            return self.respond(request, 200 if data else 404, data or b"")
+        if method != "POST" or path != "/api/v2/upload":
+            return self.respond(request, 404)
+
+        body = self.read_body(request)
+        if not self.limiter.try_acquire():
+            self.count("429")
+            return self.respond_json(request, 429, {
+                "success": False, "code": "flood", "message": "Upload rate limit exceeded"
+            })
+        data = self._extract_file(request.headers.get("Content-Type", ""), body)
+        if data is None:
+            self.count("400")
+            return self.respond_json(request, 400, {
+                "success": False, "code": "no_file", "message": "No files were uploaded."
+            })
+        if len(data) > self.max_file_size:
+            self.count("413")
+            return self.respond_json(request, 200, {
+                "success": False, "code": "file_too_large", "message": "File is too large."
+            })
+
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            existing = self.stored.get(digest)
+            if existing is None:
+                name = f"{digest[:16]}{sniff_extension(data[:16]) or '.jpg'}"
+                self.stored[digest] = f"{self.base_url}/i/{name}"
+                self.blobs[name] = data
+        if existing:
+            self.count("repeated")
+            return self.respond_json(request, 200, {
+                "success": False, "code": "image_repeated",
+                "message": f"Image upload repeated limit, this image exists at: {existing}",
+                "images": existing,
+            })
+        self.count("200")
+        return self.respond_json(request, 200, {
+            "success": True, "code": "success", "data": {"url": self.stored[digest]}
+        })
+
+    @staticmethod
+    def _extract_file(content_type: str, body: bytes) -> Optional[bytes]:
+        """从 multipart/form-data 请求体中取出 smfile 字段"""
+        message = email.message_from_bytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body,
+            policy=email.policy.HTTP
+        )
+        if not message.is_multipart():
+            return None
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "smfile":
+                return part.get_payload(decode=True)
+        return None
+
+
+class FakeCOSServer(LocalServer):
+    """
+    COS 简单上传替身：PUT /<key> 保存对象，HEAD/GET /<key> 读取
+    :param rate_limits: 服务端强制执行的限速，超出时返回 503 SlowDown
+    """
+
+    def __init__(self, rate_limits: Iterable[RateLimit] = ()):
+        super().__init__()
+        self.limiter = RateLimiter(rate_limits)
+        self.objects: Dict[str, bytes] = {}
+
+    def reset(self):
+        """清空已上传的对象和限速记录"""
+        self.objects.clear()
+        self.limiter = RateLimiter(self.limiter.limits)
+
+    @property
+    def domain(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def handle(self, request, method):
+        key = unquote(urlparse(request.path).path).lstrip("/")
+        if method == "PUT":
+            body = self.read_body(request)
+            if not self.limiter.try_acquire():
+                self.count("503")
+                return self.respond(request, 503, (
+                    b"<?xml version='1.0' encoding='utf-8' ?><Error><Code>SlowDown</Code>"
+                    b"<Message>Please reduce your request rate.</Message></Error>"
+                ), {"Content-Type": "application/xml"})
+            self.objects[key] = body
+            self.count("200")
+            etag = hashlib.md5(body).hexdigest()
+            return self.respond(request, 200, headers={"ETag": f'"{etag}"'})
+        if method in ("GET", "HEAD"):
+            data = self.objects.get(key)
+            if data is None:
+                return self.respond(request, 404, head_only=method == "HEAD")
+            return self.respond(request, 200, data, head_only=method == "HEAD")
+        return self.respond(request, 501)
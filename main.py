@@ -1,39 +1,116 @@
 from pathlib import Path
+import argparse
+import multiprocessing
 import os
+import socket
 from dotenv import load_dotenv
 from utils.logger import logger  # 修改这里
+from storage.uploaders.router import ROUTE_ORDERED, ROUTE_WEIGHTED, UploaderRouter
 from storage.uploaders.sms_uploader import SMSUploader
 from markdown.image_downloader import MarkdownImageDownloader
+from markdown.scanner import MarkdownScanner
+from markdown.sharding import ShardedMigration, collect_shard_results
+from markdown.watcher import MarkdownWatcher
+from storage.image_optimizer import ImageOptimizer, OptimizeOptions
+from storage.image_verifier import ImageVerifier
+from storage.manifest import MigrationManifest
+from utils.metrics import MetricsReporter, metrics
 
 # 加载环境变量
 load_dotenv()
 
-def main():
-    # 配置路径
-    markdown_dir = Path("C:\\Users\\tianyi\\WebstormProjects\\tackle_challenge\\docs")  # 你的markdown文件所在目录
-    # markdown_dir = Path("D:\\file_repo\\obsidian")  # 你的markdown文件所在目录
-    save_dir = Path("./tests/20250322")  # 图片保存目录
-    uploader = SMSUploader(api_token=os.getenv('SMS_API_TOKEN'))
+# 默认路径
+DEFAULT_MARKDOWN_DIR = "C:\\Users\\tianyi\\WebstormProjects\\tackle_challenge\\docs"  # 你的markdown文件所在目录
+# DEFAULT_MARKDOWN_DIR = "D:\\file_repo\\obsidian"  # 你的markdown文件所在目录
+DEFAULT_SAVE_DIR = "./tests/20250322"  # 图片保存目录
 
-    # 创建下载器实例
-    downloader = MarkdownImageDownloader(str(save_dir), uploader)
 
-    # 获取所有md文件
-    md_files = list(markdown_dir.glob("**/*.md"))
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="迁移 Markdown 文档中的图片到图床")
+    parser.add_argument("--markdown-dir", default=DEFAULT_MARKDOWN_DIR, help="Markdown 文件所在目录")
+    parser.add_argument("--save-dir", default=DEFAULT_SAVE_DIR, help="图片保存目录")
+    parser.add_argument("--watch", action="store_true",
+                        help="监听模式：持续运行，启动时和文件保存后迁移尚未迁移的图片")
+    parser.add_argument("--debounce", type=float, default=1.0,
+                        help="监听模式下文件停止变化多少秒后再处理")
+    parser.add_argument("--poll-interval", type=float, default=2.0,
+                        help="未安装 watchdog 时轮询目录的间隔秒数")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="只输出计划的URL映射和每个文件的改动统计，不下载、不上传、不修改文件")
+    parser.add_argument("--revalidate", action="store_true",
+                        help="用条件请求（ETag / Last-Modified）确认已下载的源图片是否变化")
+    parser.add_argument("--deep-verify", action="store_true",
+                        help="上传前在进程池中完整解码每张图片，拒绝损坏的文件（需要 Pillow）")
+    parser.add_argument("--optimize", action="store_true",
+                        help="上传前优化图片：去除 EXIF 并重新压缩 PNG/JPEG（需要 Pillow）；"
+                             "指定下面任一优化参数时自动启用")
+    parser.add_argument("--webp", action="store_true", help="优化时把 PNG/JPEG 转换为 WebP")
+    parser.add_argument("--quality", type=int,
+                        help="JPEG/WebP 的压缩质量（1-100），默认尽量无损")
+    parser.add_argument("--max-dimension", type=int,
+                        help="优化时把最长边缩小到指定像素以内")
+    parser.add_argument("--max-size-kb", type=float,
+                        help="优化后图片的最大体积（KB），超过时逐步缩小尺寸")
+    parser.add_argument("--stream", action="store_true",
+                        help="直通模式：图片下载到内存缓冲区后直接上传，不保存到图片目录")
+    parser.add_argument("--cache-size-mb", type=float,
+                        help="图片目录的容量上限（MB），超出时按最近最少使用的顺序删除已上传的图片")
+    parser.add_argument("--cache-max-days", type=float,
+                        help="删除超过指定天数未使用的已上传图片")
+    parser.add_argument("--backends", nargs="+", choices=("sms", "cos"),
+                        default=os.getenv("UPLOAD_TYPE", "sms").split(","),
+                        help="上传后端，按优先级排列；多个后端时某个配额耗尽后自动使用其他后端")
+    parser.add_argument("--routing", choices=(ROUTE_ORDERED, ROUTE_WEIGHTED), default=ROUTE_ORDERED,
+                        help="多个后端的分配方式：ordered 优先使用前面的后端，weighted 按权重分配")
+    parser.add_argument("--weights", type=float, nargs="+",
+                        help="weighted 分配时各后端的权重，顺序与 --backends 一致")
+    parser.add_argument("--upload-workers", type=int,
+                        help="上传线程数，默认为各上传后端允许的并发数之和")
+    parser.add_argument("--shard-dir",
+                        help="分片模式：多个进程（可以在不同主机上）通过这个共享目录中的租约分工迁移")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="分片模式下在本机启动的工作进程数")
+    parser.add_argument("--worker-id", default=socket.gethostname(),
+                        help="工作进程名称，在所有主机中唯一；本机启动多个进程时自动加上序号")
+    parser.add_argument("--total-workers", type=int,
+                        help="所有主机上的工作进程总数，用于平分上传配额，默认等于 --workers")
+    parser.add_argument("--shards", type=int, default=16,
+                        help="分片数，应明显大于进程总数以便均衡负载；以第一个开始的进程为准")
+    parser.add_argument("--lease-ttl", type=float, default=60.0,
+                        help="分片租约的有效期（秒），进程崩溃后其分片在这段时间后被其他进程接管")
+    parser.add_argument("--metrics-json", help="运行指标的 JSON 摘要输出路径")
+    parser.add_argument("--metrics-prom", help="运行指标的 Prometheus 文本输出路径")
+    parser.add_argument("--metrics-interval", type=float, default=0,
+                        help="定期写出指标的间隔秒数，0 表示只在运行结束时写出")
+    args = parser.parse_args(argv)
+    if args.dry_run and args.watch:
+        parser.error("--dry-run 不能与 --watch 同时使用")
+    if args.dry_run and args.revalidate:
+        # 重新确认会发送请求并更新迁移清单和本地副本，与 dry-run 不做任何修改的约定冲突
+        parser.error("--dry-run 不能与 --revalidate 同时使用")
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        parser.error("--quality 必须在 1 到 100 之间")
+    args.optimize = args.optimize or bool(args.webp or args.quality or args.max_dimension
+                                          or args.max_size_kb)
+    if args.stream and args.deep_verify:
+        parser.error("--stream 不能与 --deep-verify 同时使用")
+    if args.stream and args.optimize:
+        parser.error("--stream 不能与图片优化同时使用")
+    if args.shard_dir and (args.watch or args.dry_run):
+        parser.error("--shard-dir 不能与 --watch 或 --dry-run 同时使用")
+    if args.upload_workers is not None and args.upload_workers < 1:
+        parser.error("--upload-workers 必须大于 0")
+    if args.workers > 1 and not args.shard_dir:
+        parser.error("--workers 需要同时指定 --shard-dir")
+    return args
 
-    if not md_files:
-        logger.warning(f"在 {markdown_dir} 目录下没有找到markdown文件")
-        return
-
-    logger.info(f"找到 {len(md_files)} 个markdown文件")
 
+def log_results(all_results):
+    """逐个文件输出处理结果，返回 (成功数, 失败数)"""
     total_success = 0
     total_failed = 0
-
-    # 处理每个文件
-    for md_file in md_files:
-        logger.info(f"正在处理文件: {md_file}")
-        results = downloader.process_markdown_file(str(md_file))
+    for md_file, results in all_results.items():
+        logger.info(f"文件处理完成: {md_file}")
 
         # 统计结果
         success_count = len(results['success'])
@@ -45,18 +122,204 @@ def main():
         if success_count > 0:
             logger.info(f"成功下载 {success_count} 张图片:")
             for item in results['success']:
-                logger.info(f"  - {item['url']} -> {item['save_path']}")
+                backend = f" [{item['backend']}]" if item.get('backend') else ""
+                logger.info(f"  - {item['url']} -> {item['save_path']}{backend}")
 
         # 输出失败信息
         if failed_count > 0:
             logger.warning(f"下载失败 {failed_count} 张图片:")
             for item in results['failed']:
                 logger.error(f"  - {item['url']}: {item['error']}")
+    return total_success, total_failed
+
+
+def log_dry_run(report):
+    """输出 dry-run 的URL映射和每个文件的改动统计"""
+    logger.info("=== URL 映射 ===")
+    for url, new_url in report.url_mapping.items():
+        logger.info(f"  - {url} -> {new_url or '（待上传）'}")
+    logger.info("=== 文件改动 ===")
+    for md_file, stats in report.files.items():
+        if not stats.references:
+            continue
+        delta = "未知" if stats.bytes_delta is None else f"{stats.bytes_delta:+d} 字节"
+        logger.info(f"  - {md_file}: {stats.references} 处引用，{stats.lines} 行，{delta}")
+    for md_file, error in report.errors.items():
+        logger.error(f"  - {md_file}: {error}")
+    logger.info(f"共 {len(report.url_mapping)} 个URL，其中 {len(report.pending_urls)} 个待上传，"
+                f"涉及 {sum(1 for stats in report.files.values() if stats.references)} 个文件")
+
+
+def log_metrics():
+    """输出各阶段耗时和限速等待的摘要"""
+    summary = metrics.to_dict()
+    for name in ("pipeline_stage_seconds", "download_request_seconds",
+                 "upload_request_seconds", "rate_limiter_wait_seconds"):
+        for value in summary.get(name, {}).get("values", []):
+            labels = ",".join(f"{k}={v}" for k, v in value["labels"].items())
+            logger.info(f"{name}{{{labels}}}: {value['count']} 次，合计 {value['sum']:.2f} s，"
+                        f"p50 {value['p50']:.3f} s，p99 {value['p99']:.3f} s")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    reporter = None
+    if args.metrics_interval > 0 and (args.metrics_json or args.metrics_prom):
+        reporter = MetricsReporter(metrics, args.metrics_interval,
+                                   args.metrics_json, args.metrics_prom).start()
+    try:
+        return run(args)
+    finally:
+        if reporter:
+            reporter.stop()
+        else:
+            metrics.write(args.metrics_json, args.metrics_prom)
+
+
+def build_uploader(args):
+    """按 --backends 创建上传器，多个后端时组合为路由上传器"""
+    backends = []
+    for name in args.backends:
+        if name == "sms":
+            backends.append(SMSUploader(api_token=os.getenv('SMS_API_TOKEN'),
+                                        upload_url=os.getenv('SMS_UPLOAD_URL')))
+        else:
+            from storage.uploaders.tencent_cos import TencentCOSUploader
+            backends.append(TencentCOSUploader.from_config())
+    if len(backends) == 1:
+        return backends[0]
+    return UploaderRouter(backends, weights=args.weights, strategy=args.routing)
+
+
+def build_downloader(args, save_dir: Path, uploader) -> MarkdownImageDownloader:
+    """
+    创建下载器；迁移清单保存在图片目录中，中断后重新运行会跳过已完成的下载和上传。
+    dry-run 时使用只读的下载器和内存中的清单副本，不修改磁盘上的任何文件
+    """
+    manifest = MigrationManifest(str(save_dir / "manifest.db"), read_only=args.dry_run)
+    verifier = ImageVerifier() if args.deep_verify else None
+    if verifier and not verifier.available:
+        logger.warning("未安装 Pillow，跳过深度校验")
+    # 默认按上传器允许的并发数（路由器为各后端之和）启动上传线程，多个后端才能同时上传
+    upload_workers = args.upload_workers or (uploader.max_concurrency if uploader else 1)
+    optimizer = None
+    if args.optimize:
+        options = OptimizeOptions(
+            quality=args.quality,
+            webp=args.webp,
+            max_bytes=int(args.max_size_kb * 1024) if args.max_size_kb else None,
+            max_dimension=args.max_dimension
+        )
+        # 不指定图片存储，由下载器设置为它自己的存储，两者共享字节预算和索引
+        optimizer = ImageOptimizer(options=options, manifest=manifest)
+        if not optimizer.available:
+            logger.warning("未安装 Pillow，跳过图片优化")
+    return MarkdownImageDownloader(str(save_dir), uploader, manifest=manifest, verifier=verifier,
+                                   optimizer=optimizer, stream_through=args.stream,
+                                   upload_workers=upload_workers,
+                                   cache_size=int(args.cache_size_mb * 1024 * 1024) if args.cache_size_mb else None,
+                                   cache_max_age=args.cache_max_days * 86400 if args.cache_max_days else None,
+                                   read_only=args.dry_run)
+
+
+def run_worker(args, worker_id: str):
+    """分片模式下的单个工作进程：领取分片直到所有分片完成"""
+    # 每个进程使用自己的图片目录和迁移清单（SQLite 不适合放在共享的网络文件系统上）
+    save_dir = Path(args.save_dir) / worker_id
+    uploader = build_uploader(args)
+    uploader.share_quota(args.total_workers or args.workers)
+    downloader = build_downloader(args, save_dir, uploader)
+    migration = ShardedMigration(downloader, args.markdown_dir, args.shard_dir, worker_id,
+                                 shards=args.shards, lease_ttl=args.lease_ttl)
+    results = migration.run()
+    total_success, total_failed = log_results(results)
+    logger.info(f"[{worker_id}] 回写 {len(results)} 个文件，成功 {total_success} 张，失败 {total_failed} 张")
+    return results
+
+
+def run_sharded(args):
+    """分片模式：在本机启动 --workers 个工作进程，与其他主机上的进程共同完成迁移"""
+    if args.workers == 1:
+        run_worker(args, args.worker_id)
+    else:
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(args, f"{args.worker_id}-{i}"),
+                                    name=f"{args.worker_id}-{i}")
+            for i in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        for process in processes:
+            if process.exitcode != 0:
+                logger.error(f"工作进程 {process.name} 异常退出（{process.exitcode}），其分片将在租约过期后被接管")
+
+    all_results = collect_shard_results(args.markdown_dir, args.shard_dir)
+    total_success = sum(len(results["success"]) for results in all_results.values())
+    total_failed = sum(len(results["failed"]) for results in all_results.values())
+    logger.info("=== 分片迁移完成 ===")
+    logger.info(f"所有进程共回写 {len(all_results)} 个文件，成功 {total_success} 张，失败 {total_failed} 张")
+    return all_results
+
+
+def run(args):
+    """执行一次迁移，或进入监听模式"""
+    if args.shard_dir:
+        return run_sharded(args)
+    markdown_dir = Path(args.markdown_dir)
+    save_dir = Path(args.save_dir)
+    uploader = build_uploader(args)
+    downloader = build_downloader(args, save_dir, uploader)
+
+    if args.watch:
+        watcher = MarkdownWatcher(
+            downloader, str(markdown_dir),
+            debounce=args.debounce, poll_interval=args.poll_interval, on_result=log_results
+        )
+        logger.info(f"开始监听 {markdown_dir}，按 Ctrl+C 退出")
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.stop()
+        return
+
+    if args.revalidate:
+        # 先确认已下载的源图片是否变化：未变化的只收到 304，之后的迁移直接使用本地副本
+        summary = downloader.revalidate_sources()
+        logger.info(f"重新确认源图片：未变化 {len(summary['unchanged'])} 张，"
+                    f"已变化 {len(summary['changed'])} 张，失败 {len(summary['failed'])} 张")
+        for url in summary['changed']:
+            logger.info(f"  - 已变化: {url}")
+
+    # 增量扫描：只重新解析上次运行后变化过的文件，跳过图片已全部迁移的文件。
+    # dry-run 时文件索引的更新只写入内存中的清单副本
+    scanner = MarkdownScanner(downloader.manifest, is_migrated=downloader.is_migrated_url)
+    scan = scanner.scan(str(markdown_dir))
+
+    if not scan.total:
+        logger.warning(f"在 {markdown_dir} 目录下没有找到markdown文件")
+        return
+
+    logger.info(f"找到 {scan.total} 个markdown文件，重新解析 {scan.reparsed} 个，"
+                f"待处理 {len(scan.pending)} 个")
+    md_files = scan.pending
+
+    if args.dry_run:
+        report = downloader.plan_markdown_files(str(md_file) for md_file in md_files)
+        log_dry_run(report)
+        return report
+
+    # 通过流水线处理所有文件：上传等待限速时，下载仍会继续进行
+    all_results = downloader.process_markdown_files(str(md_file) for md_file in md_files)
+    total_success, total_failed = log_results(all_results)
 
     # 输出总结
     logger.info("=== 下载完成 ===")
     logger.info(f"总成功: {total_success} 张")
     logger.info(f"总失败: {total_failed} 张")
+    log_metrics()
+    return all_results
 
 
 if __name__ == "__main__":
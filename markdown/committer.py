@@ -0,0 +1,157 @@
+"""
+Markdown 回写的批量提交
+
+流水线处理图片期间只计算每个文件的新内容，全部图片处理完毕后再统一提交：
+先写入同目录下的临时文件，再通过 os.replace 原子替换，进程在写入途中崩溃也不会留下
+写了一半的笔记。内容没有变化的文件直接跳过，多个文件在线程池中并行写入。
+"""
+import os
+import tempfile
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from utils.metrics import metrics
+from .tokenizer import ImageRef
+
+# 提交结果
+COMMIT_WRITTEN = "written"
+COMMIT_UNCHANGED = "unchanged"
+
+
+class ConcurrentModificationError(Exception):
+    """文件在迁移期间被其他程序修改"""
+
+
+@dataclass
+class RewriteStats:
+    """单个文件的改动统计"""
+    # 将被替换的图片引用数
+    references: int = 0
+    # 涉及的行数
+    lines: int = 0
+    # 新旧内容的字节数之差，存在尚未确定的新URL时为 None
+    bytes_delta: Optional[int] = 0
+
+
+@dataclass
+class PendingRewrite:
+    """等待提交的一次文件回写"""
+    key: str
+    path: Path
+    # 规划时读取的原始内容，提交前用于检查文件是否已被修改
+    original: str
+    content: str
+
+    @property
+    def changed(self) -> bool:
+        return self.content != self.original
+
+
+def rewrite_stats(content: str, refs: Iterable[ImageRef],
+                  url_mapping: Dict[str, Optional[str]]) -> RewriteStats:
+    """
+    统计按映射替换后文件的改动
+    :param content: 原始Markdown内容
+    :param refs: 文档中的图片引用位置
+    :param url_mapping: 原始URL到新URL的映射，新URL为 None 表示尚未确定
+    :return: 改动统计
+    """
+    line_starts = [0]
+    line_starts.extend(i + 1 for i, char in enumerate(content) if char == "\n")
+    stats = RewriteStats()
+    lines = set()
+    for ref in refs:
+        if ref.url not in url_mapping:
+            continue
+        stats.references += 1
+        lines.add(bisect_right(line_starts, ref.start))
+        new_url = url_mapping[ref.url]
+        if new_url is None:
+            stats.bytes_delta = None
+        elif stats.bytes_delta is not None:
+            stats.bytes_delta += len(new_url.encode("utf-8")) - len(ref.url.encode("utf-8"))
+    stats.lines = len(lines)
+    return stats
+
+
+def read_text(path: Path, encoding: str = "utf-8") -> str:
+    """
+    读取文件内容，保留原有的换行符
+    不做换行符转换，CRLF 的笔记回写后仍然是 CRLF
+    :param path: 文件路径
+    :param encoding: 文件编码
+    :return: 文件内容
+    """
+    with open(path, "r", encoding=encoding, newline="") as f:
+        return f.read()
+
+
+def atomic_write_text(path: Path, content: str, encoding: str = "utf-8"):
+    """
+    先写入同目录下的临时文件，再原子替换目标文件
+    :param path: 目标文件
+    :param content: 新内容
+    :param encoding: 文件编码
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding, newline="") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # 保留原文件的权限位
+            os.chmod(tmp_name, os.stat(path).st_mode & 0o7777)
+        except OSError:
+            pass
+        os.replace(tmp_name, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def commit_rewrite(rewrite: PendingRewrite) -> str:
+    """
+    提交单个文件的回写
+    :return: COMMIT_WRITTEN 或 COMMIT_UNCHANGED
+    :raises ConcurrentModificationError: 文件在规划之后被修改过
+    """
+    if not rewrite.changed:
+        return COMMIT_UNCHANGED
+    current = read_text(rewrite.path)
+    if current != rewrite.original:
+        # 覆盖会丢失用户在迁移期间所做的编辑，留给下次运行处理
+        raise ConcurrentModificationError("文件在迁移期间被修改，跳过回写")
+    with metrics.timer("rewrite_file_seconds", "替换URL并写回单个Markdown文件的耗时（秒）"):
+        atomic_write_text(rewrite.path, rewrite.content)
+    return COMMIT_WRITTEN
+
+
+def commit_rewrites(rewrites: List[PendingRewrite], workers: int = 4) -> Dict[str, str]:
+    """
+    并行提交一批回写
+    :param rewrites: 等待提交的回写
+    :param workers: 写入线程数
+    :return: 以文件键为键的错误信息，全部成功时为空
+    """
+    errors: Dict[str, str] = {}
+    if not rewrites:
+        return errors
+
+    def commit(rewrite: PendingRewrite):
+        try:
+            status = commit_rewrite(rewrite)
+        except Exception as e:
+            errors[rewrite.key] = str(e)
+            status = "failed"
+        metrics.counter("rewrite_files_total", "回写的Markdown文件数", status=status).inc()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(rewrites)))) as executor:
+        list(executor.map(commit, rewrites))
+    return errors
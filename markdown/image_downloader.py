@@ -1,78 +1,121 @@
 import os
-import re
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterable, Optional, Set, Tuple, Union
 from urllib.parse import urlparse, unquote
 
 import requests
 
-from storage.base_uploader import BaseUploader
+from storage.base_uploader import BaseUploader, UploadItem
+from storage.image_optimizer import ImageOptimizer
+from storage.image_verifier import ImageVerifier
+from storage.image_store import ImageStore, SpooledImage, StoredImage
+from storage.manifest import MigrationManifest, STATUS_DONE
+from utils.download_scheduler import BudgetExceededError, DownloadScheduler
+from utils.http import SessionPool, default_session_pool
+from utils.image_types import SNIFF_BYTES, check_image_header, extension_from_content_type, sniff_extension
+from utils.logger import logger
+from utils.metrics import metrics
+from .pipeline import DryRunReport, MigrationPipeline
+from .rewriter import rewrite_image_urls
+from .tokenizer import ImageRef, find_image_refs
+
+
+# 单次下载的结果状态
+FETCH_CACHED = "cached"
+FETCH_NOT_MODIFIED = "not_modified"
+FETCH_OK = "ok"
+FETCH_STALE = "stale"
+FETCH_ERROR = "error"
+FETCH_TOO_LARGE = "too_large"
+FETCH_INVALID = "invalid"
+
+
+class ImageTooLargeError(Exception):
+    """图片超过允许的大小"""
+
+
+class InvalidImageError(Exception):
+    """响应内容不是完整的图片"""
 
 
 class MarkdownImageDownloader:
-    def __init__(self, save_dir: str, uploader: BaseUploader = None):
+    def __init__(self, save_dir: str, uploader: BaseUploader = None,
+                 download_workers: int = 4, upload_workers: int = 1, queue_size: int = 32,
+                 manifest: MigrationManifest = None, max_image_size: Optional[int] = None,
+                 chunk_size: int = 64 * 1024, session_pool: SessionPool = None,
+                 optimizer: ImageOptimizer = None, scheduler: DownloadScheduler = None,
+                 revalidate: bool = False, verifier: ImageVerifier = None,
+                 stream_through: bool = False, spool_memory: int = 8 * 1024 * 1024,
+                 cache_size: Optional[int] = None, cache_max_age: Optional[float] = None,
+                 read_only: bool = False):
         """
         初始化下载器
         :param save_dir: 图片保存目录
         :param uploader: 上传器实例
+        :param manifest: 迁移清单，提供时用于断点续传和跳过已迁移的图片
+        :param max_image_size: 单张图片的最大字节数，默认沿用上传器的 max_file_size
+        :param chunk_size: 流式下载时每次读取的字节数
+        :param session_pool: HTTP 连接池，默认与上传器共用全局连接池
+        :param optimizer: 图片优化器，提供时在校验与上传之间优化图片（需要 Pillow）
+        :param scheduler: 下载调度器，负责每个主机的并发上限、重试退避和熔断
+        :param revalidate: 本地已有副本时仍向源站发送条件请求（If-None-Match / If-Modified-Since），
+            确认源图片没有变化
+        :param verifier: 深度校验器，提供时在进程池中完整解码每张图片（需要 Pillow）；
+            不提供时只做下载过程中的文件头与大小检查
+        :param stream_through: 直通模式：下载的图片不写入图片存储，在内存缓冲区中计算摘要后
+            直接上传，不能与优化、深度校验同时使用
+        :param spool_memory: 直通模式下每张图片保留在内存中的最大字节数，超过后转存到临时文件
+        :param cache_size: 图片目录的字节预算，超出时按最近最少使用的顺序删除已上传的图片，为空时不限制
+        :param cache_max_age: 超过多少秒未使用的已上传图片会被删除，为空时不限制
+        :param read_only: 只读模式（dry-run）：不创建图片目录，只能用于 plan_markdown_files
+        :param download_workers: 流水线下载线程数
+        :param upload_workers: 流水线上传线程数
+        :param queue_size: 流水线各阶段之间的队列容量
         """
         self.save_dir = Path(save_dir)
-        self.save_dir.mkdir(parents=True, exist_ok=True)
+        if not read_only:
+            self.save_dir.mkdir(parents=True, exist_ok=True)
+        self.store = ImageStore(str(self.save_dir), max_bytes=cache_size, max_age=cache_max_age,
+                                evictable=self._is_uploaded, read_only=read_only)
+        if optimizer is not None and (optimizer.store is None or optimizer.store.root == self.save_dir):
+            # 优化结果写入同一个存储，字节预算和索引只有一份
+            optimizer.store = self.store
         self.uploader = uploader
-
-        # 分钟级限制
-        self.last_upload_time = time.time()
-        self.upload_count = 0
-        self.upload_limit = 15  # 每分钟最大上传数
-        self.upload_interval = 60  # 重置计数器的时间间隔（秒）
-
-        # 小时级限制
-        self.hourly_last_reset = time.time()
-        self.hourly_upload_count = 0
-        self.hourly_upload_limit = 100  # 每小时最大上传数
-        self.hourly_interval = 3600  # 一小时的秒数
-
-    def _check_upload_rate(self):
-        """检查并控制上传速率"""
-        current_time = time.time()
-
-        # 检查小时级限制
-        if current_time - self.hourly_last_reset >= self.hourly_interval:
-            self.hourly_upload_count = 0
-            self.hourly_last_reset = current_time
-        elif self.hourly_upload_count >= self.hourly_upload_limit:
-            sleep_time = self.hourly_interval - (current_time - self.hourly_last_reset)
-            print(f"已达到每小时上传限制，等待 {sleep_time / 60:.1f} 分钟后继续...")
-            time.sleep(sleep_time)
-            self.hourly_upload_count = 0
-            self.hourly_last_reset = time.time()
-            current_time = time.time()  # 更新当前时间
-
-        # 检查分钟级限制
-        if current_time - self.last_upload_time >= self.upload_interval:
-            self.upload_count = 0
-            self.last_upload_time = current_time
-        elif self.upload_count >= self.upload_limit:
-            sleep_time = self.upload_interval - (current_time - self.last_upload_time)
-            time.sleep(sleep_time)
-            self.upload_count = 0
-            self.last_upload_time = time.time()
-
-    def replace_image_urls(self, content: str, url_mapping: Dict[str, str]) -> str:
+        self.manifest = manifest
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.session_pool = session_pool or default_session_pool
+        self.scheduler = scheduler or DownloadScheduler()
+        self.revalidate = revalidate
+        if max_image_size is None and uploader is not None:
+            max_image_size = uploader.max_file_size
+        self.max_image_size = max_image_size
+        self.optimizer = optimizer if optimizer is not None and optimizer.available else None
+        self.verifier = verifier if verifier is not None and verifier.available else None
+        if stream_through and (self.optimizer or self.verifier):
+            raise ValueError("直通模式不能与图片优化、深度校验同时使用")
+        self.stream_through = stream_through
+        self.spool_memory = spool_memory
+
+        # 内容摘要 -> (已上传的URL, 后端名称)，保证相同内容只上传一次
+        self._uploaded: Dict[str, Tuple[str, str]] = {}
+        self._upload_locks: Dict[str, threading.Lock] = {}
+        self._upload_locks_guard = threading.Lock()
+
+    def replace_image_urls(self, content: str, url_mapping: Dict[str, str],
+                           refs: Optional[List[ImageRef]] = None) -> str:
         """
         替换Markdown内容中的图片URL
         :param content: 原始Markdown内容
         :param url_mapping: 原始URL到新URL的映射
+        :param refs: 提取阶段得到的图片引用位置，为空时重新查找
         :return: 更新后的Markdown内容
         """
-        for old_url, new_url in url_mapping.items():
-            # 替换Markdown格式的图片链接
-            content = content.replace(f']({old_url})', f']({new_url})')
-            # 替换HTML格式的图片链接
-            content = content.replace(f'src="{old_url}"', f'src="{new_url}"')
-            content = content.replace(f"src='{old_url}'", f"src='{new_url}'")
-        return content
+        return rewrite_image_urls(content, url_mapping, refs)
 
     def process_markdown_file(self, md_file: str) -> Dict[str, List[Dict]]:
         """
@@ -85,167 +128,410 @@ class MarkdownImageDownloader:
                 "success": [],
                 "failed": [{"url": "", "error": f"文件不存在: {md_file}"}]
             }
+        return self.process_markdown_files([md_file])[str(md_file)]
 
-        # 读取Markdown文件
-        content = md_path.read_text(encoding='utf-8')
-
-        # 提取图片URL
-        image_urls = self.extract_images(content)
-
-        results = {
-            "success": [],
-            "failed": []
-        }
-
-        # 用于存储URL映射关系
-        url_mapping = {}
-
-        # 下载并上传每个图片
-        for url in image_urls:
-            success, error, save_path = self.download_image(url)
-            if success and self.uploader:
-                try:
-                    self._check_upload_rate()
-
-                    object_name = f"images/{Path(save_path).name}"
-                    new_url = self.uploader.upload_file(save_path, object_name)
-
-                    if new_url:
-                        self.upload_count += 1
-                        self.hourly_upload_count += 1
-                        url_mapping[url] = new_url
-                        results["success"].append({
-                            "url": url,
-                            "save_path": save_path,
-                            "new_url": new_url
-                        })
-                    else:
-                        results["failed"].append({
-                            "url": url,
-                            "error": "上传失败"
-                        })
-                except Exception as e:
-                    error_str = str(e)
-                    # 检查是否是图片已存在的错误
-                    if "Image upload repeated limit, this image exists at:" in error_str:
-                        # 提取已存在的图片URL
-                        existing_url = error_str.split("exists at: ")[-1].strip()
-                        # 使用已存在的URL进行替换
-                        url_mapping[url] = existing_url
-                        results["success"].append({
-                            "url": url,
-                            "save_path": save_path,
-                            "new_url": existing_url,
-                            "note": "使用已存在的图片URL"
-                        })
-                    else:
-                        results["failed"].append({
-                            "url": url,
-                            "error": error_str
-                        })
-            elif not success:
-                results["failed"].append({
-                    "url": url,
-                    "error": error
-                })
-
-        # 如果有成功上传的图片，更新Markdown文件
-        if url_mapping and self.uploader:
-            try:
-                # 替换内容中的URL
-                new_content = self.replace_image_urls(content, url_mapping)
-                # 写回文件
-                md_path.write_text(new_content, encoding='utf-8')
-            except Exception as e:
-                results["failed"].append({
-                    "url": "",
-                    "error": f"更新Markdown文件失败: {str(e)}"
-                })
-
-        return results
+    def process_markdown_files(self, md_files: Iterable[str],
+                               only_urls: Optional[Set[str]] = None) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        通过分阶段流水线处理一批Markdown文件
+        :param md_files: Markdown文件路径
+        :param only_urls: 只迁移这些URL（监听模式用于只处理新增的图片），为空时不限制
+        :return: 以文件路径为键的处理结果统计
+        """
+        pipeline = MigrationPipeline(
+            self,
+            download_workers=self.download_workers,
+            upload_workers=self.upload_workers,
+            queue_size=self.queue_size
+        )
+        return pipeline.run(md_files, only_urls)
+
+    def plan_markdown_files(self, md_files: Iterable[str],
+                            only_urls: Optional[Set[str]] = None) -> DryRunReport:
+        """
+        dry-run：给出URL映射和每个文件的改动统计，不下载、不上传、不修改文件
+        :param md_files: Markdown文件路径
+        :param only_urls: 只统计这些URL，为空时不限制
+        :return: 规划结果
+        """
+        return MigrationPipeline(self).dry_run(md_files, only_urls)
+
+    def verify_image(self, save_path: str) -> bool:
+        """检查下载结果是否为完整的图片"""
+        return self.check_image(save_path) is None
+
+    def check_image(self, save_path: str) -> Optional[str]:
+        """
+        校验已下载的图片：文件头已在下载时检查过，这里确认文件仍然存在，
+        启用深度校验时再完整解码
+        :return: 校验失败的原因，通过时返回 None
+        """
+        try:
+            if os.path.getsize(save_path) == 0:
+                return "图片文件为空"
+        except OSError:
+            return f"图片文件不存在: {save_path}"
+        if self.verifier:
+            return self.verifier.verify(save_path)
+        return None
+
+    def reject_image(self, url: str, save_path: str, error: str):
+        """
+        丢弃校验失败的图片，避免占用上传配额，并在迁移清单中记为下载失败以便下次重新下载
+        """
+        metrics.counter("verify_rejected_total", "校验失败而被丢弃的图片数").inc()
+        self.store.remove(save_path)
+        if self.manifest:
+            self.manifest.record_download_failure(url, error)
+
+    def release_image(self, save_path: str, uploaded: bool = False):
+        """
+        处理结束后解除 download_image 对图片的保留
+        :param uploaded: 图片已上传，之后可以从存储中淘汰
+        """
+        self.store.release(save_path, uploaded)
+
+    def _is_uploaded(self, digest: str) -> bool:
+        """存储中的图片能否淘汰：内容（启用优化时为优化结果）已上传到任一后端"""
+        if not self.uploader:
+            return False
+        if self.optimizer:
+            digest = self.optimizer.result_digest(digest) or digest
+        return digest in self._uploaded or self._find_remote(digest) is not None
+
+    def optimize_image(self, save_path: str) -> str:
+        """
+        优化单张已下载的图片
+        :return: 优化后的图片路径，无需优化或未启用优化时返回原路径
+        """
+        if not self.optimizer:
+            return save_path
+        return self.optimizer.optimize(save_path)
+
+    def upload_image(self, save_path: str) -> Tuple[str, str, str]:
+        """
+        上传单张已下载的图片，相同内容（同一存储路径）只上传一次
+        :return: (新URL, 备注, 完成上传的后端名称)，上传失败时新URL为空
+        :raises Exception: 上传失败
+        """
+        path = Path(save_path)
+        uploaded = self._upload_once(path.stem, UploadItem(save_path, f"images/{path.name}"))
+        self.store.mark_uploaded(save_path)
+        return uploaded
+
+    def upload_spooled(self, image: SpooledImage) -> Tuple[str, str, str]:
+        """
+        直通模式：从内存缓冲区上传一张图片，对象名与存储模式相同，相同内容只上传一次
+        :return: (新URL, 备注, 完成上传的后端名称)
+        :raises Exception: 上传失败
+        """
+        return self._upload_once(image.digest, UploadItem("", f"images/{image.name}", stream=image.buffer))
+
+    def _upload_once(self, digest: str, item: UploadItem) -> Tuple[str, str, str]:
+        with self._upload_locks_guard:
+            lock = self._upload_locks.setdefault(digest, threading.Lock())
+
+        with lock:
+            if digest in self._uploaded:
+                remote_url, backend = self._uploaded[digest]
+                return remote_url, "相同内容的图片已上传", backend
+            recorded = self._find_remote(digest)
+            if recorded:
+                self._uploaded[digest] = recorded
+                return recorded[0], "迁移清单中已有上传记录", recorded[1]
+
+            # 等待上传器的限速配额；等待只发生在上传线程，下载阶段不受影响
+            wait = self.uploader.rate_limiter.time_until_available()
+            if wait >= 60:
+                logger.info(f"已达到上传限制，等待 {wait / 60:.1f} 分钟后继续...")
+            result = self.uploader.upload_item(item)
+            backend = result.backend or self.uploader.backend_name
+            if not result.ok:
+                if self.manifest:
+                    self.manifest.record_upload_failure(digest, backend, result.error)
+                raise Exception(result.error)
+
+            self._remember_upload(digest, backend, result.url)
+            return result.url, result.note, backend
+
+    def _find_remote(self, digest: str) -> Optional[Tuple[str, str]]:
+        """
+        在迁移清单中查找任一后端的上传记录
+        :return: (新URL, 后端名称)，没有记录时返回 None
+        """
+        if not self.manifest:
+            return None
+        for backend in self.uploader.backend_names:
+            remote_url = self.manifest.get_remote_url(digest, backend)
+            if remote_url:
+                return remote_url, backend
+        return None
+
+    def _remember_upload(self, digest: str, backend: str, new_url: str):
+        self._uploaded[digest] = (new_url, backend)
+        if self.manifest:
+            self.manifest.record_upload(digest, backend, new_url)
+
+    def resolve_migrated(self, url: str) -> Optional[Tuple[str, str, str]]:
+        """
+        查询迁移清单，判断源URL是否已经完成迁移
+        :return: (本地保存路径, 新URL, 后端名称)，未完成迁移时返回 None
+        """
+        if not (self.manifest and self.uploader):
+            return None
+        source = self.manifest.get_source(url)
+        if not source or not source.digest:
+            return None
+        digest, ext = source.digest, source.ext or ""
+        if self.optimizer:
+            # 启用优化时上传的是优化结果，按迁移清单中的结果摘要查询上传记录；
+            # 优化结果可能已从图片存储中淘汰，这里不访问存储
+            result = self.optimizer.result(digest)
+            if not result:
+                return None
+            digest, ext = result
+        recorded = self._find_remote(digest)
+        if not recorded:
+            return None
+        return str(self.store.path_for(digest, ext)), recorded[0], recorded[1]
+
+    def is_migrated_url(self, url: str) -> bool:
+        """判断URL是否已经指向迁移目标，无需再处理"""
+        if self.uploader and self.uploader.owns_url(url):
+            return True
+        return bool(self.manifest and self.manifest.is_remote_url(url))
 
     def extract_images(self, md_content: str) -> List[str]:
         """
         从Markdown内容中提取所有图片URL
-        支持以下格式：
-        ![alt](url)
+        支持以下格式（围栏代码块和行内代码中的内容会被忽略）：
+        ![alt](url)、![alt](url "title")、![alt](<url>)
+        ![alt][ref] 及 [ref]: url 定义
         <img src="url" />
         """
-        # Markdown标准图片语法
-        md_pattern = r'!\[.*?\]\((.*?)\)'
-        # HTML图片标签语法
-        html_pattern = r'<img.*?src=["\'](.*?)["\'].*?>'
-
-        urls = []
-        urls.extend(re.findall(md_pattern, md_content))
-        urls.extend(re.findall(html_pattern, md_content))
-
-        # 过滤掉已经在 SM.MS 的图片
-        filtered_urls = [
-            url.strip() for url in urls
-            if url.strip() and 's2.loli.net' not in url.strip()
+        return [ref.url for ref in self.extract_image_refs(md_content)]
+
+    def extract_image_refs(self, md_content: str) -> List[ImageRef]:
+        """提取需要迁移的图片引用及其在文档中的位置"""
+        # 过滤掉已经迁移到目标图床的图片
+        return [
+            ref for ref in find_image_refs(md_content)
+            if not self.is_migrated_url(ref.url)
         ]
-        return filtered_urls
 
     def download_image(self, url: str) -> Tuple[bool, str, str]:
         """
-        下载单个图片
+        下载单个图片，成功时图片在存储中保持 pin，处理结束后调用 release_image
         :return: (是否成功, 错误信息, 保存路径)
         """
+        status, error, save_path = self._fetch(url, self.revalidate, hold=True)
+        return status not in (FETCH_ERROR, FETCH_TOO_LARGE, FETCH_INVALID), error, save_path
+
+    def _fetch(self, url: str, revalidate: bool, hold: bool = False) -> Tuple[str, str, str]:
+        """
+        下载单个图片；本地已有副本，或副本已被淘汰但源图片已完成迁移时，按迁移清单中的
+        ETag / Last-Modified 发送条件请求
+        :param revalidate: 是否向源站确认本地副本仍是最新的
+        :param hold: 是否 pin 返回的图片，避免在上传之前被淘汰
+        :return: (结果状态 FETCH_*, 错误信息, 保存路径)
+        """
+        cached = None
+        source = None
+        if self.manifest:
+            source = self.manifest.get_source(url)
+            if source and source.status == STATUS_DONE and source.digest:
+                cached = self.store.get(source.digest, source.ext or "", pin=hold)
+        # 清单中已有下载记录且本地文件仍在时，无需再次请求
+        if cached and not revalidate:
+            metrics.counter("download_requests_total", "图片下载请求数", status=FETCH_CACHED).inc()
+            return FETCH_CACHED, "", str(cached)
+
+        # 本地副本已被淘汰、但迁移清单中有上传记录时，304 表示沿用已有的远程URL
+        migrated = None
+        if source and source.status == STATUS_DONE and not cached:
+            migrated = self.resolve_migrated(url)
+        headers = {}
+        if cached or migrated:
+            # 条件请求：源站内容未变化时返回 304，不传输响应体
+            if source.etag:
+                headers["If-None-Match"] = source.etag
+            if source.last_modified:
+                headers["If-Modified-Since"] = source.last_modified
+
+        host = urlparse(url).hostname or ""
+        session = self.session_pool.get(url)
+
+        def attempt(timeout: float, deadline: float):
+            # 单次 GET 请求，复用该主机的 keep-alive 连接
+            with session.get(url, timeout=timeout, stream=True, headers=headers) as response:
+                validators = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                if response.status_code == 304 and headers:
+                    return None, validators
+                self.scheduler.check_status(response)
+                return self._stream_to_store(response, url, deadline, pin=hold), validators
+
         try:
-            # 解析URL，获取文件名
-            parsed_url = urlparse(unquote(url))
-            original_filename = os.path.basename(parsed_url.path)
-
-            # 如果URL中没有文件扩展名，尝试从Content-Type获取
-            if not os.path.splitext(original_filename)[1]:
-                response = requests.head(url)
-                content_type = response.headers.get('Content-Type', '')
-                ext = self._get_extension_from_content_type(content_type)
-                original_filename = f"image{ext}"
-
-            # 下载图片
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-
-            # 获取最后修改时间
-            last_modified = response.headers.get('Last-Modified')
-            if last_modified:
-                from email.utils import parsedate_to_datetime
-                try:
-                    date_str = parsedate_to_datetime(last_modified).strftime('%Y%m%d')
-                    name, ext = os.path.splitext(original_filename)
-                    original_filename = f"{date_str}_{name}{ext}"
-                except:
-                    pass
-
-            # 保存图片
-            save_path = self.save_dir / original_filename
-            # 如果文件已存在，添加数字后缀
-            counter = 1
-            while save_path.exists():
-                name, ext = os.path.splitext(original_filename)
-                save_path = self.save_dir / f"{name}_{counter}{ext}"
-                counter += 1
-
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
-
-            return True, "", str(save_path)
+            with metrics.timer("download_request_seconds", "下载单张图片的耗时（秒）", host=host):
+                stored, (etag, last_modified) = self.scheduler.run(url, attempt)
+            if stored is None:
+                self.manifest.record_not_modified(url, etag, last_modified)
+                metrics.counter("download_requests_total", "图片下载请求数",
+                                status=FETCH_NOT_MODIFIED).inc()
+                return FETCH_NOT_MODIFIED, "", str(cached) if cached else migrated[0]
+
+            if cached and hold:
+                # 源图片已变化，旧副本不再需要保留
+                self.store.release(str(cached))
+            save_path = stored.path
+            ext = save_path.suffix
+            if self.manifest:
+                self.manifest.record_download(url, stored.digest, ext, stored.size, etag, last_modified)
+
+            metrics.counter("download_requests_total", "图片下载请求数", status=FETCH_OK).inc()
+            metrics.counter("download_bytes_total", "下载的图片字节数").inc(stored.size)
+            return FETCH_OK, "", str(save_path)
 
         except Exception as e:
-            return False, str(e), ""
-
-    def _get_extension_from_content_type(self, content_type: str) -> str:
-        """根据Content-Type获取文件扩展名"""
-        content_type = content_type.lower()
-        if 'jpeg' in content_type or 'jpg' in content_type:
-            return '.jpg'
-        elif 'png' in content_type:
-            return '.png'
-        elif 'gif' in content_type:
-            return '.gif'
-        elif 'webp' in content_type:
-            return '.webp'
-        else:
-            return '.jpg'  # 默认使用jpg
+            if cached:
+                # 无法确认时继续使用本地副本，不覆盖此前成功的下载记录
+                metrics.counter("download_requests_total", "图片下载请求数", status=FETCH_STALE).inc()
+                return FETCH_STALE, str(e), str(cached)
+            if isinstance(e, ImageTooLargeError):
+                status = FETCH_TOO_LARGE
+            elif isinstance(e, InvalidImageError):
+                status = FETCH_INVALID
+            else:
+                status = FETCH_ERROR
+            metrics.counter("download_requests_total", "图片下载请求数", status=status).inc()
+            if self.manifest:
+                self.manifest.record_download_failure(url, str(e))
+            return status, str(e), ""
+
+    def stream_image(self, url: str) -> Tuple[bool, str, Optional[SpooledImage]]:
+        """
+        直通模式下载单个图片：响应体写入内存缓冲区（超过 spool_memory 后转存到临时文件），
+        不写入图片存储，下载途中同样做文件头与大小检查
+        :return: (是否成功, 错误信息, 缓冲区中的图片)，调用方负责关闭图片
+        """
+        host = urlparse(url).hostname or ""
+        session = self.session_pool.get(url)
+
+        def attempt(timeout: float, deadline: float):
+            with session.get(url, timeout=timeout, stream=True) as response:
+                self.scheduler.check_status(response)
+                validators = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                image = self._stream_to_store(response, url, deadline, SpooledImage(self.spool_memory))
+                return image, validators
+
+        try:
+            with metrics.timer("download_request_seconds", "下载单张图片的耗时（秒）", host=host):
+                image, (etag, last_modified) = self.scheduler.run(url, attempt)
+        except Exception as e:
+            if isinstance(e, ImageTooLargeError):
+                status = FETCH_TOO_LARGE
+            elif isinstance(e, InvalidImageError):
+                status = FETCH_INVALID
+            else:
+                status = FETCH_ERROR
+            metrics.counter("download_requests_total", "图片下载请求数", status=status).inc()
+            if self.manifest:
+                self.manifest.record_download_failure(url, str(e))
+            return False, str(e), None
+
+        # 记录摘要，下次运行时可以按摘要找到上传记录而无需再次下载
+        if self.manifest:
+            self.manifest.record_download(url, image.digest, image.ext, image.size, etag, last_modified)
+        metrics.counter("download_requests_total", "图片下载请求数", status=FETCH_OK).inc()
+        metrics.counter("download_bytes_total", "下载的图片字节数").inc(image.size)
+        return True, "", image
+
+    def revalidate_sources(self, urls: Optional[Iterable[str]] = None,
+                           workers: Optional[int] = None) -> Dict[str, List[str]]:
+        """
+        用条件请求确认已下载的源图片是否变化，内容未变化的图片几乎不传输数据
+        :param urls: 需要确认的URL，默认为迁移清单中全部已下载的URL
+        :param workers: 并发数，默认使用下载线程数
+        :return: 按结果分组的URL：unchanged / changed / failed
+        """
+        if urls is None:
+            urls = [source.url for source in self.manifest.iter_sources()] if self.manifest else []
+        summary: Dict[str, List[str]] = {"unchanged": [], "changed": [], "failed": []}
+
+        def check(url: str) -> Tuple[str, str]:
+            before = self.manifest.get_source(url) if self.manifest else None
+            status, _, save_path = self._fetch(url, revalidate=True)
+            if status in (FETCH_NOT_MODIFIED, FETCH_CACHED):
+                return url, "unchanged"
+            if status == FETCH_OK:
+                same = before is not None and Path(save_path).stem == before.digest
+                return url, "unchanged" if same else "changed"
+            return url, "failed"
+
+        with ThreadPoolExecutor(max_workers=workers or self.download_workers) as executor:
+            for url, outcome in executor.map(check, urls):
+                summary[outcome].append(url)
+        return summary
+
+    def _stream_to_store(self, response: requests.Response, url: str,
+                         deadline: Optional[float] = None,
+                         sink: Optional[SpooledImage] = None,
+                         pin: bool = False) -> Union[StoredImage, SpooledImage]:
+        """
+        将响应体分块写入图片存储，超过大小限制或截止时间时提前中止；
+        收到文件头后立即检查是否为图片，结束时检查实际大小与声明的大小是否一致
+        :param deadline: 调度器时钟下的截止时间，为空时不限制
+        :param sink: 直通模式下写入的内存缓冲区，为空时写入图片存储
+        :param pin: 写入图片存储时同时 pin
+        :raises ImageTooLargeError: 图片超过 max_image_size
+        :raises InvalidImageError: 响应不是图片，或内容被截断
+        :raises BudgetExceededError: 读取响应体超过截止时间
+        """
+        limit = self.max_image_size
+        content_type = response.headers.get('Content-Type', '')
+        declared = response.headers.get('Content-Length')
+        declared = int(declared) if declared and declared.isdigit() else None
+        # 声明的大小已超限时不再读取响应体
+        if limit and declared is not None and declared > limit:
+            raise ImageTooLargeError(f"图片大小 {declared} 字节超过限制 {limit} 字节")
+        if declared == 0:
+            raise InvalidImageError("响应内容为空")
+
+        with sink if sink is not None else self.store.open_pending(pin) as pending:
+            checked = False
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                pending.write(chunk)
+                if limit and pending.size > limit:
+                    raise ImageTooLargeError(f"图片大小超过限制 {limit} 字节")
+                if not checked and pending.size >= SNIFF_BYTES:
+                    # 错误页等非图片内容在第一个分块就能发现，不必读完整个响应体
+                    self._check_header(pending.head, content_type)
+                    checked = True
+                # 慢速响应每个分块都不超时，但总耗时不能超出预算
+                if deadline is not None and self.scheduler.clock() > deadline:
+                    raise BudgetExceededError("读取图片超出总耗时预算")
+            if not checked:
+                self._check_header(pending.head, content_type)
+            # 经过压缩传输时 Content-Length 是压缩后的大小，无法与解码后的字节数比较
+            encoding = response.headers.get('Content-Encoding', 'identity').lower()
+            if declared is not None and encoding == 'identity' and pending.size != declared:
+                raise InvalidImageError(f"响应被截断：收到 {pending.size} 字节，声明 {declared} 字节")
+            ext = self._guess_extension(url, content_type, pending.head)
+            return pending.commit(ext)
+
+    @staticmethod
+    def _check_header(head: bytes, content_type: str):
+        error = check_image_header(head, content_type)
+        if error:
+            raise InvalidImageError(error)
+
+    def _guess_extension(self, url: str, content_type: str, head: bytes) -> str:
+        """
+        确定图片扩展名：优先使用文件头魔数，其次是URL中的扩展名和Content-Type
+        """
+        sniffed = sniff_extension(head)
+        if sniffed:
+            return sniffed
+        url_ext = os.path.splitext(os.path.basename(urlparse(unquote(url)).path))[1].lower()
+        if url_ext:
+            return url_ext
+        return extension_from_content_type(content_type) or '.jpg'  # 默认使用jpg
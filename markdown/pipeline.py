@@ -0,0 +1,421 @@
+"""
+图片迁移流水线
+
+扫描 -> 下载 -> 校验 -> [优化] -> 上传 -> 回写，各阶段之间通过有界队列连接，
+每个阶段拥有独立的工作线程；可选的优化阶段把编码工作交给进程池。上传阶段因限速而等待时，下载阶段仍会继续
+填充本地缓存，直到队列写满后自然形成背压。
+
+扫描阶段会在任何网络请求之前完成全局规划，之后每个唯一URL只进入流水线一次。
+回写阶段只计算新内容，所有图片处理完毕后再批量、原子地提交到磁盘。
+直通模式下图片不写入本地存储，以内存缓冲区的形式在阶段之间传递，回写阶段负责释放。
+分片运行时两个阶段分开进行：migrate_urls 只处理一批URL，apply_results 把结果回写到一批文件。
+"""
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from storage.image_store import SpooledImage
+from utils.metrics import metrics
+from .committer import PendingRewrite, RewriteStats, commit_rewrites, rewrite_stats
+from .planner import FilePlan, MigrationPlan, build_plan
+
+# 队列结束标记
+_STOP = object()
+
+
+@dataclass
+class ImageTask:
+    """在流水线中流转的单张图片任务"""
+    url: str
+    save_path: str = ""
+    new_url: str = ""
+    error: str = ""
+    note: str = ""
+    # 完成上传的后端名称
+    backend: str = ""
+    # 直通模式下尚未上传的图片缓冲区
+    image: Optional[SpooledImage] = None
+    # 下载得到、在存储中被 pin 的图片路径，回写阶段解除
+    held: str = ""
+    # 阶段名 -> 该阶段处理本任务耗费的秒数
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class DryRunReport:
+    """dry-run 的规划结果，不发起任何下载或上传"""
+    # 原始URL -> 新URL，尚未迁移的为 None
+    url_mapping: Dict[str, Optional[str]] = field(default_factory=dict)
+    # 文件 -> 改动统计
+    files: Dict[str, RewriteStats] = field(default_factory=dict)
+    # 文件 -> 读取失败原因
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def pending_urls(self) -> List[str]:
+        return [url for url, new_url in self.url_mapping.items() if new_url is None]
+
+
+@dataclass
+class _FileState:
+    """单个Markdown文件的处理进度"""
+    key: str
+    plan: FilePlan
+    pending: int
+    url_mapping: Dict[str, str] = field(default_factory=dict)
+    results: Dict[str, List[Dict]] = field(
+        default_factory=lambda: {"success": [], "failed": []}
+    )
+
+
+class Stage:
+    """
+    流水线阶段：从输入队列取任务，交给处理函数，再把产出放入下一阶段
+    :param name: 阶段名称
+    :param handler: 处理函数，接收一个任务并返回零个或多个产出
+    :param workers: 工作线程数
+    :param queue_size: 输入队列容量，写满时上游阻塞
+    :param skip_failed: 是否将已失败的任务直接透传而不交给处理函数
+    """
+
+    def __init__(self, name: str, handler: Callable[[object], Iterable[object]],
+                 workers: int = 1, queue_size: int = 32, skip_failed: bool = True):
+        self.name = name
+        self.handler = handler
+        self.skip_failed = skip_failed
+        self.workers = max(1, workers)
+        self.inbox: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self.next_stage: Optional["Stage"] = None
+        self._threads: List[threading.Thread] = []
+        self._alive = 0
+        self._lock = threading.Lock()
+        self._queue_depth = metrics.gauge("pipeline_queue_depth", "各阶段输入队列中等待的任务数", stage=name)
+        self._seconds = metrics.histogram("pipeline_stage_seconds", "各阶段处理单个任务的耗时（秒）",
+                                          stage=name)
+
+    def start(self):
+        self._alive = self.workers
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"{self.name}-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        self.inbox.put(item)
+        self._queue_depth.set(self.inbox.qsize())
+
+    def close(self):
+        """通知本阶段没有更多输入"""
+        for _ in range(self.workers):
+            self.inbox.put(_STOP)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                item = self.inbox.get()
+                self._queue_depth.set(self.inbox.qsize())
+                if item is _STOP:
+                    break
+                for output in self._handle(item):
+                    if self.next_stage is not None:
+                        self.next_stage.put(output)
+        finally:
+            with self._lock:
+                self._alive -= 1
+                last = self._alive == 0
+            # 最后一个退出的线程负责关闭下游
+            if last and self.next_stage is not None:
+                self.next_stage.close()
+
+    def _handle(self, item) -> Iterable[object]:
+        # 已失败的任务直接透传到下游，由回写阶段统一记录
+        if self.skip_failed and isinstance(item, ImageTask) and item.error:
+            return [item]
+        start = time.perf_counter()
+        try:
+            return self.handler(item) or []
+        except Exception as e:
+            if isinstance(item, ImageTask):
+                item.error = str(e)
+                return [item]
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._seconds.observe(elapsed)
+            if isinstance(item, ImageTask):
+                item.timings[self.name] = elapsed
+                metrics.counter("pipeline_tasks_total", "各阶段处理的任务数",
+                                stage=self.name, status="failed" if item.error else "ok").inc()
+
+
+class MigrationPipeline:
+    """
+    基于 MarkdownImageDownloader 的分阶段迁移流水线
+    :param downloader: 提供下载、校验、上传与URL替换能力的下载器
+    :param download_workers: 下载线程数
+    :param verify_workers: 校验线程数
+    :param optimize_workers: 优化阶段向进程池提交任务的线程数，默认与进程数相同
+    :param upload_workers: 上传线程数
+    :param queue_size: 各阶段之间队列的容量
+    :param commit_workers: 批量提交回写时的写入线程数
+    """
+
+    def __init__(self, downloader, download_workers: int = 4, verify_workers: int = 1,
+                 upload_workers: int = 1, queue_size: int = 32,
+                 optimize_workers: Optional[int] = None, commit_workers: int = 4):
+        self.downloader = downloader
+        self.download_workers = download_workers
+        self.verify_workers = verify_workers
+        self.optimize_workers = optimize_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
+        self.commit_workers = commit_workers
+
+        self.plan: Optional[MigrationPlan] = None
+        self._files: Dict[str, _FileState] = {}
+        self._results: Dict[str, Dict[str, List[Dict]]] = {}
+        self._rewrites: List[PendingRewrite] = []
+
+    def run(self, md_files: Iterable[str],
+            only_urls: Optional[Set[str]] = None) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        处理一批Markdown文件
+        :param md_files: Markdown文件路径
+        :param only_urls: 只迁移这些URL，为空时迁移文件中所有未迁移的图片
+        :return: 以文件路径为键的处理结果
+        """
+        # 扫描：先汇总全部URL，再开始任何网络请求
+        self._prepare(md_files, only_urls)
+        self._process(self.plan.urls, Stage("rewrite", self._rewrite, 1, self.queue_size, skip_failed=False))
+        self._commit()
+        return self._results
+
+    def migrate_urls(self, urls: Iterable[str],
+                     on_task: Optional[Callable[[ImageTask], None]] = None) -> Dict[str, ImageTask]:
+        """
+        只下载、校验和上传一批URL，不读取或修改任何Markdown文件（分片运行的第一阶段）
+        :param urls: 图片URL
+        :param on_task: 每个URL处理完成后在收集线程中调用，用于记录进度
+        :return: 以URL为键的处理结果
+        """
+        collected: Dict[str, ImageTask] = {}
+
+        def collect(task: ImageTask) -> List[ImageTask]:
+            self._release(task)
+            collected[task.url] = task
+            if on_task:
+                on_task(task)
+            return []
+
+        self._process(urls, Stage("collect", collect, 1, self.queue_size, skip_failed=False))
+        return collected
+
+    def apply_results(self, md_files: Iterable[str],
+                      tasks: Dict[str, ImageTask]) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        把已完成的处理结果回写到一批Markdown文件，不发起网络请求（分片运行的第二阶段）
+        :param md_files: Markdown文件路径
+        :param tasks: 以URL为键的处理结果，其他URL保持不变
+        :return: 以文件路径为键的处理结果
+        """
+        self._prepare(md_files, set(tasks))
+        for url in self.plan.urls:
+            self._rewrite(tasks[url])
+        self._commit()
+        return self._results
+
+    def _prepare(self, md_files: Iterable[str], only_urls: Optional[Set[str]]):
+        self.plan = build_plan(md_files, self._extractor(only_urls))
+        for key, error in self.plan.errors.items():
+            self._results[key] = {"success": [], "failed": [{"url": "", "error": error}]}
+        for key, file_plan in self.plan.files.items():
+            state = _FileState(key=key, plan=file_plan, pending=len(file_plan.urls))
+            self._files[key] = state
+            if not file_plan.urls:
+                self._finish(state)
+
+    def _process(self, urls: Iterable[str], terminal: Stage):
+        """让每个URL依次经过下载、校验、[优化]、上传阶段，最后交给 terminal 阶段"""
+        stages = [
+            Stage("download", self._download, self.download_workers, self.queue_size),
+            Stage("verify", self._verify, self._verify_workers(), self.queue_size),
+        ]
+        optimizer = getattr(self.downloader, "optimizer", None)
+        if optimizer:
+            workers = self.optimize_workers or optimizer.workers or os.cpu_count() or 1
+            stages.append(Stage("optimize", self._optimize, workers, self.queue_size))
+        stages += [
+            Stage("upload", self._upload, self.upload_workers, self.queue_size),
+            terminal,
+        ]
+        for upstream, downstream in zip(stages, stages[1:]):
+            upstream.next_stage = downstream
+        for stage in stages:
+            stage.start()
+
+        for url in urls:
+            stages[0].put(ImageTask(url=url))
+        stages[0].close()
+
+        for stage in stages:
+            stage.join()
+
+    def dry_run(self, md_files: Iterable[str],
+                only_urls: Optional[Set[str]] = None) -> DryRunReport:
+        """
+        只做规划：汇总URL映射（迁移清单中已有记录的URL给出新URL）和每个文件的改动统计，
+        不下载、不上传、不修改文件
+        :param md_files: Markdown文件路径
+        :param only_urls: 只统计这些URL，为空时统计文件中所有未迁移的图片
+        :return: 规划结果
+        """
+        self.plan = build_plan(md_files, self._extractor(only_urls))
+        report = DryRunReport(errors=dict(self.plan.errors))
+        for url in self.plan.urls:
+            migrated = self.downloader.resolve_migrated(url)
+            report.url_mapping[url] = migrated[1] if migrated else None
+        for key, file_plan in self.plan.files.items():
+            report.files[key] = rewrite_stats(file_plan.content, file_plan.refs, report.url_mapping)
+        return report
+
+    def _extractor(self, only_urls: Optional[Set[str]]) -> Callable:
+        extract = self.downloader.extract_image_refs
+        if only_urls is None:
+            return extract
+        return lambda content: [ref for ref in extract(content) if ref.url in only_urls]
+
+    def _verify_workers(self) -> int:
+        verifier = getattr(self.downloader, "verifier", None)
+        if verifier:
+            # 深度校验在进程池中执行，提交线程数与进程数一致才能让进程池保持忙碌
+            return max(self.verify_workers, verifier.workers or os.cpu_count() or 1)
+        return self.verify_workers
+
+    def _download(self, task: ImageTask) -> List[ImageTask]:
+        revalidate = getattr(self.downloader, "revalidate", False)
+        # 迁移清单中已完成的URL不再发起任何请求；重新确认模式下先用条件请求确认源图片未变化
+        migrated = None if revalidate else self.downloader.resolve_migrated(task.url)
+        if migrated:
+            task.save_path, task.new_url, task.backend = migrated
+            task.note = "迁移清单中已完成"
+            return [task]
+
+        if getattr(self.downloader, "stream_through", False):
+            success, error, task.image = self.downloader.stream_image(task.url)
+            task.error = error
+            return [task]
+
+        success, error, save_path = self.downloader.download_image(task.url)
+        if not success:
+            task.error = error
+            return [task]
+        task.save_path = task.held = save_path
+        if revalidate:
+            # 源图片未变化时摘要不变，沿用已有的上传结果
+            migrated = self.downloader.resolve_migrated(task.url)
+            if migrated:
+                task.save_path, task.new_url, task.backend = migrated
+                task.note = "源图片未变化，迁移清单中已完成"
+        return [task]
+
+    def _verify(self, task: ImageTask) -> List[ImageTask]:
+        # 直通模式的图片在下载时已检查过文件头，没有本地文件可供校验
+        if task.new_url or task.image:
+            return [task]
+        error = self.downloader.check_image(task.save_path)
+        if error:
+            # 在上传之前丢弃损坏的图片，不占用上传配额
+            self.downloader.reject_image(task.url, task.save_path, error)
+            task.error = f"图片校验失败: {error}"
+        return [task]
+
+    def _optimize(self, task: ImageTask) -> List[ImageTask]:
+        if self.downloader.uploader and not task.new_url:
+            task.save_path = self.downloader.optimize_image(task.save_path)
+        return [task]
+
+    def _upload(self, task: ImageTask) -> List[ImageTask]:
+        if self.downloader.uploader and not task.new_url:
+            if task.image:
+                new_url, note, backend = self.downloader.upload_spooled(task.image)
+            else:
+                new_url, note, backend = self.downloader.upload_image(task.save_path)
+            if new_url:
+                task.new_url = new_url
+                task.note = note
+                task.backend = backend
+            else:
+                task.error = "上传失败"
+        return [task]
+
+    def _release(self, task: ImageTask):
+        """释放任务占用的缓冲区和存储中的 pin"""
+        if task.image:
+            task.image.close()
+            task.image = None
+        if task.held:
+            # 上传完成后原图可以从存储中淘汰（启用优化时上传的是优化结果）
+            self.downloader.release_image(task.held, uploaded=bool(task.new_url and not task.error))
+            task.held = ""
+
+    def _rewrite(self, task: ImageTask) -> List[ImageTask]:
+        self._release(task)
+        # 同一个URL的结果应用到所有引用它的文件
+        for key in self.plan.url_files[task.url]:
+            state = self._files[key]
+            if task.error:
+                state.results["failed"].append({
+                    "url": task.url, "error": task.error, "timings": task.timings
+                })
+            else:
+                item = {"url": task.url, "save_path": task.save_path, "timings": task.timings}
+                if task.new_url:
+                    item["new_url"] = task.new_url
+                    state.url_mapping[task.url] = task.new_url
+                if task.note:
+                    item["note"] = task.note
+                if task.backend:
+                    item["backend"] = task.backend
+                state.results["success"].append(item)
+
+            state.pending -= 1
+            if state.pending == 0:
+                self._finish(state)
+        return []
+
+    def _finish(self, state: _FileState):
+        """文件内所有图片处理完毕后计算新内容，等到整批结束时再统一提交"""
+        if state.url_mapping and self.downloader.uploader:
+            try:
+                new_content = self.downloader.replace_image_urls(
+                    state.plan.content, state.url_mapping, state.plan.refs
+                )
+                self._rewrites.append(PendingRewrite(
+                    key=state.key, path=state.plan.path,
+                    original=state.plan.content, content=new_content
+                ))
+            except Exception as e:
+                state.results["failed"].append({
+                    "url": "",
+                    "error": f"更新Markdown文件失败: {str(e)}"
+                })
+        self._results[state.key] = state.results
+
+    def _commit(self):
+        """并行、原子地写回所有改动过的文件，内容未变化的文件跳过"""
+        errors = commit_rewrites(self._rewrites, self.commit_workers)
+        for key, error in errors.items():
+            self._results[key]["failed"].append({
+                "url": "",
+                "error": f"更新Markdown文件失败: {error}"
+            })
+        self._rewrites = []
@@ -0,0 +1,69 @@
+"""
+迁移规划
+
+在发起任何网络请求之前，先扫描全部Markdown文件，汇总所有图片URL。
+每个唯一URL只会被下载和上传一次，得到的新URL再回写到所有引用它的文件中。
+"""
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+from .committer import read_text
+from .tokenizer import ImageRef
+
+
+@dataclass
+class FilePlan:
+    """单个Markdown文件的规划结果"""
+    path: Path
+    content: str
+    urls: List[str]
+    # 图片引用在文档中的位置，回写时直接复用
+    refs: List[ImageRef] = field(default_factory=list)
+
+
+@dataclass
+class MigrationPlan:
+    """整个语料的规划结果"""
+    files: Dict[str, FilePlan] = field(default_factory=dict)
+    # URL -> 引用它的文件列表，按首次出现的顺序排列
+    url_files: Dict[str, List[str]] = field(default_factory=dict)
+    # 文件 -> 读取失败原因
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def urls(self) -> List[str]:
+        """所有唯一的图片URL"""
+        return list(self.url_files)
+
+    @property
+    def reference_count(self) -> int:
+        """所有文件中的图片引用总数（按文件去重后）"""
+        return sum(len(files) for files in self.url_files.values())
+
+
+def build_plan(md_files: Iterable[str],
+               extract_image_refs: Callable[[str], List[ImageRef]]) -> MigrationPlan:
+    """
+    扫描所有Markdown文件并生成迁移规划
+    :param md_files: Markdown文件路径
+    :param extract_image_refs: 从Markdown内容中提取图片引用的函数
+    :return: 迁移规划
+    """
+    plan = MigrationPlan()
+    for md_file in md_files:
+        key = str(md_file)
+        md_path = Path(md_file)
+        try:
+            content = read_text(md_path)
+        except Exception as e:
+            plan.errors[key] = f"读取文件失败: {str(e)}"
+            continue
+
+        refs = extract_image_refs(content)
+        # 同一文件中重复引用的URL只保留一次
+        urls = list(dict.fromkeys(ref.url for ref in refs))
+        plan.files[key] = FilePlan(path=md_path, content=content, urls=urls, refs=refs)
+        for url in urls:
+            plan.url_files.setdefault(url, []).append(key)
+    return plan
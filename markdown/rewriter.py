@@ -0,0 +1,38 @@
+"""
+Markdown 图片链接的替换
+
+提取与替换共用分词器给出的图片链接位置信息：提取时记录每个URL在文档中的偏移，
+替换时按偏移一次性拼接出新文档，耗时只与文档长度相关，与映射的URL数量无关。
+"""
+from typing import Dict, Iterable, Optional
+
+from .tokenizer import ImageRef, find_image_refs
+
+
+def rewrite_image_urls(content: str, url_mapping: Dict[str, str],
+                       refs: Optional[Iterable[ImageRef]] = None) -> str:
+    """
+    单次扫描替换文档中的图片URL
+    :param content: 原始Markdown内容
+    :param url_mapping: 原始URL到新URL的映射
+    :param refs: 已知的图片引用位置，为空时重新查找
+    :return: 更新后的Markdown内容
+    """
+    if not url_mapping:
+        return content
+    if refs is None:
+        refs = find_image_refs(content)
+
+    pieces = []
+    last = 0
+    for ref in refs:
+        new_url = url_mapping.get(ref.url)
+        if new_url is None:
+            continue
+        pieces.append(content[last:ref.start])
+        pieces.append(new_url)
+        last = ref.end
+    if not pieces:
+        return content
+    pieces.append(content[last:])
+    return ''.join(pieces)
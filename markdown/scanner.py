@@ -0,0 +1,208 @@
+"""
+增量扫描
+
+用 os.scandir 以生成器方式遍历目录，并借助迁移清单中的文件索引
+（路径、mtime、大小、内容哈希、图片URL）跳过上次扫描后未变化的文件。
+只有 mtime 或大小变化的文件才会被重新读取；其中内容哈希也没变的只更新索引，
+真正变化的文件在进程池中解析。
+"""
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from storage.manifest import FileRecord, MigrationManifest
+from .tokenizer import find_image_refs
+
+
+def iter_markdown_files(root: str, suffix: str = ".md") -> Iterator[Path]:
+    """
+    逐个产出目录下的Markdown文件，不预先构建完整列表
+    :param root: 根目录
+    :param suffix: 文件扩展名（不区分大小写）
+    """
+    stack = [str(root)]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(suffix) and entry.is_file():
+                        yield Path(entry.path)
+                except OSError:
+                    continue
+        # 逆序入栈，使遍历顺序与目录中的顺序一致
+        stack.extend(reversed(subdirs))
+
+
+def index_file(path: str, known_digest: Optional[str] = None) -> Tuple[Optional[FileRecord], str]:
+    """
+    读取并解析单个文件，在工作进程中执行
+    :param path: 文件路径
+    :param known_digest: 索引中记录的内容哈希，内容未变时不再解析，返回的 urls 为 None
+    :return: (扫描记录, 错误信息)，读取失败时记录为空、错误信息非空
+    """
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        urls = None
+        if digest != known_digest:
+            content = data.decode('utf-8')
+            urls = list(dict.fromkeys(ref.url for ref in find_image_refs(content)))
+    except (OSError, UnicodeDecodeError) as e:
+        return None, str(e)
+    record = FileRecord(
+        path=path,
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        digest=digest,
+        urls=urls
+    )
+    return record, ""
+
+
+@dataclass
+class ScanResult:
+    """一次增量扫描的结果"""
+    # 仍有待迁移图片、需要交给流水线处理的文件
+    pending: List[Path] = field(default_factory=list)
+    total: int = 0
+    # 因 mtime/大小变化而重新读取的文件数
+    reparsed: int = 0
+    # 本次扫描时已不存在、从索引中删除的文件数
+    removed: int = 0
+
+
+class MarkdownScanner:
+    """
+    基于文件索引的增量扫描器
+    :param manifest: 迁移清单，提供时索引在多次运行之间持久化
+    :param is_migrated: 判断URL是否已迁移的函数，所有URL都已迁移的文件不再处理
+    :param workers: 解析进程数，默认使用 CPU 核数
+    :param parallel_threshold: 需要重新解析的文件数达到该值时才启用进程池
+    """
+
+    def __init__(self, manifest: MigrationManifest = None,
+                 is_migrated: Optional[Callable[[str], bool]] = None,
+                 workers: Optional[int] = None, parallel_threshold: int = 64):
+        self.manifest = manifest
+        self.is_migrated = is_migrated or (lambda url: False)
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self._index: Optional[Dict[str, FileRecord]] = None
+
+    @property
+    def index(self) -> Dict[str, FileRecord]:
+        """文件索引，首次访问时从迁移清单加载"""
+        if self._index is None:
+            self._index = self.manifest.load_file_index() if self.manifest else {}
+        return self._index
+
+    def scan(self, root: str) -> ScanResult:
+        """
+        增量扫描目录
+        :param root: Markdown 文件所在的根目录
+        :return: 扫描结果
+        """
+        index = self.index
+        result = ScanResult()
+        seen = set()
+        stale: List[str] = []
+        order: List[str] = []
+
+        for path in iter_markdown_files(root):
+            key = str(path)
+            seen.add(key)
+            order.append(key)
+            result.total += 1
+            record = index.get(key)
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if record and record.mtime_ns == stat.st_mtime_ns and record.size == stat.st_size:
+                continue
+            stale.append(key)
+
+        updated, failed = self._reindex(stale)
+        result.reparsed = len(stale)
+        if self.manifest and updated:
+            self.manifest.record_files(updated)
+
+        removed = [key for key in index if key not in seen]
+        for key in removed:
+            del index[key]
+        if self.manifest and removed:
+            self.manifest.remove_files(removed)
+        result.removed = len(removed)
+
+        for key in order:
+            record = index.get(key)
+            # 读取失败的文件交给流水线，由规划阶段报告错误
+            if key in failed or (record and any(not self.is_migrated(url) for url in record.urls)):
+                result.pending.append(Path(key))
+        return result
+
+    def _reindex(self, paths: List[str]) -> Tuple[List[FileRecord], Dict[str, str]]:
+        """重新解析文件并更新内存索引，返回 (新记录, 读取失败的文件)"""
+        digests = [self.index[path].digest if path in self.index else None for path in paths]
+        if len(paths) >= self.parallel_threshold:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                outputs = list(executor.map(index_file, paths, digests, chunksize=32))
+        else:
+            outputs = [index_file(path, digest) for path, digest in zip(paths, digests)]
+
+        updated: List[FileRecord] = []
+        failed: Dict[str, str] = {}
+        for path, (record, error) in zip(paths, outputs):
+            if record is None:
+                failed[path] = error
+                continue
+            if record.urls is None:
+                # 内容未变（例如只是 touch），沿用原有的URL列表
+                record.urls = self.index[path].urls
+            self.index[path] = record
+            updated.append(record)
+        return updated, failed
+
+    def refresh(self, paths: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        重新索引指定文件，用于监听模式中处理少量变化的文件
+        :param paths: 发生变化的文件路径
+        :return: 每个文件中尚未迁移的图片URL，没有待迁移URL的文件不会出现。
+                 上次下载、上传或回写失败的URL仍留在文件中，会再次返回以便重试
+        """
+        index = self.index
+        existing: List[str] = []
+        removed: List[str] = []
+        for path in dict.fromkeys(str(p) for p in paths):
+            if os.path.isfile(path):
+                existing.append(path)
+            elif path in index:
+                removed.append(path)
+
+        updated, _ = self._reindex(existing)
+        if self.manifest and updated:
+            self.manifest.record_files(updated)
+        for path in removed:
+            del index[path]
+        if self.manifest and removed:
+            self.manifest.remove_files(removed)
+
+        pending: Dict[str, List[str]] = {}
+        for record in updated:
+            urls = [url for url in record.urls if not self.is_migrated(url)]
+            if urls:
+                pending[record.path] = urls
+        return pending
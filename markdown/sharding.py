@@ -0,0 +1,233 @@
+"""
+分片迁移
+
+多个工作进程（可以位于共享同一个笔记目录的不同主机上）通过共享目录中的租约协调，
+共同完成一次迁移：
+
+1. plan：第一个获得租约的进程扫描全部文件，把URL和文件按哈希分到固定数量的分片，
+   写入 plan.json，其他进程直接读取，保证所有进程看到相同的分片；
+2. urls-N：各进程领取URL分片，下载、校验并上传，结果写入 urls-N.json；
+3. files-N：所有URL分片完成后，各进程领取文件分片，用全部URL分片的结果回写文件，
+   结果写入 files-N.json。
+
+每个任务只在结果文件不存在时处理。持有租约的进程通过心跳续期，进程崩溃后租约过期，
+其他进程接管它的分片；结果文件原子写入，被重复处理的分片只会得到相同的结果。
+处理URL分片时每完成一个URL就追加到共享目录中的进度文件，接管的进程跳过其中已上传的URL。
+"""
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from utils.lease import LeaseStore
+from utils.metrics import metrics
+from .committer import atomic_write_text
+from .pipeline import ImageTask, MigrationPipeline
+from .planner import build_plan
+from .scanner import iter_markdown_files
+
+# 写入分片结果的任务字段
+_TASK_FIELDS = ("save_path", "new_url", "error", "note", "backend")
+
+
+def shard_of(key: str, shards: int) -> int:
+    """按稳定哈希计算键所属的分片，所有主机上的结果一致"""
+    return int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % shards
+
+
+def collect_shard_results(root: str, shard_dir: str) -> Dict[str, Dict[str, List[Dict]]]:
+    """
+    汇总所有进程写入的文件分片结果
+    :param root: Markdown 根目录
+    :param shard_dir: 分片目录
+    :return: 以文件路径为键的处理结果
+    """
+    results: Dict[str, Dict[str, List[Dict]]] = {}
+    for path in sorted(Path(shard_dir).glob("files-*.json")):
+        for key, result in json.loads(path.read_text(encoding="utf-8")).items():
+            results[str(Path(root) / key)] = result
+    return results
+
+
+class ShardedMigration:
+    """
+    基于租约的分片迁移
+    :param downloader: 本进程使用的下载器（各进程使用各自的图片目录和迁移清单）
+    :param root: Markdown 根目录，分片中的文件以相对该目录的路径记录，不同主机的挂载点可以不同
+    :param shard_dir: 所有进程共享的分片目录，保存租约、规划和结果
+    :param worker_id: 本进程的唯一名称
+    :param shards: 分片数，只在创建规划时使用，之后以 plan.json 为准
+    :param lease_ttl: 租约有效期（秒），进程崩溃后最长经过这么久其分片被接管
+    :param poll_interval: 等待其他进程完成分片时的轮询间隔（秒）
+    :param commit_workers: 回写文件时的写入线程数
+    :param sleep: 轮询时使用的等待函数，测试时可替换
+    """
+
+    def __init__(self, downloader, root: str, shard_dir: str, worker_id: str, shards: int = 16,
+                 lease_ttl: float = 60.0, poll_interval: float = 2.0, commit_workers: int = 4,
+                 sleep: Callable[[float], None] = time.sleep):
+        if shards < 1:
+            raise ValueError("分片数必须大于 0")
+        self.downloader = downloader
+        self.root = Path(root)
+        self.shard_dir = Path(shard_dir)
+        self.worker_id = worker_id
+        self.shards = shards
+        self.poll_interval = poll_interval
+        self.commit_workers = commit_workers
+        self._sleep = sleep
+        self.leases = LeaseStore(str(self.shard_dir / "leases"), worker_id, ttl=lease_ttl)
+
+    def run(self) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        参与迁移，直到所有分片完成
+        :return: 本进程回写的文件的处理结果，以文件路径为键
+        """
+        results: Dict[str, Dict[str, List[Dict]]] = {}
+        self.leases.start()
+        try:
+            self._complete(["plan"], lambda _: self._plan())
+            plan = self._load("plan")
+            url_shards = [f"urls-{i}" for i in range(plan["shards"])]
+            file_shards = [f"files-{i}" for i in range(plan["shards"])]
+
+            self._complete(url_shards, lambda name: self._migrate_urls(name, plan["urls"][name]))
+            tasks: Dict[str, ImageTask] = {}
+            for name in url_shards:
+                for url, fields in self._load(name).items():
+                    tasks[url] = ImageTask(url=url, **fields)
+
+            def rewrite(name: str) -> dict:
+                return {
+                    Path(key).relative_to(self.root).as_posix(): result
+                    for key, result in self._rewrite_files(plan["files"][name], tasks).items()
+                }
+
+            # 只返回结果已写入的分片；租约丢失而放弃的分片由接管的进程汇报
+            for data in self._complete(file_shards, rewrite).values():
+                for relative, result in data.items():
+                    results[str(self.root / relative)] = result
+        finally:
+            self.leases.stop()
+        return results
+
+    def _complete(self, names: List[str], work: Callable[[str], dict]) -> Dict[str, dict]:
+        """
+        处理一组任务直到全部完成：能获取租约的由本进程处理，其余等待持有者完成，
+        持有者的租约过期后接管。work 返回任务的结果，确认租约仍属于本进程后才写入
+        :return: 本进程写入了结果的任务及其结果
+        """
+        saved: Dict[str, dict] = {}
+        while True:
+            pending = [name for name in names if not self._done(name)]
+            if not pending:
+                return saved
+            claimed = False
+            for name in pending:
+                lease = self.leases.acquire(name)
+                if lease is None:
+                    continue
+                claimed = True
+                try:
+                    # 获取租约之前可能已有其他进程完成了该任务
+                    if self._done(name):
+                        continue
+                    with metrics.timer("shard_seconds", "处理单个分片的耗时（秒）",
+                                       phase=name.split("-")[0]):
+                        data = work(name)
+                    # 处理期间心跳可能中断（例如进程长时间停顿），租约过期后已被其他进程接管，
+                    # 这时不写入结果，也不算作完成，由新的持有者处理
+                    if lease.lost or not self.leases.renew(lease):
+                        metrics.counter("shards_abandoned_total", "租约丢失后放弃写入的分片数",
+                                        phase=name.split("-")[0]).inc()
+                        continue
+                    self._save(name, data)
+                    saved[name] = data
+                    metrics.counter("shards_completed_total", "本进程完成的分片数",
+                                    phase=name.split("-")[0]).inc()
+                finally:
+                    self.leases.release(lease)
+            if not claimed:
+                self._sleep(self.poll_interval)
+
+    def _plan(self) -> dict:
+        """扫描全部文件，把URL和文件分到各个分片"""
+        files = sorted(str(path) for path in iter_markdown_files(str(self.root)))
+        plan = build_plan(files, self.downloader.extract_image_refs)
+        urls: Dict[str, List[str]] = {f"urls-{i}": [] for i in range(self.shards)}
+        for url in plan.urls:
+            urls[f"urls-{shard_of(url, self.shards)}"].append(url)
+        shard_files: Dict[str, List[str]] = {f"files-{i}": [] for i in range(self.shards)}
+        for key, file_plan in plan.files.items():
+            # 没有待迁移图片的文件不需要回写
+            if file_plan.urls:
+                relative = Path(key).relative_to(self.root).as_posix()
+                shard_files[f"files-{shard_of(relative, self.shards)}"].append(relative)
+        return {"shards": self.shards, "urls": urls, "files": shard_files}
+
+    def _migrate_urls(self, name: str, urls: List[str]) -> dict:
+        # 崩溃的前任持有者已上传的URL直接沿用，不再重复下载和上传
+        data = self._load_progress(name)
+        remaining = [url for url in urls if url not in data]
+        with open(self._progress_path(name, self.worker_id), "a", encoding="utf-8") as progress:
+            def record(task: ImageTask):
+                if task.new_url and not task.error:
+                    entry = {field: getattr(task, field) for field in _TASK_FIELDS}
+                    progress.write(json.dumps({"url": task.url, **entry}, ensure_ascii=False) + "\n")
+                    progress.flush()
+
+            tasks = self._pipeline().migrate_urls(remaining, on_task=record)
+        for url, task in tasks.items():
+            data[url] = {field: getattr(task, field) for field in _TASK_FIELDS}
+        return data
+
+    def _progress_path(self, name: str, worker_id: str) -> Path:
+        # 每个进程写自己的进度文件，被判定崩溃后仍在运行的进程不会与接管者交替写入同一个文件
+        return self.shard_dir / f"{name}.progress-{worker_id}.jsonl"
+
+    def _load_progress(self, name: str) -> Dict[str, dict]:
+        """读取所有进程为该分片记录的已完成URL"""
+        data: Dict[str, dict] = {}
+        for path in sorted(self.shard_dir.glob(f"{name}.progress-*.jsonl")):
+            for line in path.read_text(encoding="utf-8").splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 进程崩溃时最后一行可能只写了一半
+                    continue
+                data[entry.pop("url")] = entry
+        return data
+
+    def _rewrite_files(self, files: List[str],
+                       tasks: Dict[str, ImageTask]) -> Dict[str, Dict[str, List[Dict]]]:
+        paths = [str(self.root / relative) for relative in files]
+        return self._pipeline().apply_results(paths, tasks)
+
+    def _pipeline(self) -> MigrationPipeline:
+        return MigrationPipeline(
+            self.downloader,
+            download_workers=self.downloader.download_workers,
+            upload_workers=self.downloader.upload_workers,
+            queue_size=self.downloader.queue_size,
+            commit_workers=self.commit_workers
+        )
+
+    def _result_path(self, name: str) -> Path:
+        return self.shard_dir / f"{name}.json"
+
+    def _done(self, name: str) -> bool:
+        return self._result_path(name).exists()
+
+    def _save(self, name: str, data: dict):
+        # 先写临时文件再原子替换，其他进程只会看到完整的结果
+        atomic_write_text(self._result_path(name), json.dumps(data, ensure_ascii=False))
+        # 结果已经完整写入，进度文件不再需要
+        for path in self.shard_dir.glob(f"{name}.progress-*.jsonl"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+    def _load(self, name: str) -> dict:
+        return json.loads(self._result_path(name).read_text(encoding="utf-8"))
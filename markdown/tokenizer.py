@@ -0,0 +1,144 @@
+"""
+Markdown 图片引用分词器
+
+单遍扫描文档，识别以下形式的图片引用并给出URL在文档中的偏移：
+    ![alt](url)、![alt](url "title")、![alt](<url with spaces>)
+    ![alt][ref]、![alt][]、![ref] 以及对应的 [ref]: url "title" 定义
+    <img src="url">
+围栏代码块（``` 或 ~~~）和行内代码中的内容会被跳过。
+所有正则都只使用否定字符类，不存在回溯，耗时与文档长度成线性关系。
+"""
+import re
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Pattern, Set
+
+# 单个主正则按出现顺序匹配所有关心的记号：
+# 围栏代码块起始行、链接引用定义行、行内代码、图片（含目标或引用标签）、HTML图片标签
+# HTML标签可以跨行，但不会越过空行或另一个 <，正文中未闭合的 "<img" 不会吞掉后面的内容
+_TOKEN = re.compile(
+    r'^ {0,3}(?P<fence>`{3,}|~{3,})[^\n]*$'
+    r'|^ {0,3}\[(?P<label>(?:[^\[\]\n\\]|\\.)+)\]:[ \t]*'
+    r'(?:<(?P<angle>[^<>\n]*)>|(?P<url>[^\s<>][^\s]*))'
+    r'(?:[ \t]+(?:"[^"\n]*"|\'[^\'\n]*\'|\([^()\n]*\)))?[ \t]*$'
+    r'|(?P<code>`+)'
+    r'|!\[(?P<alt>(?:[^\[\]\n\\]|\\.|\[[^\[\]\n]*\])*)\]'
+    r'(?:\([ \t]*(?:<(?P<dest_angle>[^<>\n]*)>'
+    r'|(?P<dest>(?:[^\s()\\]|\\.|\((?:[^\s()\\]|\\.)*\))+))?'
+    r'(?:[ \t]+(?:"[^"\n]*"|\'[^\'\n]*\'|\([^()\n]*\)))?[ \t]*\)'
+    r'|\[(?P<ref>(?:[^\[\]\n\\]|\\.)*)\])?'
+    r'|<img\b(?P<attrs>(?:[^<>\n]|\n(?![ \t]*\n))*)>',
+    re.IGNORECASE | re.MULTILINE
+)
+_SRC_ATTR = re.compile(
+    r'\bsrc\s*=\s*(?:"(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\'|(?P<bare>[^\s"\'>]+))',
+    re.IGNORECASE
+)
+
+
+class ImageRef(NamedTuple):
+    """文档中的一处图片引用，start/end 为URL本身在文档中的偏移"""
+    url: str
+    start: int
+    end: int
+    kind: str = "inline"  # inline / reference / html
+
+
+def _normalize_label(label: str) -> str:
+    return ' '.join(label.split()).casefold()
+
+
+@lru_cache(maxsize=None)
+def _closing_fence(marker: str) -> Pattern:
+    """与起始标记字符相同、长度不小于它的围栏结束行"""
+    return re.compile(
+        r'^ {0,3}' + re.escape(marker[0]) + '{' + str(len(marker)) + r',}[ \t]*$',
+        re.MULTILINE
+    )
+
+
+def iter_image_refs(content: str) -> Iterator[ImageRef]:
+    """
+    单遍扫描文档，依次产出图片引用
+
+    行内图片和HTML图片按出现顺序产出；引用式图片的URL位于定义处，
+    在扫描结束、所有定义都已知之后产出。
+    """
+    definitions: Dict[str, ImageRef] = {}
+    used_labels: List[str] = []
+    length = len(content)
+    pos = 0
+
+    while pos < length:
+        match = _TOKEN.search(content, pos)
+        if not match:
+            break
+        pos = match.end()
+
+        if match.group('fence'):
+            # 跳到围栏结束行之后，未闭合的围栏延续到文档末尾
+            closing = _closing_fence(match.group('fence')).search(content, pos)
+            pos = closing.end() if closing else length
+            continue
+
+        if match.group('label') is not None:
+            group = 'angle' if match.group('angle') is not None else 'url'
+            label = _normalize_label(match.group('label'))
+            # 同名定义以第一个为准
+            if label not in definitions:
+                definitions[label] = ImageRef(
+                    match.group(group), match.start(group), match.end(group), "reference"
+                )
+            continue
+
+        if match.group('code'):
+            # 跳过同一行内由相同数量反引号闭合的行内代码
+            ticks = match.group('code')
+            line_end = content.find('\n', pos)
+            if line_end == -1:
+                line_end = length
+            close = content.find(ticks, pos, line_end)
+            while close != -1 and content.startswith('`', close + len(ticks)):
+                close = content.find(ticks, close + len(ticks) + 1, line_end)
+            if close != -1:
+                pos = close + len(ticks)
+            continue
+
+        if match.group('attrs') is not None:
+            src = _SRC_ATTR.search(match.group('attrs'))
+            if src:
+                group = src.lastgroup
+                offset = match.start('attrs')
+                url_start = offset + src.start(group)
+                url_end = offset + src.end(group)
+                url = content[url_start:url_end]
+                if url.strip():
+                    yield ImageRef(url, url_start, url_end, "html")
+            else:
+                # 没有 src 的不是图片标签，从 "<img" 之后继续扫描，标签内的图片语法不会被跳过
+                pos = match.start() + len("<img")
+            continue
+
+        for group in ('dest', 'dest_angle'):
+            if match.group(group):
+                yield ImageRef(match.group(group), match.start(group), match.end(group))
+                break
+        else:
+            ref = match.group('ref')
+            if ref is not None:
+                # ![alt][] 使用 alt 作为标签
+                used_labels.append(_normalize_label(ref or match.group('alt')))
+            elif pos >= length or content[pos] != '(':
+                # 简写形式 ![ref]
+                used_labels.append(_normalize_label(match.group('alt')))
+
+    emitted: Set[str] = set()
+    for label in used_labels:
+        ref = definitions.get(label)
+        if ref and label not in emitted:
+            emitted.add(label)
+            yield ref
+
+
+def find_image_refs(content: str) -> List[ImageRef]:
+    """按文档位置排序的全部图片引用"""
+    return sorted(iter_image_refs(content), key=lambda ref: ref.start)
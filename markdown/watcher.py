@@ -0,0 +1,167 @@
+"""
+监听模式
+
+长时间运行，监听Markdown文件的修改，在文件保存后几秒内迁移新增的图片。
+安装了 watchdog 时使用系统文件事件（Linux 上为 inotify），否则定期轮询
+文件的 mtime 和大小。同一文件的连续修改会被合并（防抖），文件停止变化
+debounce 秒后才处理。启动时先迁移已有文件中尚未迁移的图片；之后每次处理变化的文件时，
+文件中所有尚未迁移的URL（包括之前下载、上传或回写失败的）都会再次尝试。
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .image_downloader import MarkdownImageDownloader
+from .scanner import MarkdownScanner, iter_markdown_files
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watchdog 为可选依赖，缺失时退回轮询
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    """把 watchdog 事件转发给 MarkdownWatcher"""
+
+    def __init__(self, watcher: "MarkdownWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        for path in (getattr(event, 'src_path', ''), getattr(event, 'dest_path', '')):
+            if path:
+                self.watcher.notify(path)
+
+
+class MarkdownWatcher:
+    """
+    监听目录并迁移新增图片
+    :param downloader: 执行下载、上传和回写的下载器
+    :param root: 监听的 Markdown 根目录
+    :param scanner: 文件索引，默认使用下载器的迁移清单创建
+    :param debounce: 文件停止变化多少秒后再处理
+    :param poll_interval: 轮询模式下两次检查之间的秒数
+    :param use_watchdog: 是否优先使用 watchdog 的文件事件
+    :param on_result: 每批文件处理完成后的回调，参数为以文件路径为键的处理结果
+    """
+
+    def __init__(self, downloader: MarkdownImageDownloader, root: str,
+                 scanner: MarkdownScanner = None, debounce: float = 1.0,
+                 poll_interval: float = 2.0, use_watchdog: bool = True,
+                 on_result: Optional[Callable[[Dict[str, Dict[str, List[Dict]]]], None]] = None):
+        self.downloader = downloader
+        self.root = str(root)
+        self.scanner = scanner or MarkdownScanner(
+            downloader.manifest, is_migrated=downloader.is_migrated_url
+        )
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_watchdog = use_watchdog and Observer is not None
+        self.on_result = on_result
+
+        # 文件路径 -> 最近一次变化的时间
+        self._changed: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        # 轮询模式下的文件快照：路径 -> (mtime_ns, 大小)
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+
+    def notify(self, path: str):
+        """记录一次文件变化"""
+        if not str(path).lower().endswith('.md'):
+            return
+        with self._lock:
+            self._changed[str(path)] = time.monotonic()
+        self._wakeup.set()
+
+    def take_due(self, now: Optional[float] = None) -> List[str]:
+        """取出已经稳定超过 debounce 秒的文件"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due = [path for path, changed in self._changed.items() if now - changed >= self.debounce]
+            for path in due:
+                del self._changed[path]
+        return due
+
+    def process(self, paths: List[str]) -> Dict[str, Dict[str, List[Dict]]]:
+        """
+        迁移指定文件中尚未迁移的图片
+        :return: 以文件路径为键的处理结果，没有待迁移图片时为空
+        """
+        pending = self.scanner.refresh(paths)
+        if not pending:
+            return {}
+        only_urls = {url for urls in pending.values() for url in urls}
+        return self._migrate(list(pending), only_urls)
+
+    def _migrate(self, paths: List[str],
+                 only_urls: Optional[Set[str]] = None) -> Dict[str, Dict[str, List[Dict]]]:
+        results = self.downloader.process_markdown_files(paths, only_urls=only_urls)
+        if self.on_result:
+            self.on_result(results)
+        return results
+
+    def poll(self):
+        """轮询一次目录，把 mtime 或大小变化、新增和删除的文件记为变化"""
+        current: Dict[str, Tuple[int, int]] = {}
+        for path in iter_markdown_files(self.root):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            current[str(path)] = (stat.st_mtime_ns, stat.st_size)
+        for path, state in current.items():
+            if self._snapshot.get(path) != state:
+                self.notify(path)
+        for path in self._snapshot.keys() - current.keys():
+            self.notify(path)
+        self._snapshot = current
+
+    def run(self):
+        """开始监听，直到调用 stop()"""
+        # 先建立索引，启动前已有但尚未迁移的图片在开始监听后迁移一次
+        pending = self.scanner.scan(self.root).pending
+        observer = None
+        if self.use_watchdog:
+            observer = Observer()
+            observer.schedule(_ChangeHandler(self), self.root, recursive=True)
+            observer.start()
+        else:
+            self.poll()
+            self._changed.clear()
+
+        try:
+            if pending:
+                self._migrate([str(path) for path in pending])
+            while not self._stop.is_set():
+                self._wakeup.wait(self._next_wait())
+                self._wakeup.clear()
+                if not self.use_watchdog:
+                    self.poll()
+                due = self.take_due()
+                if due:
+                    self.process(due)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def _next_wait(self) -> Optional[float]:
+        """距离下一次需要检查的秒数，None 表示一直等到下一个文件事件"""
+        wait = None if self.use_watchdog else self.poll_interval
+        with self._lock:
+            if self._changed:
+                oldest = min(self._changed.values())
+                remaining = max(0.0, oldest + self.debounce - time.monotonic())
+                wait = remaining if wait is None else min(wait, remaining)
+        return wait
+
+    def stop(self):
+        """停止监听"""
+        self._stop.set()
+        self._wakeup.set()
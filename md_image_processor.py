@@ -1,30 +1,37 @@
 import os
-import re
 import requests
 import hashlib
 from pathlib import Path
 from urllib.parse import unquote, urlparse
 import oss2  # 假设使用阿里云OSS
 from concurrent.futures import ThreadPoolExecutor
+from markdown.scanner import iter_markdown_files
+from markdown.tokenizer import iter_image_refs
+from storage.image_verifier import ImageVerifier
+from utils.image_types import SNIFF_BYTES, check_image_header
 
 class MDImageProcessor:
-    def __init__(self, md_folder, image_folder):
+    def __init__(self, md_folder, image_folder, max_image_size=None, chunk_size=64 * 1024,
+                 verifier=None):
         self.md_folder = Path(md_folder)
         self.image_folder = Path(image_folder)
         self.image_folder.mkdir(parents=True, exist_ok=True)
+        # 单张图片的最大字节数，None 表示不限制
+        self.max_image_size = max_image_size
+        self.chunk_size = chunk_size
+        # 与 MarkdownImageDownloader 共用的深度校验器，在进程池中解码图片
+        self.verifier = verifier or ImageVerifier()
         
     def get_md_files(self):
         """获取所有MD文件"""
-        return list(self.md_folder.glob('**/*.md'))
+        return list(iter_markdown_files(str(self.md_folder)))
     
     def extract_image_urls(self, md_file):
         """提取MD文件中的图片链接"""
         with open(md_file, 'r', encoding='utf-8') as f:
             content = f.read()
-        # 匹配图片链接，包括行内图片和引用图片
-        pattern = r'!\[.*?\]\((.*?)\)|!\[.*?\]\[.*?\]|(?<=\[.*?\]:\s)(http[s]?://.*?(?:png|jpg|jpeg|gif))'
-        urls = re.findall(pattern, content)
-        return [url for url in urls if url]
+        # 与 MarkdownImageDownloader 共用分词器，包括行内图片和引用图片
+        return [ref.url for ref in iter_image_refs(content)]
     
     def get_safe_filename(self, url):
         """生成安全的文件名"""
@@ -44,25 +51,57 @@ class MDImageProcessor:
             if save_path.exists():
                 return True, save_path
                 
-            response = requests.get(url, timeout=30)
-            if response.status_code == 200:
-                with open(save_path, 'wb') as f:
-                    f.write(response.content)
-                return True, save_path
-            return False, None
+            with requests.get(url, timeout=30, stream=True) as response:
+                if response.status_code != 200:
+                    return False, None
+                declared = response.headers.get('Content-Length', '')
+                if self.max_image_size and declared.isdigit() and int(declared) > self.max_image_size:
+                    print(f"图片超过大小限制: {url}")
+                    return False, None
+
+                # 先写入临时文件，完整下载后再改名，避免留下半截文件
+                part_path = save_path.with_name(save_path.name + '.part')
+                content_type = response.headers.get('Content-Type', '')
+                size = 0
+                head = b''
+                checked = False
+                error = None
+                with open(part_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        size += len(chunk)
+                        if self.max_image_size and size > self.max_image_size:
+                            break
+                        if len(head) < SNIFF_BYTES:
+                            head += chunk[:SNIFF_BYTES - len(head)]
+                        if not checked and len(head) >= SNIFF_BYTES:
+                            # 错误页等非图片内容在第一个分块就能发现，不必读完整个响应体
+                            error = check_image_header(head, content_type)
+                            checked = True
+                            if error:
+                                break
+                        f.write(chunk)
+                if self.max_image_size and size > self.max_image_size:
+                    part_path.unlink()
+                    print(f"图片超过大小限制: {url}")
+                    return False, None
+                # 响应比文件头还短时在读完后检查
+                if not checked:
+                    error = check_image_header(head, content_type)
+                if error:
+                    part_path.unlink()
+                    print(f"{error}: {url}")
+                    return False, None
+                os.replace(part_path, save_path)
+            return True, save_path
         except Exception as e:
             print(f"下载失败: {url}, 错误: {str(e)}")
             return False, None
     
     def verify_image(self, image_path):
-        """验证图片是否完整"""
-        try:
-            from PIL import Image
-            with Image.open(image_path) as img:
-                img.verify()
+        """验证图片是否完整，未安装 Pillow 时跳过"""
+        if not self.verifier.available:
             return True
-        except Exception:
-            return False
+        return self.verifier.verify(str(image_path)) is None
     
     def upload_to_oss(self, local_file, bucket):
         """上传文件到OSS"""
@@ -93,12 +132,16 @@ class MDImageProcessor:
                 if success and file_path:
                     downloaded_files.append(file_path)
         
-        # 验证所有下载的图片
+        # 在校验器的进程池中并行解码验证下载的图片
+        if not self.verifier.available:
+            print("未安装 Pillow，跳过深度校验")
+            return downloaded_files
         valid_files = []
-        for file_path in downloaded_files:
-            if self.verify_image(file_path):
+        errors = self.verifier.verify_many(str(file_path) for file_path in downloaded_files)
+        for file_path, error in zip(downloaded_files, errors):
+            if error is None:
                 valid_files.append(file_path)
             else:
-                print(f"图片验证失败: {file_path}")
-                
+                print(f"图片验证失败: {file_path}, {error}")
+
         return valid_files
\ No newline at end of file
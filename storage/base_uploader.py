@@ -1,17 +1,282 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlparse
+
+from utils.metrics import metrics
+from utils.rate_limiter import RateLimit, RateLimiter, Slot
+
+_limiter_lock = threading.Lock()
+
+
+@dataclass
+class UploadItem:
+    """一个待上传的文件，提供 stream 时从可定位的流读取，不读取 file_path"""
+    file_path: str
+    remote_path: str
+    stream: Optional[BinaryIO] = None
+
+    @property
+    def size(self) -> int:
+        """文件或流的字节数，无法获取时返回 0"""
+        try:
+            if self.stream is not None:
+                position = self.stream.tell()
+                size = self.stream.seek(0, os.SEEK_END)
+                self.stream.seek(position)
+                return size
+            return os.path.getsize(self.file_path)
+        except (OSError, ValueError):
+            return 0
+
+
+@dataclass
+class UploadResult:
+    """单个文件的上传结果"""
+    item: UploadItem
+    url: str = ""
+    error: str = ""
+    note: str = ""
+    backend: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.url) and not self.error
 
 
 class BaseUploader(ABC):
+    # 后端名称，用于迁移清单中区分不同的存储
+    name: str = ""
+    # 该后端生成的图片URL所在的域名，指向这些域名的图片视为已迁移
+    remote_hosts: Tuple[str, ...] = ()
+    # 后端的上传限速策略，为空表示不限速
+    rate_limits: Tuple[RateLimit, ...] = ()
+    _rate_limiter: Optional[RateLimiter] = None
+    # 后端允许的单个文件最大字节数，None 表示不限制
+    max_file_size: Optional[int] = None
+    # 批量上传时的默认并发数
+    max_concurrency: int = 4
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """该上传器实例的限速器，所有上传线程共享同一个实例"""
+        with _limiter_lock:
+            if self._rate_limiter is None:
+                self._rate_limiter = RateLimiter(self.rate_limits)
+            return self._rate_limiter
+
+    def share_quota(self, workers: int):
+        """
+        多个进程使用同一个账号时，每个进程只使用 1/workers 的上传配额，
+        合计不超过后端的限制；需要在第一次上传之前调用
+
+        Args:
+            workers: 共用配额的进程数
+        """
+        if workers > 1:
+            self.rate_limits = tuple(
+                RateLimit(max(1, limit.limit // workers), limit.period) for limit in self.rate_limits
+            )
+            self._rate_limiter = None
+
+    @property
+    def backend_name(self) -> str:
+        return self.name or type(self).__name__
+
+    @property
+    def backend_names(self) -> Tuple[str, ...]:
+        """可能处理上传的全部后端名称，组合多个后端的上传器会返回多个"""
+        return (self.backend_name,)
+
+    def owns_url(self, url: str) -> bool:
+        """
+        判断URL是否已位于该后端
+
+        Args:
+            url: 图片URL
+
+        Returns:
+            bool: URL的域名属于该后端时返回 True
+        """
+        return urlparse(url).hostname in self.remote_hosts
+
     @abstractmethod
     def upload_file(self, file_path: str, remote_path: str) -> str:
         """
         上传文件到远程存储
-        
+
         Args:
             file_path: 本地文件路径
             remote_path: 远程存储路径
-            
+
         Returns:
             str: 文件的访问URL
         """
         pass
+
+    def upload_stream(self, stream: BinaryIO, remote_path: str) -> str:
+        """
+        从文件对象上传；默认先写入临时文件再调用 upload_file，
+        能直接发送文件对象的后端应覆盖此方法以避免落地
+
+        Args:
+            stream: 可读的二进制文件对象，从当前位置读到末尾
+            remote_path: 远程存储路径
+
+        Returns:
+            str: 文件的访问URL
+        """
+        suffix = os.path.splitext(remote_path)[1]
+        fd, tmp_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(stream, f)
+            return self.upload_file(tmp_path, remote_path)
+        finally:
+            os.unlink(tmp_path)
+
+    def _upload(self, item: UploadItem) -> UploadResult:
+        """
+        执行一次上传，不做限速；子类可覆盖以返回备注等附加信息
+
+        Raises:
+            Exception: 上传失败
+        """
+        if item.stream is not None:
+            # 多后端重试时同一个流会被读取多次
+            item.stream.seek(0)
+            url = self.upload_stream(item.stream, item.remote_path)
+        else:
+            url = self.upload_file(item.file_path, item.remote_path)
+        if not url:
+            raise Exception("上传失败")
+        return UploadResult(item, url=url)
+
+    def _run_upload(self, item: UploadItem, slot: Slot) -> UploadResult:
+        """
+        执行上传并把异常转换为失败结果
+
+        Args:
+            item: 待上传的文件
+            slot: 调用前已获取的限速配额
+        """
+        backend = self.backend_name
+        start = time.perf_counter()
+        try:
+            if item.stream is None:
+                # 发出请求之前先确认本地文件可读
+                with open(item.file_path, "rb"):
+                    pass
+        except OSError as e:
+            # 请求没有发出，退还配额；连接失败、超时等网络错误可能已被服务端计数，不退还
+            self.rate_limiter.refund(slot)
+            result = UploadResult(item, error=str(e))
+        else:
+            try:
+                result = self._upload(item)
+            except Exception as e:
+                result = UploadResult(item, error=str(e))
+        metrics.histogram("upload_request_seconds", "上传单个文件的耗时（秒）",
+                          backend=backend).observe(time.perf_counter() - start)
+        metrics.counter("upload_requests_total", "上传请求数",
+                        backend=backend, status="ok" if result.ok else "error").inc()
+        if result.ok:
+            size = item.size
+            metrics.counter("upload_bytes_total", "上传的字节数", backend=backend).inc(size)
+        result.backend = backend
+        return result
+
+    def _observe_wait(self, seconds: float):
+        metrics.histogram("rate_limiter_wait_seconds", "等待上传限速配额的耗时（秒）",
+                          backend=self.backend_name).observe(seconds)
+
+    def upload_item(self, item: UploadItem) -> UploadResult:
+        """
+        等待限速配额后上传单个文件，失败时不抛出异常
+
+        Args:
+            item: 待上传的文件
+
+        Returns:
+            UploadResult: 上传结果
+        """
+        start = time.perf_counter()
+        slot = self.rate_limiter.acquire()
+        self._observe_wait(time.perf_counter() - start)
+        return self._run_upload(item, slot)
+
+    def upload_many(self, items: Iterable[UploadItem],
+                    max_workers: Optional[int] = None) -> Iterator[UploadResult]:
+        """
+        并发上传多个文件，按完成顺序逐个产出结果
+
+        同时提交的任务数不超过并发数的两倍，可以传入数量很大的迭代器。
+
+        Args:
+            items: 待上传的文件
+            max_workers: 并发数，默认使用 max_concurrency
+
+        Returns:
+            Iterator[UploadResult]: 上传结果
+        """
+        workers = max_workers or self.max_concurrency
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for item in items:
+                pending.add(executor.submit(self.upload_item, item))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    async def upload_item_async(self, item: UploadItem) -> UploadResult:
+        """
+        在 asyncio 中上传单个文件，等待配额时不阻塞事件循环
+
+        Args:
+            item: 待上传的文件
+
+        Returns:
+            UploadResult: 上传结果
+        """
+        start = time.perf_counter()
+        slot = await self.rate_limiter.acquire_async()
+        self._observe_wait(time.perf_counter() - start)
+        return await asyncio.to_thread(self._run_upload, item, slot)
+
+    async def upload_many_async(self, items: Iterable[UploadItem],
+                                max_workers: Optional[int] = None) -> AsyncIterator[UploadResult]:
+        """
+        在 asyncio 中并发上传多个文件，按完成顺序逐个产出结果
+
+        Args:
+            items: 待上传的文件
+            max_workers: 并发数，默认使用 max_concurrency
+
+        Returns:
+            AsyncIterator[UploadResult]: 上传结果
+        """
+        workers = max_workers or self.max_concurrency
+        pending = set()
+        for item in items:
+            pending.add(asyncio.ensure_future(self.upload_item_async(item)))
+            if len(pending) >= workers:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
@@ -0,0 +1,243 @@
+"""
+图片优化
+
+在上传之前去除 EXIF、重新压缩 PNG/JPEG、可选转换为 WebP，并缩小超过
+大小限制的图片。编码是 CPU 密集型操作，在进程池中执行以避开 GIL。
+结果按 原图摘要 + 优化参数 缓存，同一输入不会重复优化。
+
+依赖 Pillow；未安装时 ImageOptimizer.available 为 False，调用方应跳过该阶段。
+"""
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from utils.metrics import metrics
+from .image_store import ImageStore
+from .manifest import MigrationManifest
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 为可选依赖
+    Image = None
+    ImageOps = None
+
+# 支持重新编码的格式，GIF（可能是动图）、SVG、ICO 等保持原样
+_SUPPORTED_FORMATS = ("JPEG", "PNG", "WEBP")
+_FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+# 超过大小限制时每次缩小的比例
+_DOWNSCALE_STEP = 0.75
+_MAX_DOWNSCALE_ROUNDS = 8
+
+
+@dataclass(frozen=True)
+class OptimizeOptions:
+    """图片优化参数"""
+    # JPEG/WebP 的目标质量，None 表示尽量无损（JPEG 保留原量化表，WebP 使用无损模式）
+    quality: Optional[int] = None
+    # 是否转换为 WebP
+    webp: bool = False
+    # 输出的最大字节数，超过时逐步缩小尺寸，None 表示不限制
+    max_bytes: Optional[int] = None
+    # 最长边的最大像素数，None 表示不限制
+    max_dimension: Optional[int] = None
+
+    @property
+    def cache_key(self) -> str:
+        """用于缓存的参数标识"""
+        return f"q={self.quality};webp={int(self.webp)};bytes={self.max_bytes};dim={self.max_dimension}"
+
+
+def _encode(img, fmt: str, options: OptimizeOptions, qtables=None) -> bytes:
+    """按目标格式编码，不写入任何 EXIF 等元数据"""
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if options.quality is None and qtables:
+            # 沿用原图的量化表，避免二次有损压缩
+            img.save(buffer, "JPEG", qtables=qtables, optimize=True, progressive=True)
+        else:
+            img.save(buffer, "JPEG", quality=options.quality or 95, optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        if options.quality is None:
+            img.save(buffer, "WEBP", lossless=True, method=6)
+        else:
+            img.save(buffer, "WEBP", quality=options.quality, method=6)
+    else:
+        img.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def optimize_file(path: str, options: OptimizeOptions) -> Optional[Tuple[bytes, str]]:
+    """
+    优化单张图片，在工作进程中执行
+
+    Args:
+        path: 图片路径
+        options: 优化参数
+
+    Returns:
+        Optional[Tuple[bytes, str]]: (优化后的数据, 扩展名)；
+            格式不支持，或优化后没有变小、无需缩小且原图不含 EXIF 时返回 None
+    """
+    original_size = Path(path).stat().st_size
+    with Image.open(path) as source:
+        fmt = source.format
+        if fmt not in _SUPPORTED_FORMATS or getattr(source, "is_animated", False):
+            return None
+        qtables = getattr(source, "quantization", None) if fmt == "JPEG" else None
+        # 含 EXIF（可能带有 GPS 位置）的原图即使重新编码后没有变小，也要使用去除了元数据的结果
+        has_exif = "exif" in source.info or bool(source.getexif())
+        # 先按 EXIF 方向旋转，去除 EXIF 后图片方向保持不变
+        img = ImageOps.exif_transpose(source)
+        if img is source:
+            img = source.copy()
+
+    target = "WEBP" if options.webp else fmt
+    if options.max_dimension and max(img.size) > options.max_dimension:
+        img.thumbnail((options.max_dimension, options.max_dimension), Image.LANCZOS)
+    data = _encode(img, target, options, qtables)
+
+    # 仍然超过大小限制时逐步缩小尺寸
+    rounds = 0
+    while options.max_bytes and len(data) > options.max_bytes and rounds < _MAX_DOWNSCALE_ROUNDS:
+        width, height = img.size
+        img = img.resize(
+            (max(1, int(width * _DOWNSCALE_STEP)), max(1, int(height * _DOWNSCALE_STEP))),
+            Image.LANCZOS
+        )
+        data = _encode(img, target, options, qtables)
+        rounds += 1
+
+    too_large = bool(options.max_bytes) and original_size > options.max_bytes
+    if len(data) >= original_size and not too_large and target == fmt and not has_exif:
+        return None
+    return data, _FORMAT_EXTENSIONS[target]
+
+
+class ImageOptimizer:
+    """
+    在进程池中优化图片并写回图片存储
+
+    优化后的图片同样按内容摘要存放在 ImageStore 中，原图与结果的对应关系
+    记录在迁移清单里（未提供清单时只在内存中缓存）。
+    """
+
+    def __init__(self, store: Optional[ImageStore] = None, options: OptimizeOptions = OptimizeOptions(),
+                 manifest: MigrationManifest = None, workers: Optional[int] = None):
+        """
+        Args:
+            store: 图片存储，为空时由下载器设置为它自己的图片存储
+            options: 优化参数
+            manifest: 迁移清单，用于跨运行缓存优化结果
+            workers: 进程数，默认使用 CPU 核数
+        """
+        self.store = store
+        self.options = options
+        self.manifest = manifest
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # 原图摘要 -> (结果摘要, 扩展名)
+        self._cache: Dict[str, Tuple[str, str]] = {}
+
+    @property
+    def available(self) -> bool:
+        """是否安装了 Pillow"""
+        return Image is not None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def lookup(self, digest: str) -> Optional[Path]:
+        """
+        查询原图已有的优化结果
+
+        Args:
+            digest: 原图内容摘要
+
+        Returns:
+            Optional[Path]: 优化结果（或无需优化时的原图）在存储中的路径
+        """
+        cached = self._result(digest)
+        if cached is None:
+            return None
+        return self.store.get(*cached)
+
+    def result_digest(self, digest: str) -> Optional[str]:
+        """
+        查询原图优化结果的内容摘要，不访问图片存储
+
+        Args:
+            digest: 原图内容摘要
+
+        Returns:
+            Optional[str]: 结果摘要，尚未优化时返回 None
+        """
+        cached = self._result(digest)
+        return cached[0] if cached else None
+
+    def result(self, digest: str) -> Optional[Tuple[str, str]]:
+        """
+        查询原图的优化结果，只查询缓存和迁移清单，不要求结果仍在图片存储中
+
+        Args:
+            digest: 原图内容摘要
+
+        Returns:
+            Optional[Tuple[str, str]]: (结果摘要, 扩展名)，尚未优化时返回 None
+        """
+        return self._result(digest)
+
+    def _result(self, digest: str) -> Optional[Tuple[str, str]]:
+        cached = self._cache.get(digest)
+        if cached is None and self.manifest:
+            cached = self.manifest.get_optimized(digest, self.options.cache_key)
+            if cached:
+                self._cache[digest] = cached
+        return cached
+
+    def optimize(self, save_path: str) -> str:
+        """
+        优化存储中的一张图片
+
+        Args:
+            save_path: 原图在存储中的路径（文件名为内容摘要）
+
+        Returns:
+            str: 应当上传的图片路径，无需优化时返回原路径
+        """
+        path = Path(save_path)
+        digest = path.stem
+        cached = self.lookup(digest)
+        if cached:
+            return str(cached)
+
+        with metrics.timer("optimize_seconds", "优化单张图片的耗时（秒）"):
+            output = self._pool().submit(optimize_file, str(path), self.options).result()
+        if output is None:
+            result_digest, ext, result_path = digest, path.suffix, path
+        else:
+            stored = self.store.put_bytes(*output)
+            metrics.counter("optimize_bytes_saved_total", "优化节省的字节数").inc(
+                max(0, path.stat().st_size - stored.size)
+            )
+            result_digest, ext, result_path = stored.digest, stored.path.suffix, stored.path
+
+        self._cache[digest] = (result_digest, ext)
+        if self.manifest:
+            self.manifest.record_optimized(digest, self.options.cache_key, result_digest, ext)
+        return str(result_path)
+
+    def close(self):
+        """关闭进程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
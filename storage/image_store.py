@@ -0,0 +1,363 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+from utils.image_types import SNIFF_BYTES
+from utils.metrics import metrics
+
+
+@dataclass
+class StoredImage:
+    """已写入存储的图片"""
+    digest: str
+    path: Path
+    size: int
+    created: bool  # False 表示相同内容此前已经存在
+
+
+class PendingImage:
+    """
+    正在写入的图片：边写入临时文件边计算哈希，提交时再按摘要落位
+    """
+
+    # 保留的文件头字节数，用于判断图片类型
+    HEAD_BYTES = SNIFF_BYTES
+
+    def __init__(self, store: "ImageStore", pin: bool = False):
+        self._store = store
+        self._pin = pin
+        self._hasher = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        fd, tmp_path = tempfile.mkstemp(dir=store.tmp_dir, suffix=".part")
+        self._file = os.fdopen(fd, 'wb')
+        self.tmp_path = Path(tmp_path)
+
+    def write(self, chunk: bytes):
+        if len(self.head) < self.HEAD_BYTES:
+            self.head += chunk[:self.HEAD_BYTES - len(self.head)]
+        self._hasher.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, ext: str) -> StoredImage:
+        """
+        完成写入并移动到以内容摘要命名的位置
+        :param ext: 文件扩展名（包含点号）
+        """
+        self._file.close()
+        return self._store._place(self.tmp_path, self._hasher.hexdigest(), ext, self.size, self._pin)
+
+    def discard(self):
+        """放弃写入并删除临时文件"""
+        self._file.close()
+        try:
+            self.tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 未提交就退出时清理临时文件
+        if not self._file.closed:
+            self.discard()
+
+
+class SpooledImage:
+    """
+    不落地到图片存储的图片：写入内存缓冲区（超过 max_memory 后转存到临时文件），
+    同时计算哈希，用于下载后直接上传的直通模式
+    """
+
+    HEAD_BYTES = PendingImage.HEAD_BYTES
+
+    def __init__(self, max_memory: int = 8 * 1024 * 1024):
+        """
+        Args:
+            max_memory: 保留在内存中的最大字节数，超过后转存到临时文件
+        """
+        self._hasher = hashlib.sha256()
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.size = 0
+        self.head = b""
+        self.digest = ""
+        self.ext = ""
+
+    def write(self, chunk: bytes):
+        if len(self.head) < self.HEAD_BYTES:
+            self.head += chunk[:self.HEAD_BYTES - len(self.head)]
+        self._hasher.update(chunk)
+        self.buffer.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, ext: str) -> "SpooledImage":
+        """
+        完成写入，得到内容摘要，缓冲区回到开头等待读取
+        :param ext: 文件扩展名（包含点号）
+        """
+        self.digest = self._hasher.hexdigest()
+        self.ext = ext
+        self.buffer.seek(0)
+        return self
+
+    @property
+    def name(self) -> str:
+        """与图片存储中相同的文件名：摘要 + 扩展名"""
+        return f"{self.digest}{self.ext}"
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 未提交就退出时释放缓冲区
+        if not self.digest:
+            self.close()
+
+
+@dataclass
+class CacheEntry:
+    """存储中的一个文件"""
+    path: Path
+    size: int
+    # 最近一次使用的时间戳，同时写入文件的 mtime，下次启动时据此恢复使用顺序
+    last_used: float
+    # 是否允许淘汰：None 表示尚未判断，False 在 release(uploaded=True) 后变为 True
+    evictable: Optional[bool] = None
+
+
+class ImageStore:
+    """
+    基于内容哈希的本地图片存储
+
+    文件按 SHA-256 摘要分片存放：root/ab/cd/abcd...ef.png。
+    相同字节只会保存一份。启动时扫描一次分片目录建立内存索引，之后的查找只查询索引，
+    不再逐个检查文件是否存在。
+
+    设置 max_bytes / max_age 后存储作为缓存使用：超出字节预算或长时间未使用时，
+    按最近最少使用的顺序删除已上传的文件；正在处理（被 pin）的文件和尚未上传的文件不会被删除。
+    """
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None, max_age: Optional[float] = None,
+                 evictable: Optional[Callable[[str], bool]] = None, read_only: bool = False):
+        """
+        Args:
+            root: 存储根目录
+            max_bytes: 字节预算，为空时不限制
+            max_age: 超过多少秒未使用的文件会被淘汰，为空时不限制
+            evictable: 判断某个内容摘要能否淘汰（通常是已上传），为空时所有未 pin 的文件都可淘汰
+            read_only: 只读模式（dry-run）：不创建目录，只用于查询已存储的图片
+        """
+        self.root = Path(root)
+        self.tmp_dir = self.root / ".tmp"
+        self.read_only = read_only
+        if not read_only:
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._evictable = evictable
+        # 淘汰判断可能回调到 get（例如查询优化结果），因此使用可重入锁
+        self._lock = threading.RLock()
+        # 文件名 -> 文件信息，按最近使用时间从旧到新排列
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # 文件名 -> pin 计数
+        self._pins: Dict[str, int] = {}
+        self.total_bytes = 0
+        self._bytes_gauge = metrics.gauge("image_store_bytes", "本地图片存储占用的字节数")
+        self._load_index()
+
+    def _load_index(self):
+        """扫描分片目录建立索引，按文件的 mtime 恢复使用顺序"""
+        found = []
+        if not self.root.is_dir():
+            # 只读模式下目录可能还不存在
+            return
+        for shard in self._scan_dirs(self.root):
+            for sub_shard in self._scan_dirs(shard.path):
+                with os.scandir(sub_shard.path) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            stat = entry.stat()
+                            found.append((stat.st_mtime, entry.name,
+                                          CacheEntry(Path(entry.path), stat.st_size, stat.st_mtime)))
+        found.sort(key=lambda item: item[0])
+        for _, name, entry in found:
+            self._entries[name] = entry
+            self.total_bytes += entry.size
+        self._bytes_gauge.set(self.total_bytes)
+
+    @staticmethod
+    def _scan_dirs(path: Path) -> Iterable[os.DirEntry]:
+        # 分片目录名为摘要的两位十六进制前缀，跳过 .tmp 等其他目录
+        with os.scandir(path) as it:
+            return [entry for entry in it if entry.is_dir() and len(entry.name) == 2]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def path_for(self, digest: str, ext: str) -> Path:
+        """根据内容摘要计算存储路径"""
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{ext}"
+
+    def get(self, digest: str, ext: str, pin: bool = False) -> Optional[Path]:
+        """
+        查找已存储的图片，并将其标记为最近使用
+
+        Args:
+            digest: 内容摘要
+            ext: 文件扩展名（包含点号）
+            pin: 找到时同时 pin，处理结束后需要调用 release
+
+        Returns:
+            Optional[Path]: 存在时返回路径，否则返回 None
+        """
+        name = f"{digest}{ext}"
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            entry.last_used = time.time()
+            try:
+                os.utime(entry.path, (entry.last_used, entry.last_used))
+            except FileNotFoundError:
+                # 文件已在存储之外被删除
+                self._drop(name)
+                return None
+            self._entries.move_to_end(name)
+            if pin:
+                self._pins[name] = self._pins.get(name, 0) + 1
+            return entry.path
+
+    def _place(self, tmp_path: Path, digest: str, ext: str, size: int, pin: bool = False) -> StoredImage:
+        """把写完的临时文件移动到摘要路径并加入索引，超出预算时淘汰旧文件"""
+        name = f"{digest}{ext}"
+        path = self.path_for(digest, ext)
+        with self._lock:
+            if pin:
+                # 在淘汰之前 pin，刚写入的文件不会被立即删除
+                self._pins[name] = self._pins.get(name, 0) + 1
+            entry = self._entries.get(name)
+            if entry is not None:
+                # 相同内容已存储，丢弃临时文件
+                tmp_path.unlink()
+                entry.last_used = time.time()
+                self._entries.move_to_end(name)
+                return StoredImage(digest, path, size, created=False)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, path)
+            self._entries[name] = CacheEntry(path, size, time.time())
+            self.total_bytes += size
+            self._bytes_gauge.set(self.total_bytes)
+            self._evict()
+        return StoredImage(digest, path, size, created=True)
+
+    def pin(self, path: str):
+        """标记文件正在处理，pin 期间不会被淘汰；可多次 pin，需要相同次数的 release"""
+        name = Path(path).name
+        with self._lock:
+            self._pins[name] = self._pins.get(name, 0) + 1
+
+    def release(self, path: str, uploaded: bool = False):
+        """
+        解除一次 pin
+
+        Args:
+            path: 文件路径
+            uploaded: 文件已上传，之后可以被淘汰
+        """
+        name = Path(path).name
+        with self._lock:
+            count = self._pins.get(name, 0) - 1
+            if count > 0:
+                self._pins[name] = count
+            else:
+                self._pins.pop(name, None)
+            if uploaded:
+                self._mark_uploaded(name)
+            self._evict()
+
+    def mark_uploaded(self, path: str):
+        """标记文件已上传，之后可以被淘汰"""
+        with self._lock:
+            self._mark_uploaded(Path(path).name)
+            self._evict()
+
+    def _mark_uploaded(self, name: str):
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry.evictable = True
+
+    def remove(self, path: str):
+        """从存储中删除一个文件"""
+        with self._lock:
+            self._drop(Path(path).name)
+
+    def evict(self) -> int:
+        """
+        立即按预算和过期时间淘汰文件
+
+        Returns:
+            int: 淘汰的文件数
+        """
+        with self._lock:
+            return self._evict()
+
+    def _evict(self) -> int:
+        if self.max_bytes is None and self.max_age is None:
+            return 0
+        now = time.time()
+        evicted = 0
+        # 从最久未使用的文件开始，跳过被 pin 或尚未上传的文件
+        for name, entry in list(self._entries.items()):
+            over_budget = self.max_bytes is not None and self.total_bytes > self.max_bytes
+            expired = self.max_age is not None and now - entry.last_used > self.max_age
+            if not (over_budget or expired):
+                break
+            if self._pins.get(name) or not self._can_evict(entry):
+                continue
+            self._drop(name)
+            evicted += 1
+            metrics.counter("image_store_evicted_total", "从本地图片存储淘汰的文件数").inc()
+            metrics.counter("image_store_evicted_bytes_total", "从本地图片存储淘汰的字节数").inc(entry.size)
+        return evicted
+
+    def _can_evict(self, entry: CacheEntry) -> bool:
+        if entry.evictable is None:
+            entry.evictable = self._evictable is None or bool(self._evictable(entry.path.stem))
+        return entry.evictable
+
+    def _drop(self, name: str):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry.size
+        self._bytes_gauge.set(self.total_bytes)
+        try:
+            entry.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def open_pending(self, pin: bool = False) -> PendingImage:
+        """
+        开始写入一张新图片
+
+        Args:
+            pin: 提交时同时 pin，处理结束后需要调用 release
+        """
+        return PendingImage(self, pin)
+
+    def put_bytes(self, data: bytes, ext: str) -> StoredImage:
+        """写入一段完整的图片数据"""
+        with self.open_pending() as pending:
+            pending.write(data)
+            return pending.commit(ext)
@@ -0,0 +1,120 @@
+"""
+图片深度校验
+
+下载时的文件头检查只能发现 HTML 错误页、空响应和被截断的响应；深度校验会完整解码
+图片，发现内容损坏的文件。解码是 CPU 密集型操作，在进程池中执行以避开 GIL，
+结果按内容摘要缓存，相同内容只校验一次。
+
+依赖 Pillow；未安装时 ImageVerifier.available 为 False，调用方应跳过深度校验。
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from utils.metrics import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 为可选依赖
+    Image = None
+
+# Pillow 无法解码、只做文件头检查的格式
+_SKIPPED_EXTENSIONS = (".svg", ".avif")
+
+
+def deep_verify_file(path: str) -> Optional[str]:
+    """
+    完整解码一张图片，在工作进程中执行
+
+    Args:
+        path: 图片路径
+
+    Returns:
+        Optional[str]: 图片损坏时返回原因，否则返回 None
+    """
+    try:
+        # verify() 只检查文件结构，之后必须重新打开才能解码像素数据
+        with Image.open(path) as img:
+            img.verify()
+        with Image.open(path) as img:
+            img.load()
+    except Exception as e:
+        return f"图片无法解码: {e}"
+    return None
+
+
+class ImageVerifier:
+    """在进程池中完整解码图片，拒绝损坏的文件"""
+
+    def __init__(self, workers: Optional[int] = None):
+        """
+        Args:
+            workers: 进程数，默认使用 CPU 核数
+        """
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        # 内容摘要 -> 校验结果（None 表示通过）
+        self._cache: Dict[str, Optional[str]] = {}
+
+    @property
+    def available(self) -> bool:
+        """是否安装了 Pillow"""
+        return Image is not None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def verify(self, save_path: str) -> Optional[str]:
+        """
+        深度校验存储中的一张图片
+
+        Args:
+            save_path: 图片在存储中的路径（文件名为内容摘要）
+
+        Returns:
+            Optional[str]: 图片损坏时返回原因，否则返回 None
+        """
+        path = Path(save_path)
+        if path.suffix.lower() in _SKIPPED_EXTENSIONS:
+            return None
+        digest = path.stem
+        if digest in self._cache:
+            return self._cache[digest]
+        with metrics.timer("verify_deep_seconds", "完整解码校验单张图片的耗时（秒）"):
+            error = self._pool().submit(deep_verify_file, str(path)).result()
+        self._cache[digest] = error
+        return error
+
+    def verify_many(self, save_paths: Iterable[str]) -> List[Optional[str]]:
+        """
+        批量深度校验，所有图片同时提交到进程池，不需要调用方再开线程
+
+        Args:
+            save_paths: 图片路径（文件名为内容摘要）
+
+        Returns:
+            List[Optional[str]]: 与 save_paths 顺序一致的校验结果，通过时为 None
+        """
+        paths = [Path(save_path) for save_path in save_paths]
+        futures = {}
+        for path in paths:
+            digest = path.stem
+            if path.suffix.lower() in _SKIPPED_EXTENSIONS or digest in self._cache or digest in futures:
+                continue
+            futures[digest] = self._pool().submit(deep_verify_file, str(path))
+        for digest, future in futures.items():
+            self._cache[digest] = future.result()
+        return [None if path.suffix.lower() in _SKIPPED_EXTENSIONS else self._cache[path.stem]
+                for path in paths]
+
+    def close(self):
+        """关闭进程池"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,277 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 状态取值
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    url TEXT PRIMARY KEY,
+    digest TEXT,
+    ext TEXT,
+    size INTEGER,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    digest TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    remote_url TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (digest, backend)
+);
+CREATE INDEX IF NOT EXISTS idx_uploads_remote_url ON uploads (remote_url);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    urls TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS optimized (
+    digest TEXT NOT NULL,
+    options TEXT NOT NULL,
+    result_digest TEXT NOT NULL,
+    result_ext TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (digest, options)
+);
+"""
+
+# 旧版本清单中缺少的列：表名 -> [(列名, 类型)]
+_ADDED_COLUMNS = {
+    "sources": [("etag", "TEXT"), ("last_modified", "TEXT")],
+}
+
+
+@dataclass
+class SourceRecord:
+    """源图片URL的下载记录"""
+    url: str
+    digest: Optional[str]
+    ext: Optional[str]
+    size: Optional[int]
+    status: str
+    error: Optional[str]
+    # 源站返回的缓存校验器，用于条件请求
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+@dataclass
+class FileRecord:
+    """Markdown文件的扫描记录"""
+    path: str
+    mtime_ns: int
+    size: int
+    digest: str
+    urls: List[str]
+
+
+class MigrationManifest:
+    """
+    持久化的迁移清单（SQLite，WAL 模式）
+
+    记录 源URL -> 内容摘要 -> 各后端的远程URL 及状态，
+    使中断后的迁移可以从断点继续，不再重复下载或上传。
+    """
+
+    def __init__(self, db_path: str, read_only: bool = False):
+        """
+        Args:
+            db_path: SQLite 数据库文件路径
+            read_only: 只读模式（dry-run）：把已有的清单复制到内存中使用，之后的记录只写入内存，
+                不创建目录、数据库文件或 WAL 文件
+        """
+        self.db_path = Path(db_path)
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        if read_only:
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+            if self.db_path.exists():
+                self._copy_from_disk()
+        else:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._add_missing_columns()
+        self._conn.commit()
+
+    def _copy_from_disk(self):
+        """把磁盘上的清单复制到内存连接中"""
+        uri = self.db_path.resolve().as_uri()
+        wal_path = self.db_path.with_name(self.db_path.name + "-wal")
+        # 只读打开 WAL 模式的数据库也会创建 -wal/-shm 文件；没有未合并的 WAL 时以 immutable 方式打开，
+        # 有 WAL（其他进程正在使用或上次异常退出）时这些文件已经存在，按普通只读方式打开才能读到其中的记录
+        uri += "?mode=ro" if wal_path.exists() else "?immutable=1"
+        source = sqlite3.connect(uri, uri=True)
+        try:
+            source.backup(self._conn)
+        finally:
+            source.close()
+
+    def _add_missing_columns(self):
+        """为旧版本创建的清单补齐新增的列"""
+        for table, columns in _ADDED_COLUMNS.items():
+            existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, kind in columns:
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _execute(self, sql: str, params: tuple = ()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def _fetchone(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def get_source(self, url: str) -> Optional[SourceRecord]:
+        """查询源URL的下载记录"""
+        row = self._fetchone(
+            "SELECT url, digest, ext, size, status, error, etag, last_modified "
+            "FROM sources WHERE url = ?",
+            (url,)
+        )
+        return SourceRecord(*row) if row else None
+
+    def iter_sources(self, status: str = STATUS_DONE) -> List[SourceRecord]:
+        """列出指定状态的全部源URL记录"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, digest, ext, size, status, error, etag, last_modified "
+                "FROM sources WHERE status = ? ORDER BY url",
+                (status,)
+            ).fetchall()
+        return [SourceRecord(*row) for row in rows]
+
+    def record_download(self, url: str, digest: str, ext: str, size: int,
+                        etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """记录源URL下载成功，以及源站返回的 ETag / Last-Modified"""
+        self._execute(
+            "INSERT OR REPLACE INTO sources "
+            "(url, digest, ext, size, status, error, updated_at, etag, last_modified) "
+            "VALUES (?, ?, ?, ?, ?, NULL, ?, ?, ?)",
+            (url, digest, ext, size, STATUS_DONE, time.time(), etag, last_modified)
+        )
+
+    def record_not_modified(self, url: str, etag: Optional[str] = None,
+                            last_modified: Optional[str] = None):
+        """记录条件请求返回 304：内容未变化，刷新时间并更新源站给出的新校验器"""
+        self._execute(
+            "UPDATE sources SET status = ?, error = NULL, updated_at = ?, "
+            "etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+            (STATUS_DONE, time.time(), etag, last_modified, url)
+        )
+
+    def record_download_failure(self, url: str, error: str):
+        """记录源URL下载失败，保留此前成功下载的摘要"""
+        self._execute(
+            "INSERT INTO sources (url, status, error, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET status = excluded.status, "
+            "error = excluded.error, updated_at = excluded.updated_at",
+            (url, STATUS_FAILED, error, time.time())
+        )
+
+    def get_remote_url(self, digest: str, backend: str) -> Optional[str]:
+        """查询内容摘要在指定后端上已上传的URL"""
+        row = self._fetchone(
+            "SELECT remote_url FROM uploads WHERE digest = ? AND backend = ? AND status = ?",
+            (digest, backend, STATUS_DONE)
+        )
+        return row[0] if row else None
+
+    def record_upload(self, digest: str, backend: str, remote_url: str):
+        """记录上传成功"""
+        self._execute(
+            "INSERT OR REPLACE INTO uploads (digest, backend, remote_url, status, error, updated_at) "
+            "VALUES (?, ?, ?, ?, NULL, ?)",
+            (digest, backend, remote_url, STATUS_DONE, time.time())
+        )
+
+    def record_upload_failure(self, digest: str, backend: str, error: str):
+        """记录上传失败，已成功的记录不会被覆盖"""
+        self._execute(
+            "INSERT INTO uploads (digest, backend, status, error, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(digest, backend) DO UPDATE SET error = excluded.error, "
+            "updated_at = excluded.updated_at WHERE uploads.status != ?",
+            (digest, backend, STATUS_FAILED, error, time.time(), STATUS_DONE)
+        )
+
+    def is_remote_url(self, url: str) -> bool:
+        """判断URL是否为本工具上传生成的远程URL"""
+        return self._fetchone(
+            "SELECT 1 FROM uploads WHERE remote_url = ? LIMIT 1", (url,)
+        ) is not None
+
+    def get_optimized(self, digest: str, options: str) -> Optional[Tuple[str, str]]:
+        """查询原图在指定优化参数下的结果：(结果摘要, 扩展名)"""
+        row = self._fetchone(
+            "SELECT result_digest, result_ext FROM optimized WHERE digest = ? AND options = ?",
+            (digest, options)
+        )
+        return (row[0], row[1]) if row else None
+
+    def record_optimized(self, digest: str, options: str, result_digest: str, result_ext: str):
+        """记录图片优化结果，无需优化时结果摘要与原图相同"""
+        self._execute(
+            "INSERT OR REPLACE INTO optimized (digest, options, result_digest, result_ext, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (digest, options, result_digest, result_ext, time.time())
+        )
+
+    def load_file_index(self) -> Dict[str, FileRecord]:
+        """一次性读取全部Markdown文件的扫描记录"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, mtime_ns, size, digest, urls FROM files"
+            ).fetchall()
+        return {
+            row[0]: FileRecord(row[0], row[1], row[2], row[3], json.loads(row[4]))
+            for row in rows
+        }
+
+    def record_files(self, records: Iterable[FileRecord]):
+        """在一个事务中写入多条扫描记录"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest, urls, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (r.path, r.mtime_ns, r.size, r.digest, json.dumps(r.urls), now)
+                    for r in records
+                ]
+            )
+            self._conn.commit()
+
+    def remove_files(self, paths: Iterable[str]):
+        """删除已不存在的文件的扫描记录"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+            self._conn.commit()
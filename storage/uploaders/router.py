@@ -0,0 +1,162 @@
+import asyncio
+import random
+import threading
+import time
+from typing import BinaryIO, List, Optional, Sequence, Tuple
+
+from utils.metrics import metrics
+from utils.rate_limiter import Slot
+from ..base_uploader import BaseUploader, UploadItem, UploadResult
+
+# 路由策略
+ROUTE_ORDERED = "ordered"
+ROUTE_WEIGHTED = "weighted"
+
+
+class _RouterLimiter:
+    """汇总各后端限速器的只读视图：任一后端有配额时即可上传"""
+
+    def __init__(self, backends: Sequence[BaseUploader]):
+        self._backends = backends
+
+    def time_until_available(self) -> float:
+        return min(backend.rate_limiter.time_until_available() for backend in self._backends)
+
+
+class UploaderRouter(BaseUploader):
+    """
+    多后端上传路由
+
+    按顺序（或按权重随机）把每张图片交给当前有配额的后端，某个后端的配额耗尽时
+    其余后端继续上传，而不是让整个进程等待；所有后端都没有配额时，等待最先恢复的那个。
+    某个后端上传失败时依次尝试其他后端。结果中的 backend 字段记录实际完成上传的后端。
+    """
+    name = "router"
+
+    def __init__(self, backends: Sequence[BaseUploader], weights: Optional[Sequence[float]] = None,
+                 strategy: str = ROUTE_ORDERED, seed: Optional[int] = None):
+        """
+        Args:
+            backends: 上传后端，按优先级排列
+            weights: 各后端的权重，仅用于 weighted 策略，默认均为 1
+            strategy: ordered 优先使用排在前面的后端；weighted 按权重随机分配
+            seed: weighted 策略的随机种子
+        """
+        if not backends:
+            raise ValueError("至少需要一个上传后端")
+        if strategy not in (ROUTE_ORDERED, ROUTE_WEIGHTED):
+            raise ValueError(f"未知的路由策略: {strategy}")
+        weights = list(weights) if weights is not None else [1.0] * len(backends)
+        if len(weights) != len(backends) or any(weight <= 0 for weight in weights):
+            raise ValueError("权重数量必须与后端一致且大于 0")
+        self.backends: List[BaseUploader] = list(backends)
+        self.weights = weights
+        self.strategy = strategy
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.remote_hosts = tuple(host for backend in self.backends for host in backend.remote_hosts)
+        sizes = [backend.max_file_size for backend in self.backends]
+        self.max_file_size = None if None in sizes else max(sizes)
+        self.max_concurrency = sum(backend.max_concurrency for backend in self.backends)
+
+    @property
+    def rate_limiter(self) -> _RouterLimiter:
+        return _RouterLimiter(self.backends)
+
+    @property
+    def backend_names(self) -> Tuple[str, ...]:
+        return tuple(backend.backend_name for backend in self.backends)
+
+    def share_quota(self, workers: int):
+        for backend in self.backends:
+            backend.share_quota(workers)
+
+    def upload_file(self, file_path: str, remote_path: str) -> str:
+        result = self.upload_item(UploadItem(file_path, remote_path))
+        if not result.ok:
+            raise Exception(result.error)
+        return result.url
+
+    def upload_stream(self, stream: BinaryIO, remote_path: str) -> str:
+        result = self.upload_item(UploadItem("", remote_path, stream=stream))
+        if not result.ok:
+            raise Exception(result.error)
+        return result.url
+
+    def _candidates(self, item: UploadItem) -> List[BaseUploader]:
+        """
+        本次上传可以使用的后端，按尝试顺序排列
+
+        Args:
+            item: 待上传的文件
+
+        Returns:
+            List[BaseUploader]: 文件大小不超过其限制的后端
+        """
+        size = item.size
+        indexed = [
+            (index, backend) for index, backend in enumerate(self.backends)
+            if backend.max_file_size is None or size <= backend.max_file_size
+        ]
+        if self.strategy == ROUTE_WEIGHTED:
+            # 按权重的无放回抽样（Efraimidis-Spirakis），权重越大越可能排在前面
+            with self._rng_lock:
+                keys = {index: self._rng.random() ** (1 / self.weights[index]) for index, _ in indexed}
+            indexed.sort(key=lambda pair: keys[pair[0]], reverse=True)
+        return [backend for _, backend in indexed]
+
+    def _acquire(self, candidates: List[BaseUploader]) -> Tuple[BaseUploader, Slot]:
+        """
+        获取某个后端的配额，优先按候选顺序立即获取，都没有配额时等待最先恢复的后端
+
+        Returns:
+            Tuple[BaseUploader, Slot]: 已获取配额的后端及其配额
+        """
+        start = time.perf_counter()
+        while True:
+            for backend in candidates:
+                slot = backend.rate_limiter.try_acquire()
+                if slot:
+                    self._observe_wait(time.perf_counter() - start)
+                    return backend, slot
+            soonest = min(candidates, key=lambda backend: backend.rate_limiter.time_until_available())
+            wait = soonest.rate_limiter.time_until_available()
+            slot = soonest.rate_limiter.acquire(timeout=wait)
+            if slot:
+                self._observe_wait(time.perf_counter() - start)
+                return soonest, slot
+
+    def upload_item(self, item: UploadItem) -> UploadResult:
+        """
+        把文件交给有配额的后端上传，失败时依次尝试其他后端
+
+        Args:
+            item: 待上传的文件
+
+        Returns:
+            UploadResult: 最后一次尝试的结果，backend 为实际处理的后端
+        """
+        candidates = self._candidates(item)
+        if not candidates:
+            return UploadResult(item, error="文件超过所有后端的大小限制", backend=self.backend_name)
+        errors = []
+        while True:
+            backend, slot = self._acquire(candidates)
+            result = backend._run_upload(item, slot)
+            metrics.counter("upload_routed_total", "路由到各后端的上传数",
+                            backend=result.backend, status="ok" if result.ok else "error").inc()
+            if result.ok:
+                return result
+            errors.append(f"{result.backend}: {result.error}")
+            candidates = [candidate for candidate in candidates if candidate is not backend]
+            if not candidates:
+                result.error = "; ".join(errors)
+                return result
+
+    async def upload_item_async(self, item: UploadItem) -> UploadResult:
+        """在 asyncio 中上传单个文件，等待配额与上传都在线程中进行，不阻塞事件循环"""
+        return await asyncio.to_thread(self.upload_item, item)
+
+    def _observe_wait(self, seconds: float):
+        metrics.histogram("rate_limiter_wait_seconds", "等待上传限速配额的耗时（秒）",
+                          backend=self.backend_name).observe(seconds)
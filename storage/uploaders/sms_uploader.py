@@ -1,16 +1,41 @@
 import requests
-from ..base_uploader import BaseUploader
+from ..base_uploader import BaseUploader, UploadItem, UploadResult
+from utils.http import SessionPool, default_session_pool
+from utils.rate_limiter import RateLimit
 import os
 import json
-from typing import Optional
+from typing import BinaryIO, Optional
+
+class ImageRepeatedError(Exception):
+    """SM.MS 中已存在相同图片"""
+
+    def __init__(self, message: str, existing_url: str):
+        super().__init__(message)
+        self.existing_url = existing_url
+
 
 class SMSUploader(BaseUploader):
-    def __init__(self, api_token: str):
+    name = "smms"
+    remote_hosts = ("s2.loli.net", "i.loli.net")
+    # SM.MS 限制：每分钟 15 张，每小时 100 张
+    rate_limits = (RateLimit(15, 60), RateLimit(100, 3600))
+    # SM.MS 单个文件最大 5MB
+    max_file_size = 5 * 1024 * 1024
+    # 并发数保持较小，配额由限速器统一控制
+    max_concurrency = 2
+
+    DEFAULT_UPLOAD_URL = "https://smms.app/api/v2/upload"
+
+    def __init__(self, api_token: str, session_pool: SessionPool = None,
+                 upload_url: Optional[str] = None):
         self.api_token = api_token
-        self.upload_url = "https://smms.app/api/v2/upload"
+        # 可替换为 sm.ms 等其他域名，或本地的测试服务
+        self.upload_url = upload_url or self.DEFAULT_UPLOAD_URL
         self.headers = {
             "Authorization": api_token
         }
+        # 复用到 SM.MS 的 keep-alive 连接
+        self.session = (session_pool or default_session_pool).get(self.upload_url)
 
     def upload_file(self, file_path: str, remote_path: str) -> str:
         """
@@ -24,18 +49,41 @@ class SMSUploader(BaseUploader):
             str: 上传成功后的图片URL
             
         Raises:
+            ImageRepeatedError: 图片已存在于 SM.MS，existing_url 为已有的URL
             Exception: 上传失败时抛出异常
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"文件不存在: {file_path}")
 
         with open(file_path, 'rb') as f:
-            files = {'smfile': f}
-            response = requests.post(
-                self.upload_url,
-                headers=self.headers,
-                files=files
-            )
+            return self._post({'smfile': f})
+
+    def upload_stream(self, stream: BinaryIO, remote_path: str) -> str:
+        """
+        直接把文件对象作为表单字段上传，不写入本地文件
+
+        Args:
+            stream: 可读的二进制文件对象
+            remote_path: 远程路径，只使用其中的文件名
+
+        Returns:
+            str: 上传成功后的图片URL
+        """
+        return self._post({'smfile': (os.path.basename(remote_path), stream)})
+
+    def _post(self, files: dict) -> str:
+        """
+        发送上传请求并解析结果
+
+        Raises:
+            ImageRepeatedError: 图片已存在于 SM.MS
+            Exception: 上传失败
+        """
+        response = self.session.post(
+            self.upload_url,
+            headers=self.headers,
+            files=files
+        )
 
         if response.status_code != 200:
             raise Exception(f"上传失败，状态码: {response.status_code}")
@@ -44,10 +92,20 @@ class SMSUploader(BaseUploader):
         
         if not result.get('success'):
             error_message = result.get('message', '未知错误')
+            if result.get('code') == 'image_repeated':
+                existing_url = result.get('images') or error_message.split("exists at: ")[-1].strip()
+                raise ImageRepeatedError(f"上传失败: {error_message}", existing_url)
             raise Exception(f"上传失败: {error_message}")
 
         return result['data']['url']
 
+    def _upload(self, item: UploadItem) -> UploadResult:
+        try:
+            return super()._upload(item)
+        except ImageRepeatedError as e:
+            # 相同图片此前已上传过，直接使用已有的URL
+            return UploadResult(item, url=e.existing_url, note="使用已存在的图片URL")
+
     def _handle_response(self, response: requests.Response) -> Optional[str]:
         """
         处理响应数据
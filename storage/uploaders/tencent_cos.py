@@ -1,10 +1,31 @@
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Dict  # 添加这行导入
+from typing import BinaryIO, Iterable, Optional, Dict, List  # 添加这行导入
 from qcloud_cos import CosConfig, CosS3Client, CosServiceError
-from .environment import StorageConfig, TencentConfig
+from ..base_uploader import BaseUploader, UploadItem, UploadResult
+from ..environment import StorageConfig
+from utils.http import SessionPool, default_session_pool
+from utils.rate_limiter import RateLimit
+
+
+@dataclass
+class RemoteObject:
+    """COS 中已存在的对象"""
+    size: int
+    etag: str
+
+
+class TencentCOSUploader(BaseUploader):
+    name = "cos"
+    # COS 没有上传频率限制，批量上传时使用更高的并发
+    max_concurrency = 8
+    # 分块上传的默认分块大小，COS 要求除最后一块外每块不小于 1MB
+    DEFAULT_PART_SIZE = 8 * 1024 * 1024
 
-class TencentCOSUploader:
     @classmethod
     def from_config(cls, config_path: Optional[Path] = None):
         """从配置文件创建上传器实例"""
@@ -13,21 +34,55 @@ class TencentCOSUploader:
             secret_id=config.secret_id,
             secret_key=config.secret_key,
             region=config.area,
-            bucket=f"{config.bucket}-{config.app_id}"  # 确保 bucket 名称包含 appid
+            bucket=f"{config.bucket}-{config.app_id}",  # 确保 bucket 名称包含 appid
+            custom_url=config.custom_url,
+            prefix=config.path
         )
 
-    def __init__(self, secret_id: str, secret_key: str, region: str, bucket: str):
+    def __init__(self, secret_id: str, secret_key: str, region: str, bucket: str,
+                 rate_limits: Optional[Iterable[RateLimit]] = None,
+                 session_pool: SessionPool = None, custom_url: str = "", prefix: str = "",
+                 part_size: int = DEFAULT_PART_SIZE, part_threads: int = 4,
+                 multipart_threshold: Optional[int] = None,
+                 multipart_state_path: Optional[Path] = None,
+                 domain: Optional[str] = None, scheme: str = "https"):
         self.secret_id = secret_id
         self.secret_key = secret_key
         self.region = region  # 确保这行存在
         self.bucket = bucket
+        # 自定义访问域名，为空时使用 COS 默认域名
+        self.custom_url = custom_url.rstrip('/')
+        # 本工具使用的对象前缀，构建存在性索引时只列举该前缀
+        self.prefix = prefix.lstrip('/')
+        # 对象名 -> 已存在的对象，为 None 表示尚未构建索引
+        self._index: Optional[Dict[str, RemoteObject]] = None
+        self._index_prefix = ""
+        self._index_lock = threading.Lock()
+        # 大文件分块上传：分块大小、单个文件的分块并发数、启用分块上传的文件大小
+        self.part_size = part_size
+        self.part_threads = part_threads
+        self.multipart_threshold = multipart_threshold or part_size * 2
+        # 记录未完成分块上传的 UploadId，进程中断后可以续传
+        self.multipart_state_path = Path(multipart_state_path) if multipart_state_path else None
+        self._state_lock = threading.Lock()
+        # COS 默认不限速，可按需配置
+        if rate_limits is not None:
+            self.rate_limits = tuple(rate_limits)
         
+        # 与下载器共用按主机划分的 keep-alive 连接池
+        session = (session_pool or default_session_pool).get(
+            f"{scheme}://{domain or f'{bucket}.cos.{region}.myqcloud.com'}"
+        )
+        # domain 用于自定义请求域名（例如本地的兼容服务），为空时使用 COS 默认域名
         self.client = CosS3Client(
             CosConfig(
                 Region=region,
                 SecretId=secret_id,
-                SecretKey=secret_key
-            )
+                SecretKey=secret_key,
+                Domain=domain,
+                Scheme=scheme
+            ),
+            session=session
         )
 
     def upload_file(self, local_file: Path, object_name: str) -> bool:
@@ -35,26 +90,210 @@ class TencentCOSUploader:
         上传单个文件到 COS
         
         Args:
-            local_file (Path): 本地文件路径
+            local_file (Path): 本地文件路径，也可以是字符串
             object_name (str): 对象存储中的文件名
             
         Returns:
             bool: 上传是否成功
         """
         try:
-            self.client.upload_file(
-                Bucket=self.bucket,
-                LocalFilePath=str(local_file),
-                Key=object_name
-            )
+            self._put_file(Path(local_file), object_name)
             return True
         except Exception as e:
             print(f"上传失败: {local_file}, 错误: {str(e)}")
             return False
 
+    def _put_file(self, local_file: Path, object_name: str):
+        """上传文件，失败时抛出异常；超过阈值的文件使用分块上传"""
+        if local_file.stat().st_size >= self.multipart_threshold:
+            self.multipart_upload(local_file, object_name)
+            return
+        self.client.upload_file(
+            Bucket=self.bucket,
+            LocalFilePath=str(local_file),
+            Key=object_name
+        )
+
+    def multipart_upload(self, local_file: Path, object_name: str):
+        """
+        并发分块上传单个文件
+
+        开始上传后 UploadId 会写入状态文件；再次上传同一文件时通过 list_parts
+        查询已完成的分块，只上传缺失的部分。文件大小、修改时间或分块大小
+        变化时重新开始。
+
+        Args:
+            local_file (Path): 本地文件路径
+            object_name (str): 对象存储中的文件名
+        """
+        local_file = Path(local_file)
+        stat = local_file.stat()
+        fingerprint = {
+            'file': str(local_file.resolve()),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'part_size': self.part_size,
+        }
+        part_count = max(1, -(-stat.st_size // self.part_size))
+
+        upload_id = None
+        done: Dict[int, str] = {}
+        saved = self._load_multipart_state().get(object_name)
+        if saved and saved.get('fingerprint') == fingerprint:
+            upload_id = saved['upload_id']
+            try:
+                done = self._list_parts(object_name, upload_id)
+            except CosServiceError:
+                # 分块上传已过期或被清理，重新开始
+                upload_id = None
+                done = {}
+        if upload_id is None:
+            response = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_name)
+            upload_id = response['UploadId']
+            self._update_multipart_state(object_name, {
+                'upload_id': upload_id,
+                'fingerprint': fingerprint,
+            })
+
+        missing = [number for number in range(1, part_count + 1) if number not in done]
+        with ThreadPoolExecutor(max_workers=self.part_threads) as executor:
+            futures = {
+                number: executor.submit(self._upload_part, local_file, object_name,
+                                        upload_id, number)
+                for number in missing
+            }
+            for number, future in futures.items():
+                done[number] = future.result()
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={'Part': [
+                {'PartNumber': number, 'ETag': done[number]}
+                for number in range(1, part_count + 1)
+            ]}
+        )
+        self._update_multipart_state(object_name, None)
+
+    def _upload_part(self, local_file: Path, object_name: str,
+                     upload_id: str, number: int) -> str:
+        """上传第 number 个分块并返回其 ETag"""
+        with open(local_file, 'rb') as f:
+            f.seek((number - 1) * self.part_size)
+            data = f.read(self.part_size)
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=object_name,
+            Body=data,
+            PartNumber=number,
+            UploadId=upload_id
+        )
+        return response['ETag']
+
+    def _list_parts(self, object_name: str, upload_id: str) -> Dict[int, str]:
+        """查询分块上传中已完成的分块：分块编号 -> ETag"""
+        parts: Dict[int, str] = {}
+        marker = 0
+        while True:
+            response = self.client.list_parts(
+                Bucket=self.bucket,
+                Key=object_name,
+                UploadId=upload_id,
+                PartNumberMarker=marker
+            )
+            page: List[dict] = response.get('Part', [])
+            for part in page:
+                parts[int(part['PartNumber'])] = part['ETag']
+            if str(response.get('IsTruncated', 'false')).lower() != 'true' or not page:
+                return parts
+            marker = int(response.get('NextPartNumberMarker') or page[-1]['PartNumber'])
+
+    def _load_multipart_state(self) -> Dict[str, dict]:
+        """读取未完成分块上传的记录：对象名 -> 记录"""
+        if not self.multipart_state_path or not self.multipart_state_path.exists():
+            return {}
+        with self._state_lock:
+            return json.loads(self.multipart_state_path.read_text(encoding='utf-8'))
+
+    def _update_multipart_state(self, object_name: str, record: Optional[dict]):
+        """写入或删除（record 为 None）一条分块上传记录"""
+        if not self.multipart_state_path:
+            return
+        with self._state_lock:
+            state = {}
+            if self.multipart_state_path.exists():
+                state = json.loads(self.multipart_state_path.read_text(encoding='utf-8'))
+            if record is None:
+                state.pop(object_name, None)
+            else:
+                state[object_name] = record
+            tmp_path = self.multipart_state_path.with_name(self.multipart_state_path.name + '.tmp')
+            tmp_path.write_text(json.dumps(state), encoding='utf-8')
+            os.replace(tmp_path, self.multipart_state_path)
+
+    def upload_stream(self, stream: BinaryIO, remote_path: str) -> str:
+        """
+        通过一次 PUT 请求把文件对象直接写入 COS，不写入本地文件
+
+        Args:
+            stream: 可读的二进制文件对象
+            remote_path: 对象存储中的文件名
+
+        Returns:
+            str: 对象的访问URL
+        """
+        self.client.put_object(
+            Bucket=self.bucket,
+            Body=stream,
+            Key=remote_path
+        )
+        return self.get_url(remote_path)
+
+    def object_key(self, remote_path: str) -> str:
+        """
+        获取远程路径在存储桶中的对象名，配置了 prefix 时加在前面
+
+        Args:
+            remote_path (str): 相对于 prefix 的远程路径
+
+        Returns:
+            str: 实际写入的对象名，与 build_index 列举的对象名一致
+        """
+        remote_path = remote_path.lstrip('/')
+        if not self.prefix:
+            return remote_path
+        return f"{self.prefix.rstrip('/')}/{remote_path}"
+
+    def _upload(self, item: UploadItem) -> UploadResult:
+        key = self.object_key(item.remote_path)
+        if item.stream is not None:
+            item.stream.seek(0)
+            url = self.upload_stream(item.stream, key)
+            self._remember_object(key, item.size)
+            return UploadResult(item, url=url)
+        self._put_file(Path(item.file_path), key)
+        self._remember_object(key, Path(item.file_path).stat().st_size)
+        return UploadResult(item, url=self.get_url(key))
+
+    def get_url(self, object_name: str) -> str:
+        """
+        获取对象的访问URL
+
+        Args:
+            object_name (str): 对象存储中的文件名
+
+        Returns:
+            str: 使用自定义域名或 COS 默认域名的访问URL
+        """
+        base = self.custom_url or f"https://{self.bucket}.cos.{self.region}.myqcloud.com"
+        return f"{base}/{object_name.lstrip('/')}"
+
     def file_exists(self, object_name: str) -> bool:
         """
         检查文件是否已存在于 COS
+
+        已构建索引且对象位于索引前缀下时直接查询索引，否则发送 HEAD 请求
         
         Args:
             object_name (str): 对象存储中的文件名
@@ -62,6 +301,9 @@ class TencentCOSUploader:
         Returns:
             bool: 文件是否存在
         """
+        with self._index_lock:
+            if self._index is not None and object_name.startswith(self._index_prefix):
+                return object_name in self._index
         try:
             self.client.head_object(
                 Bucket=self.bucket,
@@ -73,32 +315,136 @@ class TencentCOSUploader:
                 return False
             raise e
 
-    def batch_upload(self, file_list: list, base_dir: Path = None) -> dict:
+    def build_index(self, prefix: Optional[str] = None,
+                    index_path: Optional[Path] = None) -> Dict[str, RemoteObject]:
+        """
+        分页列举前缀下的全部对象，构建内存中的存在性索引
+
+        一次 list_objects 最多返回 1000 个对象，5 万个对象只需 50 次请求，
+        代替逐个对象的 HEAD 请求。
+
+        Args:
+            prefix (str, optional): 列举的前缀，默认使用配置的 prefix
+            index_path (Path, optional): 索引保存路径，提供时写入 JSON 文件
+
+        Returns:
+            Dict[str, RemoteObject]: 对象名到对象信息的索引
+        """
+        prefix = self.prefix if prefix is None else prefix
+        index: Dict[str, RemoteObject] = {}
+        marker = ""
+        while True:
+            response = self.client.list_objects(
+                Bucket=self.bucket,
+                Prefix=prefix,
+                Marker=marker,
+                MaxKeys=1000
+            )
+            contents = response.get('Contents', [])
+            for obj in contents:
+                index[obj['Key']] = RemoteObject(
+                    size=int(obj.get('Size', 0)),
+                    etag=obj.get('ETag', '').strip('"')
+                )
+            if str(response.get('IsTruncated', 'false')).lower() != 'true' or not contents:
+                break
+            marker = response.get('NextMarker') or contents[-1]['Key']
+
+        with self._index_lock:
+            self._index = index
+            self._index_prefix = prefix
+        if index_path:
+            self.save_index(index_path)
+        return index
+
+    def save_index(self, index_path: Path):
+        """将存在性索引保存为 JSON 文件"""
+        with self._index_lock:
+            data = {
+                'bucket': self.bucket,
+                'prefix': self._index_prefix,
+                'objects': {key: [obj.size, obj.etag] for key, obj in (self._index or {}).items()}
+            }
+        index_path = Path(index_path)
+        tmp_path = index_path.with_name(index_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(data), encoding='utf-8')
+        os.replace(tmp_path, index_path)
+
+    def load_index(self, index_path: Path) -> bool:
+        """
+        从 JSON 文件加载存在性索引
+
+        Returns:
+            bool: 文件存在且属于当前存储桶时返回 True
+        """
+        index_path = Path(index_path)
+        if not index_path.exists():
+            return False
+        data = json.loads(index_path.read_text(encoding='utf-8'))
+        if data.get('bucket') != self.bucket:
+            return False
+        with self._index_lock:
+            self._index = {
+                key: RemoteObject(size=size, etag=etag)
+                for key, (size, etag) in data.get('objects', {}).items()
+            }
+            self._index_prefix = data.get('prefix', '')
+        return True
+
+    def _remember_object(self, object_name: str, size: int):
+        """上传成功后同步更新索引"""
+        with self._index_lock:
+            if self._index is not None and object_name.startswith(self._index_prefix):
+                self._index[object_name] = RemoteObject(size=size, etag="")
+
+    def _is_uploaded(self, local_file: Path, object_name: str) -> bool:
+        """根据索引判断对象是否已存在且大小与本地文件一致"""
+        with self._index_lock:
+            remote = (self._index or {}).get(object_name)
+        return remote is not None and remote.size == local_file.stat().st_size
+
+    def batch_upload(self, file_list: list, base_dir: Path = None,
+                     skip_existing: bool = False) -> dict:
         """
         批量上传文件
         
         Args:
             file_list (list): 本地文件路径列表
-            base_dir (Path, optional): 基础目录，用于构建对象名称
+            base_dir (Path, optional): 基础目录，用于构建对象名称（对象名加上配置的 prefix）
+            skip_existing (bool): 是否跳过 COS 中已存在且大小相同的对象，
+                未构建索引时会先调用 build_index
             
         Returns:
-            dict: 上传结果统计
+            dict: 上传结果统计，跳过的文件记录在 skipped 中
         """
         results = {
             'success': [],
-            'failed': []
+            'failed': [],
+            'skipped': []
         }
-        
+        if skip_existing and self._index is None:
+            self.build_index()
+
+        items = []
         for local_file in file_list:
             local_file = Path(local_file)
             if base_dir:
-                object_name = str(local_file.relative_to(base_dir))
+                remote_path = local_file.relative_to(base_dir).as_posix()
             else:
-                object_name = local_file.name
-                
-            if self.upload_file(local_file, object_name):
+                remote_path = local_file.name
+            # 索引中的对象名包含 prefix，与上传时实际写入的对象名一致
+            if skip_existing and self._is_uploaded(local_file, self.object_key(remote_path)):
+                results['skipped'].append(local_file)
+                continue
+            items.append(UploadItem(str(local_file), remote_path))
+
+        # 并发上传，结果按完成顺序返回
+        for result in self.upload_many(items):
+            local_file = Path(result.item.file_path)
+            if result.ok:
                 results['success'].append(local_file)
             else:
+                print(f"上传失败: {local_file}, 错误: {result.error}")
                 results['failed'].append(local_file)
-                
-        return results
\ No newline at end of file
+
+        return results
@@ -0,0 +1,62 @@
+"""测试共用的数据和假对象"""
+import threading
+import time
+from typing import List, Optional
+
+from storage.base_uploader import BaseUploader
+
+# 带有真实 PNG 文件头的测试数据，能通过下载时的文件头检查
+PNG = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+
+
+class FakeUploader(BaseUploader):
+    """
+    记录上传调用的假上传器，可选地在每次上传前等待
+    :param delay: 每次上传前等待的秒数
+    :param uploaded: 记录上传的远程路径的列表，多个上传器（例如多个分片进程）可以共用
+    """
+    name = "fake"
+    remote_hosts = ("cdn.example.com",)
+
+    def __init__(self, delay: float = 0.0, uploaded: Optional[List[str]] = None):
+        self.delay = delay
+        self.uploaded = [] if uploaded is None else uploaded
+        self.lock = threading.Lock()
+
+    def upload_file(self, file_path, remote_path):
+        time.sleep(self.delay)
+        with self.lock:
+            self.uploaded.append(remote_path)
+        return f"https://{self.remote_hosts[0]}/{remote_path}"
+
+
+class NamedUploader(FakeUploader):
+    """按名称区分的假上传器，可配置限速、大小限制和失败"""
+
+    def __init__(self, name, rate_limits=(), max_file_size=None, fail=False):
+        super().__init__()
+        self.name = name
+        self.rate_limits = tuple(rate_limits)
+        self.max_file_size = max_file_size
+        self.fail = fail
+        self.remote_hosts = (f"{name}.example.com",)
+
+    def upload_file(self, file_path, remote_path):
+        if self.fail:
+            raise Exception(f"{self.name} quota exceeded")
+        return super().upload_file(file_path, remote_path)
+
+
+class FakeClock:
+    """可以手动推进的时钟，sleep 直接推进时间"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
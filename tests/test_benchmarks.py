@@ -0,0 +1,60 @@
+from benchmarks.bench_migration import percentile, summarize
+from benchmarks.corpus import generate_corpus
+from benchmarks.fake_servers import FakeCOSServer, FakeSMMSServer, ImageServer
+from markdown.image_downloader import MarkdownImageDownloader
+from storage.uploaders.sms_uploader import SMSUploader
+from storage.uploaders.tencent_cos import TencentCOSUploader
+from utils.http import SessionPool
+from utils.image_types import sniff_extension
+from utils.rate_limiter import RateLimit
+
+
+def test_corpus_is_reproducible(tmp_path):
+    first = generate_corpus(str(tmp_path / "a"), "http://img", notes=5, images=20,
+                            duplicate_ratio=0.5, median_kb=1, seed=3)
+    second = generate_corpus(str(tmp_path / "b"), "http://img", notes=5, images=20,
+                             duplicate_ratio=0.5, median_kb=1, seed=3)
+
+    assert first.images == second.images
+    assert len(set(first.images.values())) < len(first.images)
+    assert all(sniff_extension(data[:16]) == ".png" for data in first.images.values())
+    assert first.references >= 20
+
+
+def test_pipeline_against_local_servers(tmp_path):
+    with ImageServer({}) as images, FakeSMMSServer([RateLimit(1000, 1)]) as smms:
+        corpus = generate_corpus(str(tmp_path / "corpus"), images.images_url,
+                                 notes=4, images=12, duplicate_ratio=0.25, median_kb=1)
+        images.images = corpus.images
+        uploader = SMSUploader("token", session_pool=SessionPool(), upload_url=smms.upload_url)
+        downloader = MarkdownImageDownloader(str(tmp_path / "store"), uploader)
+
+        results = downloader.process_markdown_files([str(p) for p in corpus.notes])
+
+        report = summarize(results)
+        assert report["images"] == 12
+        assert report["failed"] == 0
+        assert set(report["stages"]) == {"download", "verify", "upload", "rewrite"}
+        # 相同内容只上传一次
+        assert smms.reset_stats().get("200") == len(set(corpus.images.values()))
+        for note in corpus.notes:
+            assert images.images_url not in note.read_text(encoding="utf-8")
+
+
+def test_fake_cos_enforces_rate_limit(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"png")
+    with FakeCOSServer([RateLimit(1, 60)]) as cos:
+        uploader = TencentCOSUploader("id", "key", "ap-shanghai", "bench-1250000000",
+                                      session_pool=SessionPool(), domain=cos.domain, scheme="http")
+        uploader.upload_file(path, "images/a.png")
+
+        assert cos.objects["images/a.png"] == b"png"
+        assert cos.reset_stats() == {"200": 1}
+
+
+def test_percentile():
+    values = [i / 100 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 99) == 0.99
+    assert percentile([], 50) == 0.0
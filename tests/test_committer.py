@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from markdown.committer import (
+    COMMIT_UNCHANGED, COMMIT_WRITTEN, PendingRewrite, atomic_write_text, commit_rewrite,
+    commit_rewrites, rewrite_stats,
+)
+from markdown.planner import build_plan
+from markdown.tokenizer import find_image_refs
+
+
+def test_atomic_write_replaces_content_and_keeps_mode(tmp_path):
+    path = tmp_path / "note.md"
+    path.write_text("old", encoding="utf-8")
+    os.chmod(path, 0o640)
+
+    atomic_write_text(path, "新内容\r\n")
+
+    assert path.read_bytes() == "新内容\r\n".encode("utf-8")
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["note.md"]
+
+
+def test_atomic_write_leaves_original_on_failure(tmp_path, monkeypatch):
+    path = tmp_path / "note.md"
+    path.write_text("original", encoding="utf-8")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        atomic_write_text(path, "new")
+
+    assert path.read_text(encoding="utf-8") == "original"
+    assert [p.name for p in tmp_path.iterdir()] == ["note.md"]
+
+
+def test_crlf_note_keeps_its_line_endings(tmp_path):
+    path = tmp_path / "note.md"
+    path.write_bytes(b"# title\r\n\r\n![a](http://old.example.com/a.png)\r\n")
+
+    plan = build_plan([str(path)], find_image_refs)
+    original = plan.files[str(path)].content
+    assert original.count("\r\n") == 3
+    rewrite = PendingRewrite(str(path), path, original,
+                             original.replace("http://old.example.com/a.png", "https://cdn.example.com/a.png"))
+
+    assert commit_rewrite(rewrite) == COMMIT_WRITTEN
+    assert path.read_bytes() == b"# title\r\n\r\n![a](https://cdn.example.com/a.png)\r\n"
+
+
+def test_unchanged_content_is_not_written(tmp_path):
+    path = tmp_path / "note.md"
+    path.write_text("same", encoding="utf-8")
+    mtime = os.stat(path).st_mtime_ns
+
+    status = commit_rewrite(PendingRewrite("note", path, "same", "same"))
+
+    assert status == COMMIT_UNCHANGED
+    assert os.stat(path).st_mtime_ns == mtime
+
+
+def test_commit_rewrites_in_parallel_reports_errors(tmp_path):
+    rewrites = []
+    for i in range(8):
+        path = tmp_path / f"{i}.md"
+        path.write_text(f"old {i}", encoding="utf-8")
+        rewrites.append(PendingRewrite(str(path), path, f"old {i}", f"new {i}"))
+    # 规划之后被修改的文件不会被覆盖
+    (tmp_path / "3.md").write_text("edited", encoding="utf-8")
+
+    errors = commit_rewrites(rewrites, workers=4)
+
+    assert list(errors) == [str(tmp_path / "3.md")]
+    assert (tmp_path / "3.md").read_text(encoding="utf-8") == "edited"
+    assert (tmp_path / "5.md").read_text(encoding="utf-8") == "new 5"
+    assert commit_rewrite(PendingRewrite("x", tmp_path / "5.md", "new 5", "newer")) == COMMIT_WRITTEN
+
+
+def test_rewrite_stats_counts_lines_and_bytes():
+    content = "![a](http://x/a.png) ![b](http://x/b.png)\ntext\n![c](http://x/c.png)\n"
+    refs = find_image_refs(content)
+
+    stats = rewrite_stats(content, refs, {"http://x/a.png": "https://cdn/a.png",
+                                          "http://x/c.png": "https://cdn/c.png"})
+    assert (stats.references, stats.lines, stats.bytes_delta) == (2, 2, 6)
+
+    unknown = rewrite_stats(content, refs, {"http://x/b.png": None})
+    assert (unknown.references, unknown.lines, unknown.bytes_delta) == (1, 1, None)
@@ -0,0 +1,231 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from markdown.image_downloader import MarkdownImageDownloader
+from tests.helpers import FakeClock
+from utils.download_scheduler import (
+    BudgetExceededError, CircuitBreaker, DownloadScheduler, HostUnavailableError,
+    RetryableStatusError, RetryPolicy, parse_retry_after, STATE_CLOSED, STATE_HALF_OPEN,
+    STATE_OPEN,
+)
+from utils.metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def make_scheduler(clock: FakeClock, **kwargs) -> DownloadScheduler:
+    return DownloadScheduler(clock=clock, sleep=clock.sleep, seed=0, **kwargs)
+
+
+def test_parse_retry_after_seconds_and_http_date():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480.0) == 10.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412490.0) == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    import random
+    rng = random.Random(1)
+    delays = [policy.backoff(attempt, rng) for attempt in range(1, 10)]
+    assert all(0 <= delay <= 5.0 for delay in delays)
+    assert len(set(delays)) == len(delays)
+
+
+def test_retries_retryable_errors_then_succeeds():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    calls = []
+
+    def attempt(timeout, deadline):
+        calls.append(timeout)
+        if len(calls) < 3:
+            raise RetryableStatusError(503)
+        return "ok"
+
+    assert scheduler.run("https://example.com/a.png", attempt) == "ok"
+    assert len(calls) == 3
+    assert len(clock.sleeps) == 2
+    assert metrics.counter("download_retries_total", host="example.com").value == 2
+
+
+def test_honours_retry_after():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    results = iter([RetryableStatusError(429, retry_after=3.0), "ok"])
+
+    def attempt(timeout, deadline):
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert scheduler.run("https://example.com/a.png", attempt) == "ok"
+    assert clock.sleeps == [3.0]
+    # 429 不计入熔断
+    assert scheduler.breaker("https://example.com/a.png").failures == 0
+
+
+def test_does_not_retry_client_errors():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    calls = []
+
+    def attempt(timeout, deadline):
+        calls.append(1)
+        raise requests.HTTPError("404 Client Error")
+
+    with pytest.raises(requests.HTTPError):
+        scheduler.run("https://example.com/a.png", attempt)
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+
+def test_gives_up_when_wait_exceeds_budget():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, time_budget=10)
+
+    def attempt(timeout, deadline):
+        raise RetryableStatusError(503, retry_after=60)
+
+    with pytest.raises(BudgetExceededError):
+        scheduler.run("https://example.com/a.png", attempt)
+    assert clock.sleeps == []
+
+
+def test_request_timeout_never_exceeds_remaining_budget():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, time_budget=10, request_timeout=30)
+    timeouts = []
+
+    def attempt(timeout, deadline):
+        timeouts.append(timeout)
+        clock.now += 4
+        raise requests.ConnectionError("refused")
+
+    with pytest.raises(Exception):
+        scheduler.run("https://example.com/a.png", attempt)
+    assert timeouts[0] == 10
+    assert all(timeout <= 10 for timeout in timeouts)
+
+
+def test_circuit_breaker_opens_and_recovers():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    assert breaker.allow()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+
+    clock.now += 30
+    # 半开状态只放行一个试探请求
+    assert breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow()
+
+
+def test_circuit_breaker_reopens_when_probe_fails():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 5
+    assert breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+
+
+def test_dead_host_is_skipped_quickly():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, failure_threshold=3, retry=RetryPolicy(max_attempts=2))
+    calls = []
+
+    def attempt(timeout, deadline):
+        calls.append(1)
+        raise requests.ConnectionError("refused")
+
+    with pytest.raises(requests.ConnectionError):
+        scheduler.run("https://dead.example.com/1.png", attempt)
+    with pytest.raises((requests.ConnectionError, HostUnavailableError)):
+        scheduler.run("https://dead.example.com/2.png", attempt)
+    assert len(calls) == 3
+    with pytest.raises(HostUnavailableError):
+        scheduler.run("https://dead.example.com/3.png", attempt)
+    assert len(calls) == 3
+    assert metrics.counter("download_circuit_open_total", host="dead.example.com").value == 1
+    # 其他主机不受影响
+    assert scheduler.run("https://alive.example.com/1.png", lambda t, d: "ok") == "ok"
+
+
+def test_limits_concurrency_per_host():
+    scheduler = DownloadScheduler(max_per_host=2)
+    active = {"a.example.com": 0, "b.example.com": 0}
+    peak = dict(active)
+    lock = threading.Lock()
+
+    def make_attempt(host):
+        def attempt(timeout, deadline):
+            with lock:
+                active[host] += 1
+                peak[host] = max(peak[host], active[host])
+            time.sleep(0.02)
+            with lock:
+                active[host] -= 1
+            return host
+        return attempt
+
+    threads = [
+        threading.Thread(target=scheduler.run, args=(f"https://{host}/{i}.png", make_attempt(host)))
+        for i in range(6) for host in active
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == {"a.example.com": 2, "b.example.com": 2}
+
+
+def test_download_image_retries_server_errors(tmp_path, requests_mock):
+    clock = FakeClock()
+    url = "https://example.com/flaky.png"
+    requests_mock.get(url, [
+        {"status_code": 503},
+        {"status_code": 429, "headers": {"Retry-After": "2"}},
+        {"content": b"\x89PNG\r\n\x1a\nimage"},
+    ])
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), scheduler=make_scheduler(clock))
+
+    ok, error, save_path = downloader.download_image(url)
+
+    assert ok, error
+    assert save_path.endswith(".png")
+    assert requests_mock.call_count == 3
+    assert clock.sleeps[-1] == 2.0
+
+
+def test_download_image_does_not_retry_404(tmp_path, requests_mock):
+    url = "https://example.com/missing.png"
+    requests_mock.get(url, status_code=404)
+    clock = FakeClock()
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), scheduler=make_scheduler(clock))
+
+    ok, error, _ = downloader.download_image(url)
+
+    assert not ok
+    assert "404" in error
+    assert requests_mock.call_count == 1
+    assert clock.sleeps == []
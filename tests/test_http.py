@@ -0,0 +1,27 @@
+from utils.http import SessionPool
+from utils.image_types import extension_from_content_type, sniff_extension
+
+
+def test_session_reused_per_host():
+    pool = SessionPool()
+
+    first = pool.get("https://example.com/a.png")
+    second = pool.get("https://example.com/b/c.png")
+    other = pool.get("https://cdn.example.com/a.png")
+
+    assert first is second
+    assert first is not other
+    pool.close()
+
+
+def test_sniff_extension():
+    assert sniff_extension(b'\x89PNG\r\n\x1a\n\x00\x00') == '.png'
+    assert sniff_extension(b'\xff\xd8\xff\xe0\x00\x10JFIF') == '.jpg'
+    assert sniff_extension(b'GIF89a\x01\x00') == '.gif'
+    assert sniff_extension(b'RIFF\x24\x00\x00\x00WEBPVP8 ') == '.webp'
+    assert sniff_extension(b'<!DOCTYPE html>') is None
+
+
+def test_extension_from_content_type():
+    assert extension_from_content_type('image/JPEG; charset=binary') == '.jpg'
+    assert extension_from_content_type('text/html') is None
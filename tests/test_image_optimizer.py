@@ -0,0 +1,152 @@
+import io
+import random
+
+import pytest
+
+from markdown.image_downloader import MarkdownImageDownloader
+from storage.image_optimizer import ImageOptimizer, OptimizeOptions, optimize_file
+from storage.image_store import ImageStore
+from storage.manifest import MigrationManifest
+from tests.helpers import FakeUploader
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def make_jpeg(width=64, height=48, exif=True) -> bytes:
+    img = Image.new("RGB", (width, height), (200, 30, 30))
+    buffer = io.BytesIO()
+    if exif:
+        tags = Image.Exif()
+        tags[0x010F] = "TestCamera"  # Make
+        img.save(buffer, "JPEG", quality=95, exif=tags.tobytes())
+    else:
+        img.save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def make_noise_png(size=256) -> bytes:
+    rng = random.Random(0)
+    img = Image.new("RGB", (size, size))
+    img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                 for _ in range(size * size)])
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ImageStore(str(tmp_path / "store"))
+
+
+def test_strips_exif_and_converts_to_webp(store):
+    original = store.put_bytes(make_jpeg(), ".jpg")
+    optimizer = ImageOptimizer(store, OptimizeOptions(quality=80, webp=True), workers=1)
+    try:
+        result = optimizer.optimize(str(original.path))
+    finally:
+        optimizer.close()
+
+    assert result.endswith(".webp")
+    with Image.open(result) as img:
+        assert img.format == "WEBP"
+        assert not img.getexif()
+
+
+def test_exif_is_stripped_even_when_output_is_larger(tmp_path):
+    rng = random.Random(0)
+    img = Image.new("RGB", (64, 64))
+    img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(64 * 64)])
+    tags = Image.Exif()
+    tags[0x8825] = {1: "N", 2: (31.0, 14.0, 0.0)}  # GPSInfo
+    path = tmp_path / "photo.jpg"
+    img.save(path, "JPEG", quality=30, exif=tags.tobytes())
+
+    # 以更高的质量重新编码，结果比原图大
+    data, ext = optimize_file(str(path), OptimizeOptions(quality=100))
+
+    assert ext == ".jpg"
+    assert len(data) > path.stat().st_size
+    with Image.open(io.BytesIO(data)) as result:
+        assert not result.getexif()
+
+
+def test_downscales_over_limit_images(store):
+    original = store.put_bytes(make_noise_png(), ".png")
+    limit = original.size // 4
+    optimizer = ImageOptimizer(store, OptimizeOptions(max_bytes=limit), workers=1)
+    try:
+        result = optimizer.optimize(str(original.path))
+    finally:
+        optimizer.close()
+
+    with open(result, 'rb') as f:
+        assert len(f.read()) <= limit
+    with Image.open(result) as img:
+        assert img.size[0] < 256
+
+
+def test_results_are_cached_by_content_hash(store, tmp_path):
+    original = store.put_bytes(make_jpeg(), ".jpg")
+    options = OptimizeOptions(quality=70)
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        first = ImageOptimizer(store, options, manifest=manifest, workers=1)
+        try:
+            result = first.optimize(str(original.path))
+        finally:
+            first.close()
+
+        second = ImageOptimizer(store, options, manifest=manifest, workers=1)
+        second._pool = None  # 命中缓存时不应再提交到进程池
+        assert second.optimize(str(original.path)) == result
+
+        other = ImageOptimizer(store, OptimizeOptions(quality=70, webp=True), manifest=manifest)
+        assert other.lookup(original.digest) is None
+
+
+def test_pipeline_uploads_optimized_image(tmp_path, requests_mock):
+    url = "https://example.com/photo.jpg"
+    requests_mock.get(url, content=make_jpeg(), headers={'Content-Type': 'image/jpeg'})
+    md_file = tmp_path / "post.md"
+    md_file.write_text(f"![photo]({url})", encoding='utf-8')
+    save_dir = tmp_path / "images"
+    uploader = FakeUploader()
+    optimizer = ImageOptimizer(ImageStore(str(save_dir)), OptimizeOptions(webp=True, quality=80),
+                               workers=1)
+    downloader = MarkdownImageDownloader(str(save_dir), uploader, optimizer=optimizer)
+    try:
+        results = downloader.process_markdown_file(str(md_file))
+    finally:
+        optimizer.close()
+
+    assert results["failed"] == []
+    assert [path[-5:] for path in uploader.uploaded] == [".webp"]
+    assert ".webp" in md_file.read_text(encoding='utf-8')
+
+
+def test_evicted_optimized_image_is_not_fetched_again(tmp_path, requests_mock):
+    url = "https://example.com/photo.jpg"
+    requests_mock.get(url, content=make_jpeg(), headers={'Content-Type': 'image/jpeg'})
+    save_dir = tmp_path / "images"
+    uploader = FakeUploader()
+    options = OptimizeOptions(webp=True, quality=80)
+
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        for run in range(2):
+            md_file = tmp_path / f"post{run}.md"
+            md_file.write_text(f"![photo]({url})", encoding='utf-8')
+            optimizer = ImageOptimizer(ImageStore(str(save_dir)), options, manifest=manifest, workers=1)
+            # 字节预算为 1，已上传的原图和优化结果都会被立即淘汰
+            downloader = MarkdownImageDownloader(str(save_dir), uploader, manifest=manifest,
+                                                 optimizer=optimizer, cache_size=1)
+            try:
+                results = downloader.process_markdown_file(str(md_file))
+            finally:
+                optimizer.close()
+            assert results["failed"] == []
+            assert len(downloader.store) == 0
+
+    # 第二次运行从迁移清单得到优化结果的上传记录，不再下载和优化
+    assert requests_mock.call_count == 1
+    assert len(uploader.uploaded) == 1
+    assert "https://cdn.example.com/" in (tmp_path / "post1.md").read_text(encoding='utf-8')
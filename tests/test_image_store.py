@@ -0,0 +1,105 @@
+import hashlib
+import os
+import time
+
+from storage.image_store import ImageStore
+
+
+def test_put_bytes_uses_sharded_digest_path(tmp_path):
+    store = ImageStore(str(tmp_path))
+    digest = hashlib.sha256(b"image-bytes").hexdigest()
+
+    stored = store.put_bytes(b"image-bytes", ".png")
+
+    assert stored.digest == digest
+    assert stored.created
+    assert stored.path == tmp_path / digest[:2] / digest[2:4] / f"{digest}.png"
+    assert stored.path.read_bytes() == b"image-bytes"
+    assert store.get(digest, ".png") == stored.path
+
+
+def test_duplicate_bytes_are_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path))
+
+    first = store.put_bytes(b"same", ".jpg")
+    second = store.put_bytes(b"same", ".jpg")
+
+    assert first.path == second.path
+    assert not second.created
+    assert list(tmp_path.rglob("*.jpg")) == [first.path]
+    # 临时文件不会残留
+    assert list(store.tmp_dir.iterdir()) == []
+
+
+def test_pending_image_discarded_on_error(tmp_path):
+    store = ImageStore(str(tmp_path))
+
+    try:
+        with store.open_pending() as pending:
+            pending.write(b"partial")
+            raise IOError("connection reset")
+    except IOError:
+        pass
+
+    assert list(store.tmp_dir.iterdir()) == []
+    assert store.get(hashlib.sha256(b"partial").hexdigest(), ".png") is None
+
+
+def test_index_is_loaded_at_startup(tmp_path):
+    first = ImageStore(str(tmp_path))
+    stored = first.put_bytes(b"kept", ".png")
+
+    store = ImageStore(str(tmp_path))
+
+    assert len(store) == 1
+    assert store.total_bytes == 4
+    assert store.get(stored.digest, ".png") == stored.path
+    # 索引之外被删除的文件不会被当作已存储
+    stored.path.unlink()
+    assert store.get(stored.digest, ".png") is None
+    assert store.total_bytes == 0
+
+
+def test_lru_eviction_respects_budget_and_pins(tmp_path):
+    store = ImageStore(str(tmp_path), max_bytes=10)
+    a = store.put_bytes(b"aaaa", ".png")
+    b = store.put_bytes(b"bbbb", ".png")
+    store.pin(str(b.path))
+    # 访问 a 后，b 成为最久未使用的文件，但被 pin 住
+    store.get(a.digest, ".png")
+
+    c = store.put_bytes(b"cccc", ".png")
+
+    assert not a.path.exists()
+    assert b.path.exists() and c.path.exists()
+    assert store.total_bytes == 8
+
+    store.release(str(b.path))
+    store.put_bytes(b"dddd", ".png")
+    assert not b.path.exists()
+    assert store.total_bytes == 8
+
+
+def test_only_uploaded_entries_are_evicted(tmp_path):
+    uploaded = set()
+    store = ImageStore(str(tmp_path), max_bytes=4, evictable=lambda digest: digest in uploaded)
+    a = store.put_bytes(b"aaaa", ".png")
+    b = store.put_bytes(b"bbbb", ".png")
+
+    # 都未上传：超出预算也不删除
+    assert a.path.exists() and b.path.exists()
+
+    store.mark_uploaded(str(a.path))
+    assert not a.path.exists()
+    assert b.path.exists()
+
+
+def test_entries_unused_for_max_age_are_evicted(tmp_path):
+    old = ImageStore(str(tmp_path)).put_bytes(b"old", ".png")
+    os.utime(old.path, (time.time() - 3600, time.time() - 3600))
+    store = ImageStore(str(tmp_path), max_age=60)
+    fresh = store.put_bytes(b"fresh", ".png")
+
+    assert not old.path.exists()
+    assert fresh.path.exists()
+    assert store.evict() == 0
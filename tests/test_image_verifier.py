@@ -0,0 +1,131 @@
+import io
+
+import pytest
+
+from markdown.image_downloader import MarkdownImageDownloader
+from storage.image_verifier import ImageVerifier
+from storage.manifest import MigrationManifest, STATUS_FAILED
+from tests.helpers import PNG, FakeUploader
+from utils.image_types import check_image_header
+
+
+def make_png_bytes(color=(10, 200, 30)) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("head, content_type, ok", [
+    (PNG, "", True),
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF\x00", "image/jpeg", True),
+    (b"\x00\x00\x00\x0cjP  \r\n\x87\n", "image/jp2", True),
+    (b"<!DOCTYPE html><html><head>", "image/png", False),
+    (b'{"error": "not found"}', "application/json", False),
+    (b"Access denied by CDN", "", False),
+    (b"\x89PNG\r\n\x1a\n\x00\x00\x00\x00XXXX", "", False),
+    (b"\x00\x00\x00\x0cjP  \r\n\x87\n", "application/octet-stream", False),
+    (b"", "image/png", False),
+    (b'<?xml version="1.0" encoding="UTF-8"?>\n<svg xmlns="http://www.w3.org/2000/svg">', "", True),
+    (b'<?xml version="1.0" encoding="UTF-8"?>\n<svg xmlns="http://www.w3.org/2000/svg">', "text/plain", True),
+    # S3/COS 对象不存在时返回的 XML 错误
+    (b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>NoSuchKey</Code></Error>', "", False),
+    (b'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>NoSuchKey</Code></Error>', "image/png", False),
+    (b"BM\x8a\x00\x00\x00\x00\x00\x00\x00\x8a\x00\x00\x00|\x00", "", True),
+    (b"BMW is down for maintenance", "text/plain", False),
+    (b"\x00\x00\x01\x00\x01\x00\x10\x10\x00\x00\x01\x00 \x00", "application/xml", False),
+])
+def test_check_image_header(head, content_type, ok):
+    assert (check_image_header(head, content_type) is None) == ok
+
+
+def test_html_error_page_is_rejected_before_upload(tmp_path, requests_mock):
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![a](https://example.com/a.png)\n![b](https://example.com/b.png)\n",
+                       encoding="utf-8")
+    requests_mock.get("https://example.com/a.png", content=PNG + b"image-a")
+    requests_mock.get("https://example.com/b.png", text="<html><body>Hotlinking forbidden</body></html>",
+                      headers={"Content-Type": "text/html"})
+    uploader = FakeUploader()
+    manifest = MigrationManifest(str(tmp_path / "manifest.db"))
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest)
+
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert len(uploader.uploaded) == 1
+    assert results["failed"][0]["url"] == "https://example.com/b.png"
+    assert "不是图片" in results["failed"][0]["error"]
+    assert manifest.get_source("https://example.com/b.png").status == STATUS_FAILED
+    assert list(downloader.store.tmp_dir.iterdir()) == []
+
+
+def test_xml_error_from_object_storage_is_rejected(tmp_path, requests_mock):
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![a](https://bucket.example.com/missing.png)\n", encoding="utf-8")
+    requests_mock.get("https://bucket.example.com/missing.png",
+                      text='<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>NoSuchKey</Code>'
+                           '<Message>The specified key does not exist.</Message></Error>',
+                      headers={"Content-Type": "application/xml"})
+    uploader = FakeUploader()
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert uploader.uploaded == []
+    assert "不是图片" in results["failed"][0]["error"]
+
+
+def test_truncated_response_is_rejected(tmp_path, requests_mock):
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"))
+    requests_mock.get("https://example.com/a.png", content=PNG + b"partial",
+                      headers={"Content-Length": "4096"})
+
+    ok, error, _ = downloader.download_image("https://example.com/a.png")
+
+    assert not ok
+    assert "截断" in error
+
+
+def test_deep_verify_rejects_corrupt_image(tmp_path, requests_mock):
+    good = make_png_bytes()
+    # 文件头完好，但图像数据被破坏
+    corrupt = bytearray(make_png_bytes((200, 10, 10)))
+    corrupt[-30:-12] = b"\x00" * 18
+    requests_mock.get("https://example.com/good.png", content=good)
+    requests_mock.get("https://example.com/bad.png", content=bytes(corrupt))
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![g](https://example.com/good.png)\n![b](https://example.com/bad.png)\n",
+                       encoding="utf-8")
+    uploader = FakeUploader()
+    verifier = ImageVerifier(workers=2)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, verifier=verifier)
+
+    try:
+        results = downloader.process_markdown_file(str(md_file))
+    finally:
+        verifier.close()
+
+    assert [item["url"] for item in results["success"]] == ["https://example.com/good.png"]
+    assert results["failed"][0]["url"] == "https://example.com/bad.png"
+    assert "无法解码" in results["failed"][0]["error"]
+    assert len(uploader.uploaded) == 1
+    # 损坏的文件已从存储中删除
+    assert len(list((tmp_path / "images").rglob("*.png"))) == 1
+
+
+def test_verify_many_keeps_input_order(tmp_path):
+    corrupt = bytearray(make_png_bytes((200, 10, 10)))
+    corrupt[-30:-12] = b"\x00" * 18
+    (tmp_path / "good.png").write_bytes(make_png_bytes())
+    (tmp_path / "bad.png").write_bytes(bytes(corrupt))
+    (tmp_path / "icon.svg").write_bytes(b"<svg></svg>")
+    paths = [str(tmp_path / name) for name in ("bad.png", "good.png", "icon.svg", "bad.png")]
+    verifier = ImageVerifier(workers=2)
+
+    try:
+        errors = verifier.verify_many(paths)
+    finally:
+        verifier.close()
+
+    assert [error is None for error in errors] == [False, True, True, False]
+    assert "无法解码" in errors[0]
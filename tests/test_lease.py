@@ -0,0 +1,85 @@
+import threading
+
+from tests.helpers import FakeClock
+from utils.lease import LeaseStore
+
+
+def test_only_one_owner_holds_a_lease(tmp_path):
+    clock = FakeClock()
+    a = LeaseStore(str(tmp_path), "a", ttl=10, clock=clock)
+    b = LeaseStore(str(tmp_path), "b", ttl=10, clock=clock)
+
+    lease = a.acquire("urls-0")
+
+    assert lease is not None and lease.owner == "a"
+    assert b.acquire("urls-0") is None
+    a.release(lease)
+    assert b.acquire("urls-0") is not None
+    # 只留下租约文件，没有残留的临时文件
+    assert [path.name for path in tmp_path.iterdir()] == ["urls-0.lease"]
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    clock = FakeClock()
+    crashed = LeaseStore(str(tmp_path), "crashed", ttl=10, clock=clock)
+    survivor = LeaseStore(str(tmp_path), "survivor", ttl=10, clock=clock)
+    stale = crashed.acquire("urls-0")
+
+    clock.now += 5
+    assert survivor.acquire("urls-0") is None
+    clock.now += 6
+    lease = survivor.acquire("urls-0")
+
+    assert lease is not None and lease.owner == "survivor"
+    # 原持有者恢复后发现租约已丢失，释放时不会删除新持有者的租约
+    assert not crashed.renew(stale)
+    assert stale.lost
+    crashed.release(stale)
+    assert LeaseStore(str(tmp_path), "other", ttl=10, clock=clock).acquire("urls-0") is None
+
+
+def test_renewal_keeps_lease_alive(tmp_path):
+    clock = FakeClock()
+    holder = LeaseStore(str(tmp_path), "holder", ttl=10, clock=clock)
+    other = LeaseStore(str(tmp_path), "other", ttl=10, clock=clock)
+    lease = holder.acquire("plan")
+
+    clock.now += 8
+    assert holder.renew(lease)
+    clock.now += 8
+
+    assert other.acquire("plan") is None
+
+
+def test_concurrent_takeover_has_single_winner(tmp_path):
+    clock = FakeClock()
+    LeaseStore(str(tmp_path), "crashed", ttl=10, clock=clock).acquire("urls-0")
+    clock.now += 20
+    stores = [LeaseStore(str(tmp_path), f"w{i}", ttl=10, clock=clock) for i in range(8)]
+    winners = []
+    barrier = threading.Barrier(len(stores))
+
+    def contend(store):
+        barrier.wait()
+        lease = store.acquire("urls-0")
+        if lease:
+            winners.append(lease.owner)
+
+    threads = [threading.Thread(target=contend, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(winners) == 1
+
+
+def test_heartbeat_renews_held_leases(tmp_path):
+    holder = LeaseStore(str(tmp_path), "holder", ttl=0.15).start()
+    other = LeaseStore(str(tmp_path), "other", ttl=0.15)
+    try:
+        holder.acquire("plan")
+        threading.Event().wait(0.4)
+        assert other.acquire("plan") is None
+    finally:
+        holder.stop()
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+from main import build_downloader, main, parse_args
+from storage.manifest import MigrationManifest
+from storage.uploaders.router import UploaderRouter
+from tests.helpers import NamedUploader
+
+
+@pytest.mark.parametrize("argv, message", [
+    (["--dry-run", "--watch"], "--dry-run 不能与 --watch 同时使用"),
+    (["--dry-run", "--revalidate"], "--dry-run 不能与 --revalidate 同时使用"),
+    (["--stream", "--deep-verify"], "--stream 不能与 --deep-verify 同时使用"),
+    (["--workers", "2"], "--workers 需要同时指定 --shard-dir"),
+    (["--stream", "--webp"], "--stream 不能与图片优化同时使用"),
+    (["--quality", "0"], "--quality 必须在 1 到 100 之间"),
+])
+def test_conflicting_flags_are_rejected(argv, message, capsys):
+    with pytest.raises(SystemExit) as exc:
+        parse_args(argv)
+
+    assert exc.value.code == 2
+    assert message in capsys.readouterr().err
+
+
+def test_dry_run_alone_is_accepted():
+    args = parse_args(["--dry-run", "--markdown-dir", "docs"])
+
+    assert args.dry_run and not args.revalidate
+
+
+def snapshot(root):
+    """目录下所有文件的路径、大小和修改时间"""
+    return {
+        os.path.join(directory, name): (os.stat(os.path.join(directory, name)).st_size,
+                                        os.stat(os.path.join(directory, name)).st_mtime_ns)
+        for directory, _, names in os.walk(root) for name in names
+    }
+
+
+def test_dry_run_changes_nothing_on_disk(tmp_path):
+    docs, save_dir = tmp_path / "docs", tmp_path / "images"
+    docs.mkdir()
+    (docs / "note.md").write_text("![a](https://example.com/a.png)\n![b](https://example.com/b.png)\n",
+                                  encoding="utf-8")
+    with MigrationManifest(str(save_dir / "manifest.db")) as manifest:
+        manifest.record_download("https://example.com/a.png", "abc", ".png", 3)
+        manifest.record_upload("abc", "smms", "https://s2.loli.net/a.png")
+    before = snapshot(tmp_path)
+
+    report = main(["--dry-run", "--markdown-dir", str(docs), "--save-dir", str(save_dir),
+                   "--backends", "sms"])
+
+    assert report.url_mapping == {"https://example.com/a.png": "https://s2.loli.net/a.png",
+                                  "https://example.com/b.png": None}
+    assert snapshot(tmp_path) == before
+
+
+def test_dry_run_does_not_create_save_dir(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "note.md").write_text("![a](https://example.com/a.png)\n", encoding="utf-8")
+
+    report = main(["--dry-run", "--markdown-dir", str(docs), "--save-dir", str(tmp_path / "images"),
+                   "--backends", "sms"])
+
+    assert report.pending_urls == ["https://example.com/a.png"]
+    assert not (tmp_path / "images").exists()
+
+
+def test_optimizer_flags_build_optimizer(tmp_path):
+    pytest.importorskip("PIL")
+    args = parse_args(["--webp", "--quality", "80", "--max-dimension", "1600", "--max-size-kb", "500"])
+
+    downloader = build_downloader(args, tmp_path / "images", None)
+    try:
+        options = downloader.optimizer.options
+        assert (options.webp, options.quality, options.max_dimension) == (True, 80, 1600)
+        assert options.max_bytes == 500 * 1024
+        # 优化器与下载器共用同一个图片存储
+        assert downloader.optimizer.store is downloader.store
+    finally:
+        downloader.optimizer.close()
+        downloader.manifest.close()
+
+
+def test_optimizer_is_off_by_default(tmp_path):
+    downloader = build_downloader(parse_args([]), tmp_path / "images", None)
+    downloader.manifest.close()
+
+    assert downloader.optimizer is None
+
+
+def test_upload_workers_cover_all_backends(tmp_path):
+    first, second = NamedUploader("first"), NamedUploader("second")
+    first.max_concurrency, second.max_concurrency = 2, 8
+    router = UploaderRouter([first, second])
+
+    downloader = build_downloader(parse_args([]), tmp_path / "images", router)
+    downloader.manifest.close()
+    assert downloader.upload_workers == 10
+
+    downloader = build_downloader(parse_args(["--upload-workers", "3"]), tmp_path / "images", router)
+    downloader.manifest.close()
+    assert downloader.upload_workers == 3
@@ -0,0 +1,166 @@
+import pytest
+from pathlib import Path
+
+from markdown.image_downloader import MarkdownImageDownloader
+from storage.manifest import MigrationManifest, STATUS_DONE, STATUS_FAILED
+from tests.helpers import PNG, FakeUploader
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        yield manifest
+
+
+def test_manifest_uses_wal(manifest):
+    mode = manifest._fetchone("PRAGMA journal_mode")[0]
+    assert mode.lower() == "wal"
+
+
+def test_upload_failure_keeps_done_record(manifest):
+    manifest.record_upload("abc", "smms", "https://s2.loli.net/a.png")
+    manifest.record_upload_failure("abc", "smms", "timeout")
+
+    assert manifest.get_remote_url("abc", "smms") == "https://s2.loli.net/a.png"
+    assert manifest.is_remote_url("https://s2.loli.net/a.png")
+    assert manifest.get_remote_url("abc", "cos") is None
+
+
+def test_download_failure_keeps_digest(manifest):
+    manifest.record_download("https://example.com/a.png", "abc", ".png", 3)
+    manifest.record_download_failure("https://example.com/a.png", "404")
+
+    source = manifest.get_source("https://example.com/a.png")
+    assert source.status == STATUS_FAILED
+    assert source.digest == "abc"
+
+
+def test_rerun_makes_no_http_requests(tmp_path, manifest, requests_mock):
+    url = "https://example.com/a.png"
+    adapter = requests_mock.get(url, content=PNG + b"image-a")
+    md_file = tmp_path / "note.md"
+    md_file.write_text(f"![a]({url})", encoding='utf-8')
+    uploader = FakeUploader()
+
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest)
+    downloader.process_markdown_file(str(md_file))
+    assert manifest.get_source(url).status == STATUS_DONE
+
+    # 模拟回写前中断：恢复原文后重新运行
+    md_file.write_text(f"![a]({url})", encoding='utf-8')
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest)
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert adapter.call_count == 1
+    assert len(uploader.uploaded) == 1
+    assert len(results['success']) == 1
+    assert url not in md_file.read_text(encoding='utf-8')
+
+
+def test_skip_filter_uses_manifest(tmp_path, manifest):
+    manifest.record_upload("abc", "fake", "https://other.example.com/migrated.png")
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), FakeUploader(), manifest=manifest)
+
+    urls = downloader.extract_images(
+        "![a](https://other.example.com/migrated.png)\n"
+        "![b](https://cdn.example.com/images/x.png)\n"
+        "![c](https://example.com/new.png)\n"
+    )
+
+    assert urls == ["https://example.com/new.png"]
+
+
+def test_conditional_refetch_uses_stored_validators(tmp_path, manifest, requests_mock):
+    url = "https://example.com/a.png"
+    validators = {"ETag": '"v1"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+    requests_mock.get(url, content=PNG + b"image-a", headers=validators)
+    MarkdownImageDownloader(str(tmp_path / "images"), manifest=manifest).download_image(url)
+    source = manifest.get_source(url)
+    assert (source.etag, source.last_modified) == ('"v1"', validators["Last-Modified"])
+
+    requests_mock.get(url, status_code=304, headers={"ETag": '"v1"'})
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), manifest=manifest, revalidate=True)
+    ok, _, save_path = downloader.download_image(url)
+
+    assert ok and Path(save_path).read_bytes() == PNG + b"image-a"
+    headers = requests_mock.last_request.headers
+    assert headers["If-None-Match"] == '"v1"'
+    assert headers["If-Modified-Since"] == validators["Last-Modified"]
+
+
+def test_revalidate_sources_reports_changes(tmp_path, manifest, requests_mock):
+    same, changed, gone = ("https://example.com/same.png", "https://example.com/changed.png",
+                           "https://example.com/gone.png")
+    for url in (same, changed, gone):
+        requests_mock.get(url, content=PNG + url.encode(), headers={"ETag": '"v1"'})
+        MarkdownImageDownloader(str(tmp_path / "images"), manifest=manifest).download_image(url)
+
+    requests_mock.get(same, status_code=304)
+    requests_mock.get(changed, content=PNG + b"new bytes", headers={"ETag": '"v2"'})
+    requests_mock.get(gone, status_code=404)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), manifest=manifest)
+
+    summary = downloader.revalidate_sources()
+
+    assert summary == {"unchanged": [same], "changed": [changed], "failed": [gone]}
+    assert manifest.get_source(changed).etag == '"v2"'
+    # 源站暂时不可用时保留此前成功的下载记录
+    assert manifest.get_source(gone).status == STATUS_DONE
+
+
+def test_revalidated_unchanged_image_reuses_upload(tmp_path, manifest, requests_mock):
+    url = "https://example.com/a.png"
+    requests_mock.get(url, content=PNG + b"image-a", headers={"ETag": '"v1"'})
+    md_file = tmp_path / "note.md"
+    md_file.write_text(f"![a]({url})", encoding="utf-8")
+    uploader = FakeUploader()
+    MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest).process_markdown_file(
+        str(md_file))
+    md_file.write_text(f"![a]({url})", encoding="utf-8")
+
+    requests_mock.get(url, status_code=304)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest,
+                                         revalidate=True)
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert results["success"][0]["new_url"].startswith("https://cdn.example.com/")
+    assert len(uploader.uploaded) == 1
+    assert requests_mock.call_count == 2
+
+
+def test_evicted_image_is_revalidated_conditionally(tmp_path, manifest, requests_mock):
+    url = "https://example.com/a.png"
+    requests_mock.get(url, content=PNG + b"image-a", headers={"ETag": '"v1"'})
+    md_file = tmp_path / "note.md"
+    md_file.write_text(f"![a]({url})", encoding="utf-8")
+    uploader = FakeUploader()
+    # 字节预算为 1，上传后本地副本立即被淘汰
+    first = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest, cache_size=1)
+    first.process_markdown_file(str(md_file))
+    assert len(first.store) == 0
+    md_file.write_text(f"![a]({url})", encoding="utf-8")
+
+    requests_mock.get(url, status_code=304)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest,
+                                         revalidate=True, cache_size=1)
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert requests_mock.last_request.headers["If-None-Match"] == '"v1"'
+    assert results["success"][0]["new_url"].startswith("https://cdn.example.com/")
+    assert len(uploader.uploaded) == 1
+
+
+def test_old_manifest_gains_validator_columns(tmp_path):
+    import sqlite3
+
+    db_path = tmp_path / "old.db"
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("CREATE TABLE sources (url TEXT PRIMARY KEY, digest TEXT, ext TEXT, size INTEGER, "
+                 "status TEXT NOT NULL, error TEXT, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO sources VALUES ('https://example.com/a.png', 'abc', '.png', 1, 'done', NULL, 0)")
+    conn.commit()
+    conn.close()
+
+    with MigrationManifest(str(db_path)) as manifest:
+        source = manifest.get_source("https://example.com/a.png")
+        assert source.digest == "abc" and source.etag is None
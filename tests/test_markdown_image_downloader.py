@@ -1,6 +1,7 @@
 import pytest
 from pathlib import Path
 from markdown.image_downloader import MarkdownImageDownloader
+from tests.helpers import PNG, FakeUploader
 
 @pytest.fixture
 def downloader(tmp_path):
@@ -32,9 +33,9 @@ def test_extract_images(downloader):
 
 def test_process_markdown_file(downloader, sample_md_file, requests_mock):
     # Mock请求响应
-    requests_mock.get('https://example.com/image1.jpg', content=b'fake-image-1')
-    requests_mock.get('https://example.com/image2.png', content=b'fake-image-2')
-    requests_mock.get('https://example.com/image3.gif', content=b'fake-image-3')
+    requests_mock.get('https://example.com/image1.jpg', content=PNG + b'fake-image-1')
+    requests_mock.get('https://example.com/image2.png', content=PNG + b'fake-image-2')
+    requests_mock.get('https://example.com/image3.gif', content=PNG + b'fake-image-3')
     
     # Mock HEAD请求
     requests_mock.head('https://example.com/image1.jpg', headers={'Content-Type': 'image/jpeg'})
@@ -44,4 +45,73 @@ def test_process_markdown_file(downloader, sample_md_file, requests_mock):
     results = downloader.process_markdown_file(sample_md_file)
     
     assert len(results['success']) == 3
-    assert len(results['failed']) == 0
\ No newline at end of file
+    assert len(results['failed']) == 0
+
+def test_download_rejects_declared_oversize(tmp_path, requests_mock):
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), max_image_size=10)
+    requests_mock.get('https://example.com/big.png', content=b'x' * 100,
+                      headers={'Content-Length': '100'})
+
+    success, error, save_path = downloader.download_image('https://example.com/big.png')
+
+    assert not success
+    assert "超过限制" in error
+    assert save_path == ""
+    assert list((tmp_path / "images").rglob("*.png")) == []
+
+
+def test_download_aborts_stream_over_limit(tmp_path, requests_mock):
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), max_image_size=10, chunk_size=4)
+    requests_mock.get('https://example.com/big.png', content=b'x' * 100)
+
+    success, error, _ = downloader.download_image('https://example.com/big.png')
+
+    assert not success
+    assert "超过限制" in error
+    # 中止后临时文件被清理
+    assert list(downloader.store.tmp_dir.iterdir()) == []
+
+
+def test_download_limit_defaults_to_uploader(tmp_path):
+    from storage.uploaders.sms_uploader import SMSUploader
+
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), SMSUploader(api_token="token"))
+
+    assert downloader.max_image_size == 5 * 1024 * 1024
+
+
+def test_download_uses_single_get_without_head(downloader, requests_mock):
+    png = PNG + b'\x00' * 32
+    requests_mock.get('https://example.com/render?id=1', content=png,
+                      headers={'Content-Type': 'application/octet-stream'})
+
+    success, _, save_path = downloader.download_image('https://example.com/render?id=1')
+
+    assert success
+    assert save_path.endswith('.png')
+    assert [request.method for request in requests_mock.request_history] == ['GET']
+
+
+def test_download_extension_from_content_type(downloader, requests_mock):
+    requests_mock.get('https://example.com/avatar', content=b'\x00\x00\x00\x1cnot-sniffable',
+                      headers={'Content-Type': 'image/webp'})
+
+    success, _, save_path = downloader.download_image('https://example.com/avatar')
+
+    assert success
+    assert save_path.endswith('.webp')
+
+
+def test_long_rate_limit_wait_is_logged(tmp_path, requests_mock, caplog, monkeypatch):
+    requests_mock.get('https://example.com/a.png', content=PNG + b'image-a')
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![a](https://example.com/a.png)", encoding='utf-8')
+    uploader = FakeUploader()
+    monkeypatch.setattr(uploader.rate_limiter, "time_until_available", lambda: 120)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    with caplog.at_level("INFO"):
+        results = downloader.process_markdown_file(str(md_file))
+
+    assert results["failed"] == []
+    assert "已达到上传限制，等待 2.0 分钟后继续..." in caplog.messages
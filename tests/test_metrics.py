@@ -0,0 +1,108 @@
+import json
+import time
+
+import pytest
+
+from markdown.image_downloader import MarkdownImageDownloader
+from storage.base_uploader import UploadItem
+from tests.helpers import PNG, FakeUploader
+from utils.metrics import MetricsRegistry, MetricsReporter, metrics
+from utils.rate_limiter import RateLimit
+
+
+@pytest.fixture(autouse=True)
+def clear_metrics():
+    metrics.clear()
+    yield
+    metrics.clear()
+
+
+def test_histogram_quantiles_and_timer():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", buckets=(0.1, 1, 10))
+    for value in (0.05, 0.05, 0.5, 5):
+        histogram.observe(value)
+    with registry.timer("latency_seconds"):
+        pass
+
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["p50"] == 0.1
+    assert snapshot["p99"] == 5
+    assert snapshot["max"] == 5
+
+
+def test_prometheus_and_json_export(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "请求数", status="ok").inc(3)
+    registry.gauge("queue_depth", stage='a"b').set(2)
+    registry.histogram("seconds", buckets=(1,)).observe(0.5)
+
+    text = registry.to_prometheus()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{status="ok"} 3.0' in text
+    assert 'queue_depth{stage="a\\"b"} 2' in text
+    assert 'seconds_bucket{le="1.0"} 1' in text
+    assert 'seconds_bucket{le="+Inf"} 1' in text
+    assert "seconds_count 1" in text
+
+    registry.write(str(tmp_path / "m.json"), str(tmp_path / "m.prom"))
+    data = json.loads((tmp_path / "m.json").read_text(encoding="utf-8"))
+    assert data["requests_total"]["values"] == [{"labels": {"status": "ok"}, "value": 3}]
+    assert (tmp_path / "m.prom").read_text(encoding="utf-8") == text
+
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total")
+
+
+def test_reporter_writes_on_interval(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter("ticks_total").inc()
+    path = tmp_path / "metrics.prom"
+    reporter = MetricsReporter(registry, 0.01, prometheus_path=str(path)).start()
+    deadline = time.monotonic() + 2
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    registry.counter("ticks_total").inc()
+    reporter.stop()
+
+    assert "ticks_total 2.0" in path.read_text(encoding="utf-8")
+
+
+def test_pipeline_and_uploader_are_instrumented(tmp_path, requests_mock):
+    requests_mock.get("https://example.com/a.png", content=PNG + b"image-a")
+    requests_mock.get("https://example.com/b.png", content=PNG + b"image-b")
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![a](https://example.com/a.png) ![b](https://example.com/b.png)",
+                       encoding="utf-8")
+    uploader = FakeUploader()
+    uploader.rate_limits = (RateLimit(1, 0.05),)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    downloader.process_markdown_file(str(md_file))
+
+    summary = metrics.to_dict()
+    stages = {v["labels"]["stage"]: v["count"] for v in summary["pipeline_stage_seconds"]["values"]}
+    assert stages == {"download": 2, "verify": 2, "upload": 2, "rewrite": 2}
+    assert summary["download_bytes_total"]["values"][0]["value"] == 2 * len(PNG) + 14
+    uploads = summary["upload_requests_total"]["values"]
+    assert uploads == [{"labels": {"backend": "fake", "status": "ok"}, "value": 2}]
+    assert summary["upload_bytes_total"]["values"][0]["value"] == 2 * len(PNG) + 14
+    wait = summary["rate_limiter_wait_seconds"]["values"][0]
+    assert wait["count"] == 2 and wait["sum"] > 0
+    assert summary["rewrite_files_total"]["values"][0]["value"] == 1
+
+
+def test_failed_upload_is_counted():
+    class FailingUploader(FakeUploader):
+        def upload_file(self, file_path, remote_path):
+            raise Exception("boom")
+
+    result = FailingUploader().upload_item(UploadItem("/tmp/a.png", "a.png"))
+
+    assert not result.ok
+    summary = metrics.to_dict()
+    assert summary["upload_requests_total"]["values"] == [
+        {"labels": {"backend": "fake", "status": "error"}, "value": 1}
+    ]
+    assert "upload_bytes_total" not in summary
@@ -0,0 +1,272 @@
+import pytest
+
+from markdown.image_downloader import MarkdownImageDownloader
+from markdown.pipeline import MigrationPipeline
+from markdown.planner import build_plan
+from tests.helpers import PNG, FakeUploader
+
+
+@pytest.fixture
+def md_files(tmp_path):
+    files = []
+    for i in range(3):
+        md_file = tmp_path / f"note{i}.md"
+        md_file.write_text(
+            f"![a](https://example.com/{i}-a.png)\n"
+            f"<img src=\"https://example.com/{i}-b.png\" />\n",
+            encoding='utf-8'
+        )
+        files.append(str(md_file))
+    return files
+
+
+def mock_images(requests_mock, count=3):
+    for i in range(count):
+        for name in ("a", "b"):
+            requests_mock.get(f"https://example.com/{i}-{name}.png",
+                              content=PNG + f"fake-image-{i}-{name}".encode())
+
+
+def test_pipeline_rewrites_every_file(tmp_path, md_files, requests_mock):
+    mock_images(requests_mock)
+    uploader = FakeUploader()
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    results = downloader.process_markdown_files(md_files)
+
+    assert set(results) == set(md_files)
+    for md_file in md_files:
+        assert len(results[md_file]['success']) == 2
+        assert results[md_file]['failed'] == []
+        content = open(md_file, encoding='utf-8').read()
+        assert "https://example.com" not in content
+        assert "https://cdn.example.com/images/" in content
+    assert len(uploader.uploaded) == 6
+
+
+def test_pipeline_records_download_failures(tmp_path, md_files, requests_mock):
+    mock_images(requests_mock)
+    requests_mock.get("https://example.com/1-a.png", status_code=404)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), FakeUploader())
+
+    results = downloader.process_markdown_files(md_files)
+
+    assert len(results[md_files[1]]['failed']) == 1
+    assert results[md_files[1]]['failed'][0]['url'] == "https://example.com/1-a.png"
+    # 失败的图片保持原链接
+    assert "https://example.com/1-a.png" in open(md_files[1], encoding='utf-8').read()
+
+
+def test_downloads_continue_while_upload_waits(tmp_path, md_files, requests_mock):
+    mock_images(requests_mock)
+    uploader = FakeUploader(delay=0.05)
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+    download_done = []
+    original_download = downloader.download_image
+
+    def tracking_download(url):
+        result = original_download(url)
+        download_done.append(len(uploader.uploaded))
+        return result
+
+    downloader.download_image = tracking_download
+    MigrationPipeline(downloader, download_workers=2, queue_size=8).run(md_files)
+
+    # 上传缓慢时，所有下载都应在大部分上传完成之前结束
+    assert len(download_done) == 6
+    assert download_done[-1] < len(uploader.uploaded)
+
+
+def test_shared_url_is_fetched_and_uploaded_once(tmp_path, requests_mock):
+    url = "https://example.com/shared.png"
+    adapter = requests_mock.get(url, content=PNG + b"fake-image")
+    md_files = []
+    for i in range(40):
+        md_file = tmp_path / f"note{i}.md"
+        md_file.write_text(f"![shot]({url})\n![shot again]({url})\n", encoding='utf-8')
+        md_files.append(str(md_file))
+    uploader = FakeUploader()
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    results = downloader.process_markdown_files(md_files)
+
+    assert adapter.call_count == 1
+    assert len(uploader.uploaded) == 1
+    assert len([p for p in (tmp_path / "images").rglob("*.png")]) == 1
+    for md_file in md_files:
+        assert len(results[md_file]['success']) == 1
+        content = open(md_file, encoding='utf-8').read()
+        assert url not in content
+        assert content.count("https://cdn.example.com/images/") == 2
+
+
+def test_plan_collects_unique_urls(tmp_path):
+    first = tmp_path / "a.md"
+    second = tmp_path / "b.md"
+    first.write_text("![x](https://example.com/1.png)\n![y](https://example.com/2.png)", encoding='utf-8')
+    second.write_text("![z](https://example.com/2.png)", encoding='utf-8')
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"))
+
+    plan = build_plan([str(first), str(second), str(tmp_path / "missing.md")], downloader.extract_image_refs)
+
+    assert plan.urls == ["https://example.com/1.png", "https://example.com/2.png"]
+    assert plan.url_files["https://example.com/2.png"] == [str(first), str(second)]
+    assert plan.reference_count == 3
+    assert str(tmp_path / "missing.md") in plan.errors
+
+
+def test_identical_bytes_behind_different_urls_upload_once(tmp_path, requests_mock):
+    requests_mock.get("https://a.example.com/one.png", content=PNG + b"same-bytes")
+    requests_mock.get("https://b.example.com/two.png", content=PNG + b"same-bytes")
+    md_file = tmp_path / "note.md"
+    md_file.write_text(
+        "![1](https://a.example.com/one.png)\n![2](https://b.example.com/two.png)\n",
+        encoding='utf-8'
+    )
+    uploader = FakeUploader()
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert len(uploader.uploaded) == 1
+    new_urls = {item['new_url'] for item in results['success']}
+    assert len(new_urls) == 1
+
+
+def test_rewrites_are_committed_after_all_images(tmp_path, md_files, requests_mock, monkeypatch):
+    mock_images(requests_mock)
+    written = []
+    import markdown.committer as committer
+    original = committer.atomic_write_text
+
+    def record(path, content, encoding="utf-8"):
+        # 提交时所有图片都已上传完毕
+        written.append((str(path), len(uploader.uploaded)))
+        original(path, content, encoding)
+
+    monkeypatch.setattr(committer, "atomic_write_text", record)
+    uploader = FakeUploader()
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader)
+
+    downloader.process_markdown_files(md_files)
+
+    assert sorted(path for path, _ in written) == sorted(md_files)
+    assert all(count == 6 for _, count in written)
+    assert list(tmp_path.glob(".*.tmp")) == []
+
+
+def test_file_edited_during_run_is_not_overwritten(tmp_path, requests_mock):
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![a](https://example.com/a.png)\n", encoding='utf-8')
+
+    class EditingUploader(FakeUploader):
+        def upload_file(self, file_path, remote_path):
+            md_file.write_text("用户的新内容\n![a](https://example.com/a.png)\n", encoding='utf-8')
+            return super().upload_file(file_path, remote_path)
+
+    requests_mock.get("https://example.com/a.png", content=PNG + b"image-a")
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), EditingUploader())
+
+    results = downloader.process_markdown_file(str(md_file))
+
+    assert "迁移期间被修改" in results['failed'][0]['error']
+    assert md_file.read_text(encoding='utf-8').startswith("用户的新内容")
+
+
+def test_dry_run_reports_mapping_without_network(tmp_path, md_files, requests_mock):
+    from storage.manifest import MigrationManifest
+
+    manifest = MigrationManifest(str(tmp_path / "manifest.db"))
+    manifest.record_download("https://example.com/0-a.png", "abc", ".png", 10)
+    uploader = FakeUploader()
+    manifest.record_upload("abc", uploader.backend_name, "https://cdn.example.com/images/abc.png")
+    before = {md_file: open(md_file, encoding='utf-8').read() for md_file in md_files}
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest)
+
+    report = downloader.plan_markdown_files(md_files)
+
+    assert requests_mock.call_count == 0
+    assert uploader.uploaded == []
+    assert len(report.url_mapping) == 6
+    assert report.url_mapping["https://example.com/0-a.png"] == "https://cdn.example.com/images/abc.png"
+    assert len(report.pending_urls) == 5
+    stats = report.files[md_files[0]]
+    assert (stats.references, stats.lines, stats.bytes_delta) == (2, 2, None)
+    assert {md_file: open(md_file, encoding='utf-8').read() for md_file in md_files} == before
+
+
+def test_stream_through_uploads_without_local_copy(tmp_path, md_files, requests_mock):
+    from storage.manifest import MigrationManifest
+
+    mock_images(requests_mock)
+    # 两个URL内容相同，只上传一次
+    requests_mock.get("https://example.com/2-b.png", content=PNG + b"fake-image-2-a")
+    originals = {md_file: open(md_file, encoding='utf-8').read() for md_file in md_files}
+    uploader = FakeUploader()
+    manifest = MigrationManifest(str(tmp_path / "manifest.db"))
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest,
+                                         stream_through=True)
+
+    results = downloader.process_markdown_files(md_files)
+
+    assert all(not result['failed'] for result in results.values())
+    assert len(uploader.uploaded) == 5
+    assert not list((tmp_path / "images").rglob("*.png"))
+    for md_file in md_files:
+        assert "https://cdn.example.com/images/" in open(md_file, encoding='utf-8').read()
+
+    # 清单记录了内容摘要，再次运行时不重新下载或上传
+    for md_file, content in originals.items():
+        open(md_file, "w", encoding='utf-8').write(content)
+    requests_made = len(requests_mock.request_history)
+    rerun = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest,
+                                    stream_through=True)
+    results = rerun.process_markdown_files(md_files)
+
+    assert all(len(result['success']) == 2 for result in results.values())
+    assert len(requests_mock.request_history) == requests_made
+    assert len(uploader.uploaded) == 5
+
+
+def test_stream_through_rejects_deep_verify(tmp_path):
+    from storage.image_verifier import ImageVerifier
+
+    verifier = ImageVerifier()
+    if not verifier.available:
+        pytest.skip("需要 Pillow")
+    with pytest.raises(ValueError):
+        MarkdownImageDownloader(str(tmp_path / "images"), FakeUploader(), verifier=verifier,
+                                stream_through=True)
+
+
+def test_cache_budget_evicts_uploaded_images(tmp_path, md_files, requests_mock):
+    from storage.manifest import MigrationManifest
+
+    mock_images(requests_mock)
+    uploader = FakeUploader()
+    manifest = MigrationManifest(str(tmp_path / "manifest.db"))
+    size = len(PNG + b"fake-image-0-a")
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), uploader, manifest=manifest,
+                                         cache_size=2 * size)
+
+    results = downloader.process_markdown_files(md_files)
+
+    assert all(len(result['success']) == 2 for result in results.values())
+    assert len(uploader.uploaded) == 6
+    assert downloader.store.total_bytes <= 2 * size
+    assert len(list((tmp_path / "images").rglob("*.png"))) == len(downloader.store) <= 2
+
+
+def test_cache_keeps_images_that_are_not_uploaded(tmp_path, md_files, requests_mock):
+    mock_images(requests_mock)
+    class RejectingUploader(FakeUploader):
+        def upload_file(self, file_path, remote_path):
+            raise Exception("quota exceeded")
+
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), RejectingUploader(), cache_size=1)
+
+    results = downloader.process_markdown_files(md_files)
+
+    assert all(len(result['failed']) == 2 for result in results.values())
+    # 上传失败的图片保留在本地，下次运行无需重新下载
+    assert len(downloader.store) == 6
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+
+from storage.uploaders.sms_uploader import SMSUploader
+from tests.helpers import FakeClock
+from utils.rate_limiter import RateLimit, RateLimiter
+
+
+def test_sliding_window_prevents_boundary_burst():
+    clock = FakeClock()
+    limiter = RateLimiter([RateLimit(3, 60)], clock=clock)
+
+    clock.now += 59
+    assert all(limiter.try_acquire() for _ in range(3))
+    # 固定窗口在此处会重置计数，滑动窗口仍然拒绝
+    clock.now += 2
+    assert not limiter.try_acquire()
+    assert limiter.time_until_available() == 58
+
+    clock.now += 58
+    assert limiter.try_acquire()
+
+
+def test_all_policies_must_allow():
+    clock = FakeClock()
+    limiter = RateLimiter([RateLimit(2, 1), RateLimit(3, 100)], clock=clock)
+
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert limiter.time_until_available() == 1
+    clock.now += 1
+    assert limiter.try_acquire()
+    clock.now += 1
+    assert not limiter.try_acquire()
+    assert limiter.time_until_available() == 98
+
+
+def test_refund_returns_slot():
+    limiter = RateLimiter([RateLimit(1, 60)])
+
+    slot = limiter.try_acquire()
+    assert slot
+    assert not limiter.try_acquire()
+    limiter.refund(slot)
+    assert limiter.try_acquire()
+
+
+def test_refund_keeps_slots_taken_by_other_threads():
+    clock = FakeClock()
+    limiter = RateLimiter([RateLimit(2, 60)], clock=clock)
+
+    first = limiter.try_acquire()
+    clock.sleep(30)
+    second = limiter.try_acquire()
+    limiter.refund(first)
+
+    # 退还的是第一个配额，第二个配额仍在窗口中，要等它过期后才有新的配额
+    assert [slot.time for slot in limiter._history] == [second.time]
+    assert limiter.try_acquire()
+    assert limiter.time_until_available() == 60
+
+
+def test_acquire_times_out():
+    limiter = RateLimiter([RateLimit(1, 60)])
+
+    assert limiter.acquire()
+    assert not limiter.acquire(timeout=0.01)
+
+
+def test_thread_safe_under_contention():
+    limiter = RateLimiter([RateLimit(5, 60)])
+    granted = []
+    barrier = threading.Barrier(20)
+
+    def worker():
+        barrier.wait()
+        if limiter.try_acquire():
+            granted.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(granted) == 5
+
+
+def test_acquire_async_waits_without_blocking_loop():
+    limiter = RateLimiter([RateLimit(1, 0.05)])
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await limiter.acquire_async()
+        await limiter.acquire_async()
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(run()) > 1
+
+
+def test_sms_uploader_policy():
+    uploader = SMSUploader(api_token="token")
+
+    assert uploader.rate_limiter.limits == (RateLimit(15, 60), RateLimit(100, 3600))
+    assert uploader.rate_limiter is uploader.rate_limiter
@@ -0,0 +1,39 @@
+from markdown.rewriter import find_image_refs, rewrite_image_urls
+
+
+def test_find_image_refs_offsets():
+    content = '![a]( https://example.com/a.png )\n<img src="https://example.com/b.png">'
+
+    refs = find_image_refs(content)
+
+    assert [ref.url for ref in refs] == ["https://example.com/a.png", "https://example.com/b.png"]
+    for ref in refs:
+        assert content[ref.start:ref.end] == ref.url
+
+
+def test_rewrite_does_not_touch_prefix_urls():
+    content = (
+        "![a](https://example.com/a.png)\n"
+        "![b](https://example.com/a.png.bak)\n"
+        "<img src='https://example.com/a.png'>\n"
+        "plain text https://example.com/a.png\n"
+    )
+
+    result = rewrite_image_urls(content, {"https://example.com/a.png": "https://cdn/x.png"})
+
+    assert result == (
+        "![a](https://cdn/x.png)\n"
+        "![b](https://example.com/a.png.bak)\n"
+        "<img src='https://cdn/x.png'>\n"
+        "plain text https://example.com/a.png\n"
+    )
+
+
+def test_rewrite_with_precomputed_refs():
+    content = "x ![a](u1) y ![b](u2) z"
+    refs = find_image_refs(content)
+
+    result = rewrite_image_urls(content, {"u2": "v2-longer"}, refs)
+
+    assert result == "x ![a](u1) y ![b](v2-longer) z"
+    assert rewrite_image_urls(content, {}, refs) == content
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from markdown.image_downloader import MarkdownImageDownloader
+from storage.base_uploader import UploadItem
+from storage.manifest import MigrationManifest
+from storage.uploaders.router import ROUTE_WEIGHTED, UploaderRouter
+from tests.helpers import PNG, NamedUploader
+from utils.rate_limiter import RateLimit
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"x" * 100)
+    return str(path)
+
+
+def test_ordered_routing_spills_over_when_quota_exhausted(image_file):
+    first = NamedUploader("first", rate_limits=(RateLimit(2, 3600),))
+    second = NamedUploader("second")
+    router = UploaderRouter([first, second])
+
+    results = [router.upload_item(UploadItem(image_file, f"{i}.png")) for i in range(5)]
+
+    assert all(result.ok for result in results)
+    assert [result.backend for result in results] == ["first", "first", "second", "second", "second"]
+    assert len(first.uploaded) == 2 and len(second.uploaded) == 3
+
+
+def test_failed_backend_falls_over_to_next(image_file):
+    router = UploaderRouter([NamedUploader("broken", fail=True), NamedUploader("backup")])
+
+    result = router.upload_item(UploadItem(image_file, "a.png"))
+
+    assert result.ok
+    assert result.backend == "backup"
+
+
+def test_all_backends_failing_reports_every_error(image_file):
+    router = UploaderRouter([NamedUploader("a", fail=True), NamedUploader("b", fail=True)])
+
+    result = router.upload_item(UploadItem(image_file, "a.png"))
+
+    assert not result.ok
+    assert "a: a quota exceeded" in result.error
+    assert "b: b quota exceeded" in result.error
+
+
+def test_files_too_large_for_a_backend_skip_it(image_file):
+    small = NamedUploader("small", max_file_size=10)
+    large = NamedUploader("large")
+    router = UploaderRouter([small, large])
+
+    result = router.upload_item(UploadItem(image_file, "a.png"))
+
+    assert result.backend == "large"
+    assert router.max_file_size is None
+
+
+def test_waits_for_the_backend_that_recovers_first(image_file):
+    slow = NamedUploader("slow", rate_limits=(RateLimit(1, 5),))
+    fast = NamedUploader("fast", rate_limits=(RateLimit(1, 0.1),))
+    router = UploaderRouter([slow, fast])
+    router.upload_item(UploadItem(image_file, "0.png"))
+    router.upload_item(UploadItem(image_file, "1.png"))
+
+    start = time.monotonic()
+    result = router.upload_item(UploadItem(image_file, "2.png"))
+
+    assert result.backend == "fast"
+    assert time.monotonic() - start < 1
+    assert router.rate_limiter.time_until_available() > 0
+
+
+def test_weighted_routing_follows_weights(image_file):
+    heavy = NamedUploader("heavy")
+    light = NamedUploader("light")
+    router = UploaderRouter([heavy, light], weights=[3, 1], strategy=ROUTE_WEIGHTED, seed=1)
+
+    for i in range(400):
+        router.upload_item(UploadItem(image_file, f"{i}.png"))
+
+    assert 250 < len(heavy.uploaded) < 350
+    assert len(heavy.uploaded) + len(light.uploaded) == 400
+
+
+def test_router_rejects_bad_configuration():
+    with pytest.raises(ValueError):
+        UploaderRouter([])
+    with pytest.raises(ValueError):
+        UploaderRouter([NamedUploader("a")], weights=[1, 2])
+    with pytest.raises(ValueError):
+        UploaderRouter([NamedUploader("a")], strategy="random")
+
+
+def test_pipeline_records_serving_backend(tmp_path, requests_mock):
+    md_file = tmp_path / "note.md"
+    md_file.write_text("![a](https://src.example.com/a.png)\n![b](https://src.example.com/b.png)\n",
+                       encoding="utf-8")
+    requests_mock.get("https://src.example.com/a.png", content=PNG + b"image-a")
+    requests_mock.get("https://src.example.com/b.png", content=PNG + b"image-b")
+    first = NamedUploader("first", rate_limits=(RateLimit(1, 3600),))
+    second = NamedUploader("second")
+    manifest = MigrationManifest(str(tmp_path / "manifest.db"))
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), UploaderRouter([first, second]),
+                                         manifest=manifest)
+
+    results = downloader.process_markdown_file(str(md_file))
+
+    backends = sorted(item["backend"] for item in results["success"])
+    assert backends == ["first", "second"]
+    assert downloader.is_migrated_url("https://first.example.com/images/x.png")
+
+    # 再次运行时从清单中找到各自后端的上传记录
+    md_file.write_text("![a](https://src.example.com/a.png)\n![b](https://src.example.com/b.png)\n",
+                       encoding="utf-8")
+    rerun = MarkdownImageDownloader(str(tmp_path / "images"), UploaderRouter([first, second]),
+                                    manifest=manifest)
+    results = rerun.process_markdown_file(str(md_file))
+    assert sorted(item["backend"] for item in results["success"]) == ["first", "second"]
+    assert len(first.uploaded) + len(second.uploaded) == 2
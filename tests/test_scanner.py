@@ -0,0 +1,77 @@
+import os
+
+from markdown.scanner import MarkdownScanner, index_file, iter_markdown_files
+from storage.manifest import MigrationManifest
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding='utf-8')
+    return path
+
+
+def test_iter_markdown_files_walks_lazily(tmp_path):
+    write(tmp_path / "a.md", "")
+    write(tmp_path / "sub" / "deep" / "b.MD", "")
+    write(tmp_path / "sub" / "note.txt", "")
+
+    files = iter_markdown_files(str(tmp_path))
+
+    assert iter(files) is files
+    assert sorted(p.name for p in files) == ["a.md", "b.MD"]
+
+
+def test_scan_reparses_only_changed_files(tmp_path, monkeypatch):
+    vault = tmp_path / "vault"
+    a = write(vault / "a.md", "![a](https://example.com/a.png)")
+    b = write(vault / "b.md", "![b](https://cdn.example.com/b.png)")
+    c = write(vault / "c.md", "no images")
+    is_migrated = lambda url: url.startswith("https://cdn.example.com/")
+
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        first = MarkdownScanner(manifest, is_migrated=is_migrated).scan(str(vault))
+        assert first.total == 3
+        assert first.reparsed == 3
+        assert first.pending == [a]
+
+        parsed = []
+        monkeypatch.setattr("markdown.scanner.find_image_refs",
+                            lambda content: parsed.append(content) or [])
+
+        # 新的扫描器从清单加载索引，未变化的文件不再读取
+        second = MarkdownScanner(manifest, is_migrated=is_migrated).scan(str(vault))
+        assert second.reparsed == 0
+        assert second.pending == [a]
+        assert parsed == []
+
+        # 只修改 mtime 时重新计算哈希，但不再解析
+        stat = b.stat()
+        os.utime(b, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        c.unlink()
+        third = MarkdownScanner(manifest, is_migrated=is_migrated).scan(str(vault))
+        assert third.reparsed == 1
+        assert third.removed == 1
+        assert parsed == []
+        assert str(c) not in manifest.load_file_index()
+
+
+def test_scan_in_process_pool(tmp_path):
+    vault = tmp_path / "vault"
+    for i in range(6):
+        write(vault / f"{i}.md", f"![img](https://example.com/{i}.png)")
+
+    result = MarkdownScanner(workers=2, parallel_threshold=4).scan(str(vault))
+
+    assert result.reparsed == 6
+    assert len(result.pending) == 6
+
+
+def test_unreadable_file_is_still_pending(tmp_path):
+    bad = tmp_path / "bad.md"
+    bad.write_bytes(b"\xff\xfe invalid utf-8")
+
+    record, error = index_file(str(bad))
+    assert record is None and error
+
+    result = MarkdownScanner().scan(str(tmp_path))
+    assert result.pending == [bad]
@@ -0,0 +1,188 @@
+import json
+import threading
+
+from markdown.image_downloader import MarkdownImageDownloader
+from markdown.sharding import ShardedMigration, collect_shard_results, shard_of
+from storage.manifest import MigrationManifest
+from tests.helpers import PNG, FakeUploader
+from utils.lease import LeaseStore
+from utils.rate_limiter import RateLimit
+
+
+def make_vault(tmp_path, requests_mock, notes=6, images=3):
+    vault = tmp_path / "vault"
+    (vault / "sub").mkdir(parents=True)
+    for n in range(notes):
+        folder = vault / "sub" if n % 2 else vault
+        lines = [f"![{i}](https://src.example.com/{n}-{i}.png)" for i in range(images)]
+        # 所有笔记都引用同一张共享图片
+        lines.append("![shared](https://src.example.com/shared.png)")
+        (folder / f"note{n}.md").write_text("\n".join(lines) + "\n", encoding="utf-8")
+        for i in range(images):
+            requests_mock.get(f"https://src.example.com/{n}-{i}.png", content=PNG + f"{n}-{i}".encode())
+    requests_mock.get("https://src.example.com/shared.png", content=PNG + b"shared")
+    return vault
+
+
+def make_worker(tmp_path, vault, worker_id, uploads, **kwargs):
+    save_dir = tmp_path / "save" / worker_id
+    downloader = MarkdownImageDownloader(str(save_dir), FakeUploader(uploaded=uploads),
+                                         manifest=MigrationManifest(str(save_dir / "manifest.db")))
+    return ShardedMigration(downloader, str(vault), str(tmp_path / "shards"), worker_id,
+                            shards=4, poll_interval=0.01, **kwargs)
+
+
+def test_workers_split_the_corpus(tmp_path, requests_mock):
+    vault = make_vault(tmp_path, requests_mock)
+    uploads = []
+    workers = [make_worker(tmp_path, vault, f"w{i}", uploads) for i in range(3)]
+    results = {}
+
+    def run(worker):
+        results[worker.worker_id] = worker.run()
+
+    threads = [threading.Thread(target=run, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 每个URL只上传一次，每个文件只被一个进程回写
+    assert len(uploads) == 6 * 3 + 1
+    assert len(set(uploads)) == len(uploads)
+    rewritten = [key for worker_results in results.values() for key in worker_results]
+    assert sorted(rewritten) == sorted(str(path) for path in vault.rglob("*.md"))
+    for path in vault.rglob("*.md"):
+        assert "src.example.com" not in path.read_text(encoding="utf-8")
+
+    merged = collect_shard_results(str(vault), str(tmp_path / "shards"))
+    assert sum(len(result["success"]) for result in merged.values()) == 6 * 4
+    assert all(not result["failed"] for result in merged.values())
+
+
+def test_plan_is_shared_by_all_workers(tmp_path, requests_mock):
+    vault = make_vault(tmp_path, requests_mock, notes=2)
+    make_worker(tmp_path, vault, "first", []).run()
+
+    # 之后加入的进程使用已有的规划（包括分片数），不会重新处理已完成的分片
+    late = make_worker(tmp_path, vault, "late", [])
+    late.shards = 8
+    history = len(requests_mock.request_history)
+    assert late.run() == {}
+    assert len(requests_mock.request_history) == history
+    plan = json.loads((tmp_path / "shards" / "plan.json").read_text(encoding="utf-8"))
+    assert plan["shards"] == 4
+    assert "https://src.example.com/shared.png" in plan["urls"][f"urls-{shard_of('https://src.example.com/shared.png', 4)}"]
+
+
+def test_crashed_workers_shard_is_taken_over(tmp_path, requests_mock):
+    vault = make_vault(tmp_path, requests_mock, notes=2)
+    uploads = []
+    worker = make_worker(tmp_path, vault, "survivor", uploads, lease_ttl=0.2)
+    # 另一个进程领取了 urls-0 后崩溃，租约没有释放
+    LeaseStore(str(tmp_path / "shards" / "leases"), "crashed", ttl=0.1).acquire("urls-0")
+
+    worker.run()
+
+    assert len(uploads) == 2 * 3 + 1
+    for path in vault.rglob("*.md"):
+        assert "src.example.com" not in path.read_text(encoding="utf-8")
+
+
+def test_takeover_skips_urls_uploaded_by_crashed_worker(tmp_path, requests_mock):
+    vault = make_vault(tmp_path, requests_mock, notes=2)
+    shards = tmp_path / "shards"
+    shards.mkdir()
+    urls = [f"https://src.example.com/{n}-{i}.png" for n in range(2) for i in range(3)]
+    finished = [url for url in urls if shard_of(url, 4) == 0]
+    assert finished
+    # 崩溃的进程在 urls-0 中已上传了这些URL，最后一行只写了一半
+    lines = [json.dumps({"url": url, "save_path": "", "new_url": url.replace("src", "old-cdn"),
+                         "error": "", "note": "", "backend": "fake"}) for url in finished]
+    (shards / "urls-0.progress-crashed.jsonl").write_text("\n".join(lines) + '\n{"url": "ht',
+                                                          encoding="utf-8")
+    LeaseStore(str(shards / "leases"), "crashed", ttl=0.1).acquire("urls-0")
+    uploads = []
+
+    make_worker(tmp_path, vault, "survivor", uploads, lease_ttl=0.2).run()
+
+    requested = {request.url for request in requests_mock.request_history}
+    assert not requested & set(finished)
+    assert len(uploads) == 2 * 3 + 1 - len(finished)
+    text = "".join(path.read_text(encoding="utf-8") for path in vault.rglob("*.md"))
+    assert "src.example.com" not in text
+    assert all(url.replace("src", "old-cdn") in text for url in finished)
+    assert not list(shards.glob("*.progress-*.jsonl"))
+
+
+def test_abandoned_file_shard_is_not_reported(tmp_path, requests_mock):
+    vault = make_vault(tmp_path, requests_mock, notes=6)
+    shards = tmp_path / "shards"
+    worker = make_worker(tmp_path, vault, "paused", [])
+    thief = LeaseStore(str(shards / "leases"), "thief", ttl=10)
+    rewrite = worker._rewrite_files
+    stolen = []
+
+    def paused(files, tasks):
+        shard_results = rewrite(files, tasks)
+        if not stolen and files:
+            plan = json.loads((shards / "plan.json").read_text(encoding="utf-8"))
+            name = next(name for name, shard in plan["files"].items() if shard == files)
+            # 本进程停顿期间租约被其他进程接管，由它完成并汇报这个分片
+            (shards / "leases" / f"{name}.lease").unlink()
+            thief.acquire(name)
+            (shards / f"{name}.json").write_text("{}", encoding="utf-8")
+            stolen.extend(str(vault / relative) for relative in files)
+        return shard_results
+
+    worker._rewrite_files = paused
+    results = worker.run()
+
+    assert stolen
+    assert results
+    assert not set(stolen) & set(results)
+
+
+def test_result_is_not_saved_after_lease_is_lost(tmp_path, requests_mock):
+    vault = make_vault(tmp_path, requests_mock, notes=2)
+    worker = make_worker(tmp_path, vault, "paused", [])
+    leases = tmp_path / "shards" / "leases"
+    thief = LeaseStore(str(leases), "thief", ttl=0.1)
+    migrate = worker._migrate_urls
+    calls = []
+
+    def paused(name, urls):
+        data = migrate(name, urls)
+        calls.append(tuple(urls))
+        if len(calls) == 1:
+            # 本进程停顿期间租约过期，被其他进程接管后又崩溃
+            (leases / "urls-0.lease").unlink()
+            thief.acquire("urls-0")
+        return data
+
+    saved = []
+    save = worker._save
+
+    def record_save(name, data):
+        saved.append(name)
+        save(name, data)
+
+    worker._migrate_urls = paused
+    worker._save = record_save
+    worker.run()
+
+    # 第一次处理的结果没有写入，租约再次过期后重新处理 urls-0
+    assert calls[0] == calls[-1]
+    assert saved.count("urls-0") == 1
+    for path in vault.rglob("*.md"):
+        assert "src.example.com" not in path.read_text(encoding="utf-8")
+
+
+def test_share_quota_divides_rate_limits():
+    uploader = FakeUploader()
+    uploader.rate_limits = (RateLimit(15, 60), RateLimit(100, 3600))
+
+    uploader.share_quota(4)
+
+    assert uploader.rate_limits == (RateLimit(3, 60), RateLimit(25, 3600))
+    assert uploader.rate_limiter.limits == uploader.rate_limits
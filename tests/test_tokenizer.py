@@ -0,0 +1,104 @@
+from markdown.tokenizer import find_image_refs, iter_image_refs
+
+
+def urls(content):
+    return [ref.url for ref in find_image_refs(content)]
+
+
+def test_offsets_point_at_urls():
+    content = (
+        '![a](https://e.com/1.png "title")\n'
+        '![b](<https://e.com/with space.png>)\n'
+        '<img alt="x" src=\'https://e.com/3.png\'>\n'
+        '![c][logo]\n\n'
+        '[logo]: https://e.com/logo.png "Logo"\n'
+    )
+
+    refs = find_image_refs(content)
+
+    assert [ref.url for ref in refs] == [
+        "https://e.com/1.png",
+        "https://e.com/with space.png",
+        "https://e.com/3.png",
+        "https://e.com/logo.png",
+    ]
+    assert [ref.kind for ref in refs] == ["inline", "inline", "html", "reference"]
+    for ref in refs:
+        assert content[ref.start:ref.end] == ref.url
+
+
+def test_skips_code():
+    content = (
+        "```markdown\n"
+        "![in fence](https://e.com/fence.png)\n"
+        "````\n"
+        "~~~\n"
+        "<img src=\"https://e.com/tilde.png\">\n"
+        "~~~\n"
+        "Use `![inline code](https://e.com/code.png)` like this.\n"
+        "![real](https://e.com/real.png)\n"
+    )
+
+    assert urls(content) == ["https://e.com/real.png"]
+
+
+def test_reference_forms():
+    content = (
+        "![Logo][]\n"
+        "![shortcut]\n"
+        "![x][Missing]\n"
+        "![dup][logo]\n"
+        "[LOGO]: <https://e.com/logo.png>\n"
+        "[shortcut]: https://e.com/short.png 'title'\n"
+        "[unused]: https://e.com/unused.png\n"
+    )
+
+    assert urls(content) == ["https://e.com/logo.png", "https://e.com/short.png"]
+
+
+def test_balanced_parentheses_and_nested_alt():
+    content = "![a [nested] alt](https://e.com/img_(1).png)"
+
+    assert urls(content) == ["https://e.com/img_(1).png"]
+
+
+def test_links_are_not_images():
+    assert urls("[not image](https://e.com/page.html) and ![]()") == []
+
+
+def test_streams_inline_refs_before_definitions():
+    refs = iter_image_refs("![a][r]\n![b](https://e.com/b.png)\n[r]: https://e.com/r.png\n")
+
+    assert next(refs).url == "https://e.com/b.png"
+    assert next(refs).url == "https://e.com/r.png"
+
+
+def test_unclosed_syntax_stays_linear():
+    import time
+
+    content = "![a](b " * 20000 + "\n"
+    start = time.perf_counter()
+    find_image_refs(content)
+    # 原先的惰性正则在该输入上需要数分钟
+    assert time.perf_counter() - start < 2
+
+
+def test_stray_img_in_prose_does_not_hide_later_images():
+    content = "Write <img in HTML.\n\n![a](http://x/a.png)\n\nthen 3 > 2"
+    assert urls(content) == ["http://x/a.png"]
+
+    content = "an <img without src ![b](http://x/b.png) then >\n"
+    assert urls(content) == ["http://x/b.png"]
+
+
+def test_multiline_img_tag():
+    assert urls('<img\n  alt="x"\n  src="http://x/c.png">') == ["http://x/c.png"]
+
+
+def test_repeated_unclosed_img_stays_linear():
+    import time
+
+    content = "<img " * 8000
+    start = time.perf_counter()
+    find_image_refs(content)
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,420 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from storage.base_uploader import BaseUploader, UploadItem
+from storage.uploaders.sms_uploader import SMSUploader
+from qcloud_cos import CosServiceError
+
+from storage.uploaders.tencent_cos import TencentCOSUploader
+from utils.rate_limiter import RateLimit
+
+
+class SlowUploader(BaseUploader):
+    """记录最大并发数的假上传器"""
+    name = "slow"
+
+    def __init__(self, delay=0.01, fail=()):
+        self.delay = delay
+        self.fail = set(fail)
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def upload_file(self, file_path, remote_path):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if remote_path in self.fail:
+            raise Exception("boom")
+        return f"https://cdn.example.com/{remote_path}"
+
+
+def make_items(tmp_path, count):
+    items = []
+    for i in range(count):
+        path = tmp_path / f"{i}.png"
+        path.write_bytes(b"data")
+        items.append(UploadItem(str(path), f"{i}.png"))
+    return items
+
+
+def test_upload_many_streams_results_with_bounded_pool(tmp_path):
+    uploader = SlowUploader(fail={"3.png"})
+
+    results = list(uploader.upload_many(make_items(tmp_path, 20), max_workers=3))
+
+    assert len(results) == 20
+    assert uploader.peak <= 3
+    failed = [result for result in results if not result.ok]
+    assert [result.item.remote_path for result in failed] == ["3.png"]
+    assert failed[0].error == "boom"
+    assert all(result.backend == "slow" for result in results)
+
+
+def test_upload_many_respects_rate_limit(tmp_path):
+    uploader = SlowUploader(delay=0)
+    uploader.rate_limits = (RateLimit(2, 0.2),)
+
+    start = time.monotonic()
+    results = list(uploader.upload_many(make_items(tmp_path, 4), max_workers=4))
+
+    assert len(results) == 4
+    assert time.monotonic() - start >= 0.2
+
+
+def test_upload_many_async(tmp_path):
+    uploader = SlowUploader()
+
+    async def collect():
+        return [result async for result in uploader.upload_many_async(make_items(tmp_path, 6), max_workers=2)]
+
+    results = asyncio.run(collect())
+
+    assert sorted(result.url for result in results) == sorted(
+        f"https://cdn.example.com/{i}.png" for i in range(6)
+    )
+    assert uploader.peak <= 2
+
+
+def test_sms_repeated_image_returns_existing_url(tmp_path, requests_mock):
+    image = tmp_path / "a.png"
+    image.write_bytes(b"png")
+    requests_mock.post("https://smms.app/api/v2/upload", json={
+        "success": False,
+        "code": "image_repeated",
+        "message": "Image upload repeated limit, this image exists at: https://s2.loli.net/a.png",
+        "images": "https://s2.loli.net/a.png",
+    })
+    uploader = SMSUploader(api_token="token")
+
+    result = uploader.upload_item(UploadItem(str(image), "images/a.png"))
+
+    assert result.ok
+    assert result.url == "https://s2.loli.net/a.png"
+    assert result.note == "使用已存在的图片URL"
+
+
+def test_sms_uploads_stream_without_local_file(requests_mock):
+    requests_mock.post("https://smms.app/api/v2/upload", json={
+        "success": True, "data": {"url": "https://s2.loli.net/a.png"},
+    })
+    uploader = SMSUploader(api_token="token")
+    stream = io.BytesIO(b"png-bytes")
+    stream.seek(4)
+
+    result = uploader.upload_item(UploadItem("", "images/a.png", stream=stream))
+
+    assert result.ok
+    body = requests_mock.last_request.body
+    assert b'filename="a.png"' in body
+    # 从流的开头读取
+    assert b"png-bytes" in body
+
+
+def test_default_upload_stream_spools_to_file():
+    class FileOnlyUploader(BaseUploader):
+        name = "file-only"
+
+        def __init__(self):
+            self.received = []
+
+        def upload_file(self, file_path, remote_path):
+            with open(file_path, "rb") as f:
+                self.received.append(f.read())
+            return f"https://cdn.example.com/{remote_path}"
+
+    uploader = FileOnlyUploader()
+
+    result = uploader.upload_item(UploadItem("", "a.png", stream=io.BytesIO(b"data")))
+
+    assert result.ok
+    assert uploader.received == [b"data"]
+
+
+def test_sms_missing_file_refunds_quota():
+    uploader = SMSUploader(api_token="token")
+
+    result = uploader.upload_item(UploadItem("/nonexistent/a.png", "a.png"))
+
+    assert not result.ok
+    assert uploader.rate_limiter.time_until_available() == 0
+    assert len(uploader.rate_limiter._history) == 0
+
+
+def test_network_error_keeps_quota(tmp_path, requests_mock):
+    image = tmp_path / "a.png"
+    image.write_bytes(b"data")
+    requests_mock.post("https://smms.app/api/v2/upload", exc=requests.exceptions.ConnectionError)
+    uploader = SMSUploader(api_token="token")
+
+    result = uploader.upload_item(UploadItem(str(image), "a.png"))
+
+    # 连接失败时请求可能已被服务端计数，配额不退还
+    assert not result.ok
+    assert len(uploader.rate_limiter._history) == 1
+
+
+@pytest.fixture
+def cos_uploader():
+    uploader = TencentCOSUploader("id", "key", "ap-shanghai", "bucket-123")
+    uploader.client = MagicMock()
+    return uploader
+
+
+def test_cos_batch_upload_is_concurrent(cos_uploader, tmp_path):
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def fake_upload(**kwargs):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.pop()
+
+    cos_uploader.client.upload_file.side_effect = fake_upload
+    files = []
+    for i in range(8):
+        path = tmp_path / f"{i}.txt"
+        path.write_text(str(i))
+        files.append(path)
+
+    results = cos_uploader.batch_upload(files, base_dir=tmp_path)
+
+    assert sorted(results['success']) == sorted(files)
+    assert results['failed'] == []
+    assert max(peak) > 1
+
+
+def test_cos_upload_file_accepts_str_path(cos_uploader, tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"png")
+
+    assert cos_uploader.upload_file(str(path), "images/a.png")
+    cos_uploader.client.upload_file.assert_called_once_with(
+        Bucket="bucket-123", LocalFilePath=str(path), Key="images/a.png")
+
+
+def test_cos_upload_item_returns_url(cos_uploader, tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"png")
+    result = cos_uploader.upload_item(UploadItem(str(path), "images/a.png"))
+
+    assert result.url == "https://bucket-123.cos.ap-shanghai.myqcloud.com/images/a.png"
+    cos_uploader.custom_url = "https://img.example.com"
+    assert cos_uploader.get_url("images/a.png") == "https://img.example.com/images/a.png"
+
+
+def test_cos_build_index_paginates(cos_uploader, tmp_path):
+    pages = [
+        {'Contents': [{'Key': 'images/a.png', 'Size': '3', 'ETag': '"e1"'}],
+         'IsTruncated': 'true', 'NextMarker': 'images/a.png'},
+        {'Contents': [{'Key': 'images/b.png', 'Size': '5', 'ETag': '"e2"'}],
+         'IsTruncated': 'false'},
+    ]
+    cos_uploader.client.list_objects.side_effect = pages
+    index_path = tmp_path / "index.json"
+
+    index = cos_uploader.build_index(prefix="images/", index_path=index_path)
+
+    assert set(index) == {'images/a.png', 'images/b.png'}
+    assert index['images/b.png'].size == 5
+    assert index['images/a.png'].etag == "e1"
+    markers = [call.kwargs['Marker'] for call in cos_uploader.client.list_objects.call_args_list]
+    assert markers == ["", "images/a.png"]
+    assert cos_uploader.file_exists('images/a.png')
+    assert not cos_uploader.file_exists('images/c.png')
+    cos_uploader.client.head_object.assert_not_called()
+
+    restored = TencentCOSUploader("id", "key", "ap-shanghai", "bucket-123")
+    restored.client = MagicMock()
+    assert restored.load_index(index_path)
+    assert restored.file_exists('images/b.png')
+    restored.client.head_object.assert_not_called()
+
+
+def test_cos_batch_upload_skips_existing(cos_uploader, tmp_path):
+    same = tmp_path / "same.png"
+    same.write_bytes(b"abc")
+    changed = tmp_path / "changed.png"
+    changed.write_bytes(b"abcdef")
+    new = tmp_path / "new.png"
+    new.write_bytes(b"x")
+    cos_uploader.client.list_objects.return_value = {
+        'Contents': [
+            {'Key': 'same.png', 'Size': '3', 'ETag': '"e1"'},
+            {'Key': 'changed.png', 'Size': '4', 'ETag': '"e2"'},
+        ],
+        'IsTruncated': 'false',
+    }
+
+    results = cos_uploader.batch_upload([same, changed, new], base_dir=tmp_path, skip_existing=True)
+
+    assert results['skipped'] == [same]
+    assert sorted(results['success']) == sorted([changed, new])
+    uploaded = {call.kwargs['Key'] for call in cos_uploader.client.upload_file.call_args_list}
+    assert uploaded == {'changed.png', 'new.png'}
+    assert cos_uploader.file_exists('new.png')
+
+
+def test_cos_prefix_applies_to_uploads_and_index(tmp_path):
+    uploader = TencentCOSUploader("id", "key", "ap-shanghai", "bucket-123", prefix="/notes/")
+    uploader.client = MagicMock()
+    same = tmp_path / "same.png"
+    same.write_bytes(b"abc")
+    new = tmp_path / "new.png"
+    new.write_bytes(b"x")
+    uploader.client.list_objects.return_value = {
+        'Contents': [{'Key': 'notes/same.png', 'Size': '3', 'ETag': '"e1"'}],
+        'IsTruncated': 'false',
+    }
+
+    results = uploader.batch_upload([same, new], base_dir=tmp_path, skip_existing=True)
+
+    assert results['skipped'] == [same]
+    assert results['success'] == [new]
+    assert uploader.client.list_objects.call_args.kwargs['Prefix'] == "notes/"
+    uploaded = [call.kwargs['Key'] for call in uploader.client.upload_file.call_args_list]
+    assert uploaded == ['notes/new.png']
+    assert uploader.file_exists('notes/new.png')
+
+    result = uploader.upload_item(UploadItem(str(new), "images/new.png"))
+    assert result.url == "https://bucket-123.cos.ap-shanghai.myqcloud.com/notes/images/new.png"
+    assert uploader.file_exists('notes/images/new.png')
+    uploader.client.head_object.assert_not_called()
+
+
+class FakeCOSClient:
+    """在内存中模拟 COS 分块上传接口的客户端"""
+
+    def __init__(self, fail_parts=()):
+        self.objects = {}
+        self.uploads = {}
+        self.fail_parts = set(fail_parts)
+        self.uploaded_parts = []
+        self.lock = threading.Lock()
+
+    def upload_file(self, Bucket, LocalFilePath, Key, **kwargs):
+        with open(LocalFilePath, 'rb') as f:
+            self.objects[Key] = f.read()
+
+    def put_object(self, Bucket, Body, Key, **kwargs):
+        self.objects[Key] = Body.read()
+
+    def create_multipart_upload(self, Bucket, Key):
+        with self.lock:
+            upload_id = f"upload-{len(self.uploads) + 1}"
+            self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, Body, PartNumber, UploadId):
+        if PartNumber in self.fail_parts:
+            raise ConnectionError(f"part {PartNumber} failed")
+        with self.lock:
+            self.uploads[UploadId][PartNumber] = Body
+            self.uploaded_parts.append(PartNumber)
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    def list_parts(self, Bucket, Key, UploadId, PartNumberMarker=0):
+        if UploadId not in self.uploads:
+            raise CosServiceError('GET', 'NoSuchUpload', 404)
+        numbers = sorted(n for n in self.uploads[UploadId] if n > PartNumberMarker)
+        page = numbers[:2]
+        return {
+            'Part': [{'PartNumber': str(n), 'ETag': f'"etag-{n}"'} for n in page],
+            'IsTruncated': 'true' if len(numbers) > 2 else 'false',
+            'NextPartNumberMarker': str(page[-1]) if page else '0',
+        }
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Part']]
+        assert numbers == sorted(parts)
+        self.objects[Key] = b"".join(parts[n] for n in numbers)
+
+
+def make_multipart_uploader(client, state_path):
+    uploader = TencentCOSUploader("id", "key", "ap-shanghai", "bucket-123",
+                                  part_size=4, part_threads=3,
+                                  multipart_state_path=state_path)
+    uploader.client = client
+    return uploader
+
+
+def test_cos_multipart_upload_resumes_after_interruption(tmp_path):
+    data = bytes(range(26))  # 7 个分块，最后一块 2 字节
+    path = tmp_path / "big.bin"
+    path.write_bytes(data)
+    state_path = tmp_path / "multipart.json"
+    client = FakeCOSClient(fail_parts={5})
+
+    first = make_multipart_uploader(client, state_path)
+    result = first.upload_item(UploadItem(str(path), "big.bin"))
+
+    assert not result.ok
+    assert "big.bin" not in client.objects
+    assert "big.bin" in json.loads(state_path.read_text())
+    uploaded_before = set(client.uploaded_parts)
+    assert 5 not in uploaded_before
+
+    client.fail_parts.clear()
+    client.uploaded_parts.clear()
+    second = make_multipart_uploader(client, state_path)
+    result = second.upload_item(UploadItem(str(path), "big.bin"))
+
+    assert result.ok
+    assert client.objects["big.bin"] == data
+    assert set(client.uploaded_parts) == set(range(1, 8)) - uploaded_before
+    assert json.loads(state_path.read_text()) == {}
+
+
+def test_cos_multipart_restarts_when_upload_expired(tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(b"x" * 10)
+    state_path = tmp_path / "multipart.json"
+    client = FakeCOSClient(fail_parts={3})
+    make_multipart_uploader(client, state_path).upload_item(UploadItem(str(path), "big.bin"))
+    client.uploads.clear()
+    client.fail_parts.clear()
+
+    result = make_multipart_uploader(client, state_path).upload_item(UploadItem(str(path), "big.bin"))
+
+    assert result.ok
+    assert client.objects["big.bin"] == b"x" * 10
+
+
+def test_cos_small_files_skip_multipart(tmp_path):
+    path = tmp_path / "small.bin"
+    path.write_bytes(b"abc")
+    client = FakeCOSClient()
+
+    make_multipart_uploader(client, None).upload_item(UploadItem(str(path), "small.bin"))
+
+    assert client.objects["small.bin"] == b"abc"
+    assert client.uploaded_parts == []
+
+
+def test_cos_uploads_stream_with_single_put(tmp_path):
+    client = FakeCOSClient()
+    uploader = make_multipart_uploader(client, None)
+    uploader._index = {}
+
+    result = uploader.upload_item(UploadItem("", "images/a.png", stream=io.BytesIO(b"x" * 10)))
+
+    assert result.ok
+    assert result.url == "https://bucket-123.cos.ap-shanghai.myqcloud.com/images/a.png"
+    assert client.objects["images/a.png"] == b"x" * 10
+    assert client.uploaded_parts == []
+    assert uploader._index["images/a.png"].size == 10
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from markdown.image_downloader import MarkdownImageDownloader
+from markdown.watcher import MarkdownWatcher
+from storage.manifest import MigrationManifest
+from tests.helpers import PNG, FakeUploader
+
+
+def make_watcher(tmp_path, manifest, **kwargs):
+    downloader = MarkdownImageDownloader(str(tmp_path / "images"), FakeUploader(), manifest=manifest)
+    return MarkdownWatcher(downloader, str(tmp_path / "vault"), use_watchdog=False, **kwargs)
+
+
+def test_failed_urls_are_retried(tmp_path, requests_mock):
+    requests_mock.get("https://example.com/broken.png", status_code=500)
+    requests_mock.get("https://example.com/new.png", content=PNG + b"new-image")
+    vault = tmp_path / "vault"
+    vault.mkdir()
+    note = vault / "note.md"
+    note.write_text("![old](https://example.com/broken.png)\n", encoding='utf-8')
+
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        watcher = make_watcher(tmp_path, manifest)
+        watcher.scanner.scan(str(vault))
+
+        note.write_text("![old](https://example.com/broken.png)\n"
+                        "![new](https://example.com/new.png)\n", encoding='utf-8')
+        results = watcher.process([str(note)])
+
+        assert [item['url'] for item in results[str(note)]['success']] == ["https://example.com/new.png"]
+        assert [item['url'] for item in results[str(note)]['failed']] == ["https://example.com/broken.png"]
+        content = note.read_text(encoding='utf-8')
+        assert "https://example.com/broken.png" in content
+        assert "https://example.com/new.png" not in content
+
+        # 之前失败的URL在文件再次变化时重试，已迁移的URL不会重复下载
+        requests_mock.get("https://example.com/broken.png", content=PNG + b"fixed")
+        results = watcher.process([str(note)])
+        assert [item['url'] for item in results[str(note)]['success']] == ["https://example.com/broken.png"]
+        assert "example.com/" not in note.read_text(encoding='utf-8').replace("cdn.example.com/", "")
+        assert [r.url for r in requests_mock.request_history].count("https://example.com/new.png") == 1
+        assert watcher.process([str(note)]) == {}
+
+
+def test_pending_files_are_migrated_at_startup(tmp_path, requests_mock):
+    requests_mock.get("https://example.com/old.png", content=PNG + b"old-image")
+    vault = tmp_path / "vault"
+    vault.mkdir()
+    note = vault / "note.md"
+    note.write_text("![old](https://example.com/old.png)\n", encoding='utf-8')
+
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        done = threading.Event()
+        watcher = make_watcher(tmp_path, manifest, poll_interval=0.02,
+                               on_result=lambda results: done.set())
+        thread = threading.Thread(target=watcher.run, daemon=True)
+        thread.start()
+        try:
+            assert done.wait(5)
+        finally:
+            watcher.stop()
+            thread.join(5)
+
+        assert "https://cdn.example.com/" in note.read_text(encoding='utf-8')
+
+
+def test_changes_are_debounced(tmp_path):
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        watcher = make_watcher(tmp_path, manifest, debounce=5)
+        watcher.notify("a.md")
+        watcher.notify("image.png")
+        start = time.monotonic()
+        watcher.notify("a.md")
+
+        assert watcher.take_due(start + 1) == []
+        assert watcher.take_due(start + 6) == ["a.md"]
+        assert watcher.take_due(start + 12) == []
+
+
+def test_polling_watch_migrates_saved_note(tmp_path, requests_mock):
+    requests_mock.get("https://example.com/shot.png", content=PNG + b"screenshot")
+    vault = tmp_path / "vault"
+    vault.mkdir()
+    note = vault / "note.md"
+    note.write_text("draft\n", encoding='utf-8')
+
+    with MigrationManifest(str(tmp_path / "manifest.db")) as manifest:
+        done = threading.Event()
+        watcher = make_watcher(tmp_path, manifest, debounce=0.05, poll_interval=0.02,
+                               on_result=lambda results: done.set())
+        thread = threading.Thread(target=watcher.run, daemon=True)
+        thread.start()
+        try:
+            time.sleep(0.1)
+            note.write_text("draft\n![shot](https://example.com/shot.png)\n", encoding='utf-8')
+            assert done.wait(5)
+        finally:
+            watcher.stop()
+            thread.join(5)
+
+        assert "https://cdn.example.com/" in note.read_text(encoding='utf-8')
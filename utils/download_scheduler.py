@@ -0,0 +1,276 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+from urllib.parse import urlparse
+
+import requests
+
+from utils.metrics import metrics
+
+T = TypeVar("T")
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class RetryableStatusError(Exception):
+    """服务端返回了可重试的状态码（429/5xx）"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class HostUnavailableError(Exception):
+    """主机处于熔断状态，跳过请求"""
+
+
+class BudgetExceededError(Exception):
+    """单张图片的总耗时超出预算"""
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    解析 Retry-After 响应头
+
+    Args:
+        value: 响应头的值，秒数或 HTTP 日期
+        now: 当前的 Unix 时间戳，便于测试
+
+    Returns:
+        Optional[float]: 需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        target = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, target - (time.time() if now is None else now))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """下载重试策略"""
+    # 单张图片最多尝试的次数（包含第一次）
+    max_attempts: int = 4
+    # 指数退避的基础间隔与上限（秒），实际等待在 [0, 上限] 内随机（full jitter）
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    # 需要重试的状态码
+    retry_statuses: Tuple[int, ...] = (429, 500, 502, 503, 504)
+
+    def backoff(self, attempt: int, rng: random.Random) -> float:
+        """第 attempt 次失败（从 1 开始）后的等待秒数"""
+        return rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器
+
+    连续失败达到阈值后打开，打开期间直接拒绝请求；经过 reset_timeout 秒后
+    进入半开状态，只放行一个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            failure_threshold: 打开熔断器所需的连续失败次数
+            reset_timeout: 打开后多久允许试探请求（秒）
+            clock: 时间函数，便于测试时替换
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """是否允许发出请求"""
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self.state = STATE_HALF_OPEN
+                self._probing = False
+            if self.state == STATE_HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """
+        记录一次失败
+
+        Returns:
+            bool: 本次失败是否使熔断器打开
+        """
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == STATE_HALF_OPEN or (
+                    self.state == STATE_CLOSED and self.failures >= self.failure_threshold):
+                self.state = STATE_OPEN
+                self._opened_at = self._clock()
+                return True
+            return False
+
+
+class DownloadScheduler:
+    """
+    源图片下载调度器
+
+    - 每个主机的并发连接数上限，避免压垮单个图源
+    - 每张图片的总耗时预算，包含重试与退避等待
+    - 429/5xx、连接错误和超时按带抖动的指数退避重试，优先遵循 Retry-After
+    - 每个主机一个熔断器，失效的主机会被快速跳过，而不是每张图片都等到超时
+    """
+
+    def __init__(self, max_per_host: int = 4, time_budget: float = 120.0,
+                 request_timeout: float = 30.0, retry: RetryPolicy = RetryPolicy(),
+                 failure_threshold: int = 5, reset_timeout: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep, seed: Optional[int] = None):
+        """
+        Args:
+            max_per_host: 每个主机同时进行的请求数
+            time_budget: 单张图片的总耗时预算（秒）
+            request_timeout: 单次请求的连接/读取超时（秒），不超过剩余预算
+            retry: 重试策略
+            failure_threshold: 熔断器打开所需的连续失败次数
+            reset_timeout: 熔断器打开后多久允许试探请求（秒）
+            clock: 时间函数，便于测试时替换
+            sleep: 等待函数，便于测试时替换
+            seed: 退避抖动的随机种子
+        """
+        self.max_per_host = max_per_host
+        self.time_budget = time_budget
+        self.request_timeout = request_timeout
+        self.retry = retry
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._sleep = sleep
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def _host_state(self, host: str) -> Tuple[threading.BoundedSemaphore, CircuitBreaker]:
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+                self._breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.clock
+                )
+            return self._slots[host], self._breakers[host]
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """URL所在主机的熔断器"""
+        return self._host_state(urlparse(url).netloc)[1]
+
+    def check_status(self, response: requests.Response):
+        """
+        检查响应状态码
+
+        Raises:
+            RetryableStatusError: 状态码需要重试
+            requests.HTTPError: 其他错误状态码
+        """
+        if response.status_code in self.retry.retry_statuses:
+            raise RetryableStatusError(
+                response.status_code, parse_retry_after(response.headers.get("Retry-After"))
+            )
+        response.raise_for_status()
+
+    def run(self, url: str, attempt: Callable[[float, float], T]) -> T:
+        """
+        在调度约束下执行一次下载
+
+        Args:
+            url: 图片URL，用于确定主机
+            attempt: 执行单次请求的函数，参数为 (请求超时秒数, 截止时间)，
+                截止时间使用调度器的时钟；遇到 429/5xx 时应抛出 RetryableStatusError
+                （可调用 check_status）
+
+        Returns:
+            attempt 的返回值
+
+        Raises:
+            HostUnavailableError: 主机处于熔断状态
+            BudgetExceededError: 重试等待会超出总耗时预算
+            Exception: 不可重试的错误或最后一次尝试的错误
+        """
+        host = urlparse(url).netloc
+        slots, breaker = self._host_state(host)
+        deadline = self.clock() + self.time_budget
+        attempt_number = 0
+        while True:
+            attempt_number += 1
+            if not breaker.allow():
+                metrics.counter("download_circuit_rejected_total", "因熔断而跳过的下载数",
+                                host=host).inc()
+                raise HostUnavailableError(f"主机 {host} 连续失败，暂时跳过")
+
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                raise BudgetExceededError(f"下载超出 {self.time_budget:g} 秒的总耗时预算")
+            try:
+                # 只在请求期间占用主机的并发名额，退避等待时释放
+                with slots:
+                    result = attempt(min(self.request_timeout, remaining), deadline)
+            except Exception as e:
+                retry_after = None
+                if isinstance(e, RetryableStatusError):
+                    retry_after = e.retry_after
+                    # 429 说明主机仍然可用，只是需要放慢速度
+                    if e.status != 429:
+                        self._record_failure(breaker, host)
+                    else:
+                        breaker.record_success()
+                elif isinstance(e, (requests.ConnectionError, requests.Timeout, BudgetExceededError)):
+                    self._record_failure(breaker, host)
+                else:
+                    # 4xx、图片过大等错误与主机是否可用无关，也不值得重试
+                    breaker.record_success()
+                    raise
+                if isinstance(e, BudgetExceededError) or attempt_number >= self.retry.max_attempts:
+                    raise
+
+                delay = retry_after if retry_after is not None else self.retry.backoff(
+                    attempt_number, self._rng
+                )
+                if self.clock() + delay >= deadline:
+                    raise BudgetExceededError(
+                        f"重试需要等待 {delay:.1f} 秒，超出总耗时预算: {e}"
+                    ) from e
+                metrics.counter("download_retries_total", "下载重试次数", host=host).inc()
+                self._sleep(delay)
+                continue
+
+            breaker.record_success()
+            return result
+
+    def _record_failure(self, breaker: CircuitBreaker, host: str):
+        if breaker.record_failure():
+            metrics.counter("download_circuit_open_total", "熔断器打开的次数", host=host).inc()
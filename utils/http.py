@@ -0,0 +1,52 @@
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool:
+    """
+    按主机复用的 requests.Session 池
+
+    同一主机的请求共用一个 Session 及其 keep-alive 连接池，
+    下载器和上传器共享同一个实例即可避免重复建立 TCP/TLS 连接。
+    """
+
+    def __init__(self, pool_maxsize: int = 16, headers: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            pool_maxsize: 每个主机保持的最大连接数，应不小于访问该主机的线程数
+            headers: 所有 Session 的默认请求头
+        """
+        self.pool_maxsize = pool_maxsize
+        self.headers = headers or {}
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> requests.Session:
+        """获取URL所在主机的 Session"""
+        parsed = urlparse(url)
+        key = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[key] = session
+            return session
+
+    def close(self):
+        """关闭所有 Session 及其连接"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# 默认的全局连接池，下载器和上传器未指定时共用
+default_session_pool = SessionPool()
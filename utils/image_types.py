@@ -0,0 +1,121 @@
+from typing import Optional
+
+# 文件头魔数 -> 扩展名
+_MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+    (b"\x00\x00\x01\x00", ".ico"),
+)
+
+# 扩展名 -> 魔数很短、文本开头也可能碰巧匹配的格式（如以 "BM" 开头的文本）
+_WEAK_MAGICS = (".bmp", ".ico")
+
+# 判断文件类型最少需要的字节数；SVG 的 <svg 可能出现在 XML 声明、注释和 DOCTYPE 之后
+SNIFF_BYTES = 512
+
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    """
+    根据文件头判断图片类型
+
+    Args:
+        head: 文件开头的若干字节，至少 SNIFF_BYTES 字节
+
+    Returns:
+        Optional[str]: 扩展名（包含点号），无法识别时返回 None
+    """
+    for magic, ext in _MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return ".avif"
+    stripped = head.lstrip()
+    if stripped.startswith(b"<svg"):
+        return ".svg"
+    # 以 XML 声明开头的也可能是 S3/COS 的 <Error> 等错误响应，出现 <svg 才是图片
+    if stripped.startswith((b"<?xml", b"<!--", b"<!DOCTYPE svg")) and b"<svg" in stripped:
+        return ".svg"
+    return None
+
+
+# 常见的非图片响应（错误页、接口返回的 JSON 等）的开头
+_TEXT_PREFIXES = (b"<!doctype", b"<html", b"<head", b"<body", b"<title", b"{", b"[")
+
+
+def looks_like_text(head: bytes) -> bool:
+    """
+    判断文件头是否像 HTML、JSON 等文本内容
+
+    Args:
+        head: 文件开头的若干字节
+
+    Returns:
+        bool: 以常见的文本开头，或全部为可打印的 UTF-8 文本时返回 True
+    """
+    stripped = head.lstrip().lower()
+    if stripped.startswith(_TEXT_PREFIXES):
+        return True
+    try:
+        text = head.decode("utf-8")
+    except UnicodeDecodeError:
+        # 截断在多字节字符中间时忽略最后几个字节再判断
+        try:
+            text = head[:-3].decode("utf-8")
+        except UnicodeDecodeError:
+            return False
+    return bool(text) and all(char.isprintable() or char in "\r\n\t" for char in text)
+
+
+def check_image_header(head: bytes, content_type: str = "") -> Optional[str]:
+    """
+    根据文件头快速检查响应是否为图片，不解码图片内容
+
+    Args:
+        head: 文件开头的若干字节，至少 SNIFF_BYTES 字节（文件更短时为全部内容）
+        content_type: 响应的 Content-Type
+
+    Returns:
+        Optional[str]: 不是图片时返回原因，否则返回 None
+    """
+    if not head:
+        return "响应内容为空"
+    media_type = content_type.split(";")[0].strip().lower()
+    # 源站明确声明为文本、XML 或 JSON（image/svg+xml 除外）
+    declared_text = not media_type.startswith("image/") and (
+        media_type.startswith("text/") or media_type.endswith(("json", "xml")))
+    ext = sniff_extension(head)
+    if ext == ".png" and len(head) >= 16 and head[12:16] != b"IHDR":
+        return "PNG 文件头损坏"
+    if ext and not (declared_text and ext in _WEAK_MAGICS):
+        return None
+    if declared_text or looks_like_text(head):
+        return f"响应内容不是图片（{media_type or '疑似文本'}）"
+    if media_type.startswith("image/"):
+        # 魔数表未覆盖、但源站声明为图片的格式（如 TIFF、HEIC）
+        return None
+    return "无法识别的图片格式"
+
+
+def extension_from_content_type(content_type: str) -> Optional[str]:
+    """根据Content-Type获取文件扩展名，无法识别时返回 None"""
+    content_type = content_type.lower()
+    if 'jpeg' in content_type or 'jpg' in content_type:
+        return '.jpg'
+    elif 'png' in content_type:
+        return '.png'
+    elif 'gif' in content_type:
+        return '.gif'
+    elif 'webp' in content_type:
+        return '.webp'
+    elif 'svg' in content_type:
+        return '.svg'
+    elif 'avif' in content_type:
+        return '.avif'
+    elif 'bmp' in content_type:
+        return '.bmp'
+    return None
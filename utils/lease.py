@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from utils.metrics import metrics
+
+
+@dataclass
+class Lease:
+    """某个任务在一段时间内的独占权"""
+    name: str
+    owner: str
+    # 每次获取生成的随机令牌，用于确认租约仍属于自己
+    token: str
+    # 过期时间（Unix 时间戳）
+    expires: float
+    # 心跳发现租约已被其他进程接管
+    lost: bool = False
+
+
+class LeaseStore:
+    """
+    基于共享目录的租约
+
+    每个租约是目录中的一个 JSON 文件。创建时先写入临时文件，再用 os.link 原子地创建目标文件：
+    目标已存在时 link 失败，只有一个进程能获得租约，且其他进程不会读到写了一半的文件；
+    这种方式在 NFS 上比 O_EXCL 更可靠。持有者通过心跳延长租约，进程崩溃后租约过期，
+    其他进程把过期的文件原子地改名移走后接管。
+
+    过期时间使用各主机的系统时钟，多台主机共享目录时需要同步时钟（NTP）。
+    """
+
+    def __init__(self, directory: str, owner: str, ttl: float = 60.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            directory: 租约目录，所有参与的进程共享
+            owner: 当前进程的唯一名称
+            ttl: 租约有效期（秒），心跳每隔 ttl / 3 续期一次
+            clock: 时钟函数，测试时可替换
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.owner = owner
+        self.ttl = ttl
+        self.clock = clock
+        self._held: Dict[str, Lease] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.lease"
+
+    def acquire(self, name: str) -> Optional[Lease]:
+        """
+        尝试获取租约，不等待
+
+        Args:
+            name: 租约名称
+
+        Returns:
+            Optional[Lease]: 获取成功时返回租约；有效租约被其他进程持有时返回 None
+        """
+        path = self._path(name)
+        lease = Lease(name, self.owner, uuid.uuid4().hex, self.clock() + self.ttl)
+        if not self._create(path, lease):
+            current = self._read(path)
+            if current is None or current.expires > self.clock():
+                return None
+            if not self._take_over(path, current, lease.token):
+                return None
+            metrics.counter("lease_takeovers_total", "接管过期租约的次数").inc()
+            lease.expires = self.clock() + self.ttl
+            if not self._create(path, lease):
+                return None
+        with self._lock:
+            self._held[name] = lease
+        return lease
+
+    def renew(self, lease: Lease) -> bool:
+        """
+        延长租约
+
+        Returns:
+            bool: 租约仍属于自己并已续期时返回 True
+        """
+        path = self._path(lease.name)
+        current = self._read(path)
+        if current is None or current.token != lease.token:
+            lease.lost = True
+            return False
+        lease.expires = self.clock() + self.ttl
+        tmp_path = path.with_name(f"{path.name}.{lease.token}.tmp")
+        tmp_path.write_text(self._dump(lease), encoding="utf-8")
+        os.replace(tmp_path, path)
+        return True
+
+    def release(self, lease: Lease):
+        """释放租约；租约已被其他进程接管时不做任何事"""
+        with self._lock:
+            self._held.pop(lease.name, None)
+        path = self._path(lease.name)
+        current = self._read(path)
+        if current is not None and current.token == lease.token:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def start(self) -> "LeaseStore":
+        """启动心跳线程，定期为持有的全部租约续期"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """停止心跳线程，不释放租约"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 3):
+            with self._lock:
+                held = list(self._held.values())
+            for lease in held:
+                if not self.renew(lease):
+                    metrics.counter("lease_lost_total", "被其他进程接管的租约数").inc()
+                    with self._lock:
+                        self._held.pop(lease.name, None)
+
+    def _create(self, path: Path, lease: Lease) -> bool:
+        tmp_path = path.with_name(f"{path.name}.{lease.token}.tmp")
+        tmp_path.write_text(self._dump(lease), encoding="utf-8")
+        try:
+            os.link(tmp_path, path)
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            tmp_path.unlink()
+
+    def _take_over(self, path: Path, stale: Lease, token: str) -> bool:
+        """把过期的租约文件改名移走；多个进程同时接管时只有一个能成功"""
+        moved = path.with_name(f"{path.name}.{token}.stale")
+        try:
+            os.rename(path, moved)
+        except FileNotFoundError:
+            return False
+        taken = self._read(moved)
+        if taken is None or taken.token != stale.token:
+            # 读取之后租约已被续期或接管，移走的是有效租约，放回原处
+            try:
+                os.link(moved, path)
+            except FileExistsError:
+                pass
+            moved.unlink()
+            return False
+        moved.unlink()
+        return True
+
+    @staticmethod
+    def _dump(lease: Lease) -> str:
+        return json.dumps({"owner": lease.owner, "token": lease.token, "expires": lease.expires})
+
+    @staticmethod
+    def _read(path: Path) -> Optional[Lease]:
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        return Lease(path.name[:-len(".lease")], data["owner"], data["token"], data["expires"])
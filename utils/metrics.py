@@ -0,0 +1,301 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """可以任意设置的瞬时值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+class Histogram:
+    """
+    分桶直方图
+
+    只保存每个桶的计数、总和与最大值，内存占用与观测次数无关；
+    分位数由桶的上界近似得到。
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """
+        近似分位数
+
+        Args:
+            q: 0 到 1 之间的分位
+
+        Returns:
+            float: 包含该分位的桶的上界，最后一个桶返回观测到的最大值
+        """
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                if cumulative >= target:
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _Family:
+    """同名指标在不同标签下的集合"""
+
+    def __init__(self, name: str, kind: str, help_text: str, factory):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self._factory = factory
+        self._children: Dict[LabelKey, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._factory()
+            return child
+
+    def items(self) -> List[Tuple[LabelKey, object]]:
+        with self._lock:
+            return list(self._children.items())
+
+
+class MetricsRegistry:
+    """
+    线程安全的指标注册表
+
+    各模块通过全局实例 metrics 记录计数器、直方图和瞬时值，
+    运行结束时或定期导出为 JSON 摘要或 Prometheus 文本格式。
+    """
+
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+
+    def _family(self, name: str, kind: str, help_text: str, factory) -> _Family:
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = _Family(name, kind, help_text, factory)
+            elif family.kind != kind:
+                raise ValueError(f"指标 {name} 已注册为 {family.kind}")
+            return family
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        """获取（必要时创建）计数器"""
+        return self._family(name, "counter", help_text, Counter).labels(**labels)
+
+    def gauge(self, name: str, help_text: str = "", **labels) -> Gauge:
+        """获取（必要时创建）瞬时值"""
+        return self._family(name, "gauge", help_text, Gauge).labels(**labels)
+
+    def histogram(self, name: str, help_text: str = "",
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> Histogram:
+        """获取（必要时创建）直方图，同名直方图使用首次注册时的分桶"""
+        return self._family(name, "histogram", help_text, lambda: Histogram(buckets)).labels(**labels)
+
+    @contextmanager
+    def timer(self, name: str, help_text: str = "", **labels) -> Iterator[None]:
+        """
+        记录代码块耗时（秒）到直方图
+
+        Args:
+            name: 直方图名称
+            help_text: 指标说明
+            labels: 标签
+        """
+        histogram = self.histogram(name, help_text, **labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def clear(self):
+        """清空全部指标"""
+        with self._lock:
+            self._families.clear()
+
+    def _sorted_families(self) -> List[_Family]:
+        with self._lock:
+            return [self._families[name] for name in sorted(self._families)]
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """
+        导出 JSON 摘要
+
+        Returns:
+            Dict: 指标名 -> {类型, 说明, 各标签组合的取值}
+        """
+        summary = {}
+        for family in self._sorted_families():
+            values = []
+            for key, child in family.items():
+                entry = {"labels": dict(key)}
+                if family.kind == "histogram":
+                    entry.update(child.snapshot())
+                else:
+                    entry["value"] = child.value
+                values.append(entry)
+            summary[family.name] = {"type": family.kind, "help": family.help, "values": values}
+        return summary
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """导出 Prometheus 文本格式"""
+        lines = []
+        for family in self._sorted_families():
+            if family.help:
+                lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, child in sorted(family.items(), key=lambda item: item[0]):
+                if family.kind != "histogram":
+                    lines.append(f"{family.name}{_format_labels(key)} {_format_value(child.value)}")
+                    continue
+                with child._lock:
+                    counts, total, count = list(child.counts), child.sum, child.count
+                cumulative = 0
+                for bound, bucket_count in zip(child.buckets, counts):
+                    cumulative += bucket_count
+                    le = ("le", _format_value(float(bound)))
+                    lines.append(f"{family.name}_bucket{_format_labels(key, le)} {cumulative}")
+                lines.append(f"{family.name}_sum{_format_labels(key)} {_format_value(total)}")
+                lines.append(f"{family.name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        """把当前指标写入文件，先写临时文件再替换，读取方不会看到写了一半的内容"""
+        for path, text in ((json_path, self.to_json), (prometheus_path, self.to_prometheus)):
+            if not path:
+                continue
+            path = Path(path)
+            tmp_path = path.with_name(path.name + ".tmp")
+            tmp_path.write_text(text(), encoding="utf-8")
+            tmp_path.replace(path)
+
+
+class MetricsReporter:
+    """定期把指标写入文件的后台线程，停止时再写入一次最终结果"""
+
+    def __init__(self, registry: MetricsRegistry, interval: float,
+                 json_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        """
+        Args:
+            registry: 指标注册表
+            interval: 写入间隔秒数
+            json_path: JSON 摘要文件路径
+            prometheus_path: Prometheus 文本文件路径（可供 node_exporter textfile 收集）
+        """
+        self.registry = registry
+        self.interval = interval
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.registry.write(self.json_path, self.prometheus_path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.registry.write(self.json_path, self.prometheus_path)
+
+
+# 全局指标注册表
+metrics = MetricsRegistry()
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Iterable, Optional
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """在任意长度为 period 秒的时间窗口内最多允许 limit 次请求"""
+    limit: int
+    period: float
+
+
+@dataclass(eq=False)
+class Slot:
+    """一次获取到的配额，退还时需要交回同一个对象"""
+    time: float
+
+
+class RateLimiter:
+    """
+    线程安全的滑动窗口限速器
+
+    记录每次获取配额的时间戳，同时满足所有 RateLimit 策略时才放行，
+    不存在固定窗口在边界处允许两倍突发的问题。可以在多个线程以及
+    asyncio 任务之间共享同一个实例。
+    """
+
+    def __init__(self, limits: Iterable[RateLimit] = (),
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            limits: 限速策略，为空时不限速
+            clock: 时间函数，便于测试时替换
+        """
+        self.limits = tuple(limits)
+        self._clock = clock
+        self._max_period = max((rule.period for rule in self.limits), default=0)
+        self._history: Deque[Slot] = deque()
+        self._cond = threading.Condition()
+
+    def _prune(self, now: float):
+        while self._history and now - self._history[0].time >= self._max_period:
+            self._history.popleft()
+
+    def _wait_time(self, now: float) -> float:
+        """计算距离下一个可用配额的秒数，调用方需持有锁"""
+        self._prune(now)
+        wait = 0.0
+        for rule in self.limits:
+            if len(self._history) < rule.limit:
+                continue
+            # 窗口内第 limit 新的请求过期后才会空出配额
+            oldest_in_window = self._history[-rule.limit].time
+            wait = max(wait, oldest_in_window + rule.period - now)
+        return max(wait, 0.0)
+
+    def time_until_available(self) -> float:
+        """距离下一个可用配额的秒数，0 表示当前即可获取"""
+        with self._cond:
+            return self._wait_time(self._clock())
+
+    def _take(self, now: float) -> Slot:
+        slot = Slot(now)
+        self._history.append(slot)
+        return slot
+
+    def try_acquire(self) -> Optional[Slot]:
+        """尝试立即获取一个配额，不等待；没有配额时返回 None"""
+        with self._cond:
+            now = self._clock()
+            if self._wait_time(now) > 0:
+                return None
+            return self._take(now)
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[Slot]:
+        """
+        获取一个配额，必要时等待
+
+        Args:
+            timeout: 最长等待秒数，None 表示一直等待
+
+        Returns:
+            Optional[Slot]: 获取到的配额，退还时传给 refund；超时返回 None
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._cond:
+            while True:
+                now = self._clock()
+                wait = self._wait_time(now)
+                if wait <= 0:
+                    return self._take(now)
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait, deadline - now)
+                # 使用条件变量等待，退还配额时可以提前唤醒
+                self._cond.wait(wait)
+
+    async def acquire_async(self) -> Slot:
+        """在 asyncio 任务中获取一个配额，等待期间不阻塞事件循环"""
+        while True:
+            slot = self.try_acquire()
+            if slot:
+                return slot
+            await asyncio.sleep(self.time_until_available())
+
+    def refund(self, slot: Slot):
+        """
+        退还一次获取的配额，用于请求没有发出的情况
+
+        Args:
+            slot: acquire 返回的配额；其他线程在此之后获取的配额不受影响
+        """
+        with self._cond:
+            try:
+                self._history.remove(slot)
+            except ValueError:
+                # 已经移出时间窗口，无需退还
+                pass
+            self._cond.notify_all()